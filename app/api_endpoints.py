@@ -1,21 +1,98 @@
+import asyncio
 import json
+import logging
 import os
-from fastapi import FastAPI, HTTPException, Depends, status
-from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import create_engine
-from typing import List
-from datetime import date
+from collections import namedtuple
+from contextlib import aclosing, asynccontextmanager
+import anyio.to_thread
+from fastapi import Body, FastAPI, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import column, delete, exists, func, insert, select, table, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+from typing import Any, Dict, List, Optional
+from datetime import date, datetime, timezone
 import models_sqlalchemy as models
 import models_pydantic as schemas
-from utils import clean_llm_output, get_completion, setup_llm_client
+from database import IN_MEMORY_DATABASE, SessionLocal, engine, read_engine, get_db, get_read_db
+from utils import (
+    clean_llm_output, completion_observers, get_completion_async, get_completion_stream_async, llm_clients,
+)
+import metrics
+import query_stats
+from catalog import catalog_version
+from llm_resilience import ResilientLLM
+from prompts import RecommendationPrompt, RecommendationPromptBuilder
+from recommendation_cache import RecommendationCache, SingleFlight
+from recommendation_worker import RecommendationWorker
+from recommender import CandidateIndex, TermMatrixEngine, interest_terms, retrieval_terms
+from sse import SSE_HEADERS, SSE_MEDIA_TYPE, IncrementalIdParser, sse_event
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import ValidationError
+from fast_responses import CompressionMiddleware, FastJSONResponse, dumps
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_MODEL = "gpt-4.1-mini"
+RECOMMENDATION_TEMPERATURE = 0.5
+# Only the best-matching properties are sent to the LLM, keeping the prompt size constant
+RECOMMENDATION_CANDIDATES = int(os.getenv("RECOMMENDATION_CANDIDATES", "50"))
+# Token budget for the catalog block every prompt starts with (see prompts.py)
+RECOMMENDATION_SHARED_TOKENS = int(os.getenv("RECOMMENDATION_SHARED_TOKENS", "2048"))
+# Alternate models (keys of utils.RECOMMENDED_MODELS) for retries and hedged
+# requests, comma-separated; without any, hedges go to RECOMMENDATION_MODEL again
+RECOMMENDATION_FALLBACK_MODELS = [
+    m.strip() for m in os.getenv("RECOMMENDATION_FALLBACK_MODELS", "").split(",") if m.strip()
+]
+# Deadlines, retries, hedging and per-provider circuit breakers for LLM calls
+llm_resilience = ResilientLLM.from_env()
+
+recommendation_cache = RecommendationCache(
+    maxsize=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RECOMMENDATION_CACHE_TTL", "3600")),
+)
+# Concurrent misses for the same cache key wait on one LLM call
+recommendation_flight = SingleFlight()
 
-DATABASE_URL = models.DATABASE_URL
+# In-process term-matrix engine for ?engine=local and LLM fallback
+local_engine = TermMatrixEngine()
+# Keyword index that picks the LLM's candidates (same scores as recommender.retrieve_candidates)
+candidate_index = CandidateIndex()
+# Both are built from one catalog scan on first use and patched on every property write
+catalog_indexes = (local_engine, candidate_index)
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def index_property(prop):
+    for index in catalog_indexes:
+        if index.loaded:
+            index.upsert(prop)
 
-app = FastAPI()
+# ---------- Metrics and per-request query stats ----------
+metrics.register_cache(recommendation_cache)
+metrics.register_single_flight(recommendation_flight)
+metrics.register_llm_resilience(llm_resilience)
+metrics.instrument_engine(engine)
+metrics.instrument_engine(read_engine)
+query_stats.instrument_engine(engine)
+query_stats.instrument_engine(read_engine)
+completion_observers.append(metrics.observe_completion)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as conn:
+        await conn.run_sync(models.init_db)
+    # Build the LLM client before the first recommendation request arrives
+    await llm_clients.warm_async([RECOMMENDATION_MODEL, *RECOMMENDATION_FALLBACK_MODELS])
+    if IN_MEMORY_DATABASE:
+        # The worker's sessions would interleave with request sessions on the
+        # one shared connection; rankings are then computed on demand only
+        logger.warning("In-memory database: the recommendation refresh worker is not started")
+    else:
+        recommendation_worker.start()
+    yield
+    await recommendation_worker.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,26 +100,235 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "ETag", "X-Next-Cursor", "X-DB-Queries", "X-DB-Time", "X-Prompt-Tokens",
+        "X-Recommendations-Source", "X-Recommendations-Computed-At",
+    ],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(query_stats.QueryStatsMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 
-# Dependency to get a DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+# Dependency to get the shared (asyncio) LLM client for recommendations
+def get_llm_client():
+    return llm_clients.get(RECOMMENDATION_MODEL, asynchronous=True)
+
+def llm_targets(llm) -> list:
+    """The request's client first, then every fallback model whose client could be built."""
+    fallbacks = (llm_clients.get(model, asynchronous=True) for model in RECOMMENDATION_FALLBACK_MODELS)
+    return [llm] + [target for target in fallbacks if target[0] is not None and target != llm]
 
 # ---------- Utility Functions ----------
-def list_to_comma_string(lst):
-    if lst is None:
-        return None
-    return ",".join([v.strip() for v in lst if v.strip()])
+# Keyset pagination: return up to `limit` rows with id > `after`, ordered by id.
+# The id to pass as `after` for the next page is sent in the X-Next-Cursor header.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+async def paginate(db: AsyncSession, query, model, limit: int, after: Optional[int], response: Response):
+    if after is not None:
+        query = query.filter(model.id > after)
+    rows = (await db.scalars(query.order_by(model.id).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    return rows
+
+# NDJSON export: when the client sends Accept: application/x-ndjson, list
+# endpoints stream one JSON object per line straight from a server-side cursor
+# instead of materializing the whole result. `limit` is optional in this mode.
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_BATCH_SIZE = 1000
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def stream_ndjson(db: AsyncSession, query, model, limit: Optional[int], after: Optional[int], to_dict, headers=None):
+    if after is not None:
+        query = query.filter(model.id > after)
+    query = query.order_by(model.id)
+    if limit is not None:
+        query = query.limit(limit)
+
+    async def generate():
+        lines = []
+        rows = await db.stream_scalars(query.execution_options(yield_per=NDJSON_BATCH_SIZE))
+        async for row in rows:
+            lines.append(dumps(to_dict(row)))
+            if len(lines) >= NDJSON_BATCH_SIZE:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+# Fast path for list endpoints: rows are mapped straight to dicts and encoded
+# with orjson. The rows come from the database through the same columns the
+# response models describe, so FastAPI's response_model validation is skipped;
+# response_model is kept for the OpenAPI schema.
+def fast_json(rows, to_dict, response: Response) -> FastJSONResponse:
+    # Headers set on the injected Response (X-Next-Cursor, ETag) are not copied
+    # over automatically when an endpoint returns its own Response
+    return FastJSONResponse([to_dict(row) for row in rows], headers=dict(response.headers))
+
+def user_to_dict(u) -> dict:
+    return {
+        "id": u.id,
+        "name": u.name,
+        "email": u.email,
+        "interests": u.interests,
+    }
 
-def comma_string_to_list(s):
-    if s is None or s.strip() == "":
+def property_to_dict(p) -> dict:
+    return {
+        "id": p.id,
+        "name": p.name,
+        "address_line1": p.address_line1,
+        "address_line2": p.address_line2,
+        "city": p.city,
+        "state": p.state,
+        "zip_code": p.zip_code,
+        "country": p.country,
+        "price_per_night": p.price_per_night,
+        "amenities": p.amenities,
+    }
+
+def reservation_to_dict(r) -> dict:
+    return {
+        "id": r.id,
+        "user_id": r.user_id,
+        "property_id": r.property_id,
+        "check_in_date": r.check_in_date.isoformat(),
+        "check_out_date": r.check_out_date.isoformat(),
+        "reservation_date": r.reservation_date.isoformat(),
+    }
+
+# Bulk create: every item is validated on its own with the regular *Create
+# model, valid rows are inserted with one executemany in a single transaction,
+# and invalid ones are reported by index instead of failing the whole batch.
+MAX_BULK_ITEMS = 10000
+
+def validate_bulk_items(items, model, errors):
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ITEMS} items per request")
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, model(**item)))
+        except (ValidationError, TypeError) as e:
+            detail = json.loads(e.json()) if isinstance(e, ValidationError) else str(e)
+            errors.append(schemas.BulkItemError(index=index, detail=detail))
+    return valid
+
+async def lock_sqlite_writes(db: AsyncSession) -> bool:
+    """On SQLite, take the database write lock now (BEGIN IMMEDIATE) instead of at the first write.
+
+    Must run before any other statement of the transaction. Returns whether the
+    backend is SQLite.
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        return False
+    connection = await db.connection()
+    driver_connection = (await connection.get_raw_connection()).driver_connection
+    if not driver_connection.in_transaction:
+        await db.execute(text("BEGIN IMMEDIATE"))
+    return True
+
+SQLITE_MASTER = table("sqlite_master", column("name"))
+
+async def bulk_insert_ids(db: AsyncSession, model, rows) -> list:
+    """executemany INSERT returning the new ids in input order.
+
+    SQLite cannot order RETURNING rows, so SQLAlchemy would send one INSERT per
+    row there. Instead the ids are assigned from MAX(id) under the write lock
+    and the rows go out in a single executemany. That is the rowid SQLite picks
+    itself for a table without AUTOINCREMENT (so ids of deleted trailing rows
+    are reused either way). Tables created with AUTOINCREMENT, as in the
+    original travel.db, also start past their sqlite_sequence entry, which
+    SQLite moves up to the explicit ids inserted.
+    """
+    if not rows:
         return []
-    return [v.strip() for v in s.split(",") if v.strip()]
+    if await lock_sqlite_writes(db):
+        has_sequence = exists().where(SQLITE_MASTER.c.name == "sqlite_sequence")
+        last_id, sequenced = (await db.execute(select(func.max(model.id), has_sequence))).one()
+        last_id = last_id or 0
+        if sequenced:
+            sequence = await db.scalar(
+                text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": model.__tablename__}
+            )
+            last_id = max(last_id, sequence or 0)
+        ids = list(range(last_id + 1, last_id + 1 + len(rows)))
+        await db.execute(insert(model), [dict(row, id=row_id) for row, row_id in zip(rows, ids)])
+        return ids
+    result = await db.execute(insert(model).returning(model.id, sort_by_parameter_order=True), rows)
+    return [row.id for row in result]
+
+async def bulk_insert_tag_links(db: AsyncSession, tag_model, link_model, owner_key, tag_key, owner_tags):
+    """Link freshly inserted rows to their tags: owner_tags is [(owner_id, [names])]."""
+    all_names = [name for _, names in owner_tags for name in names]
+    tags = {t.name: t for t in await db.run_sync(models.get_or_create_tags, tag_model, all_names)}
+    await db.flush()
+    links = [
+        {owner_key: owner_id, tag_key: tags[name].id, "position": position}
+        for owner_id, names in owner_tags
+        for position, name in enumerate(names)
+    ]
+    if links:
+        await db.execute(insert(link_model), links)
+
+# Conditional GET for the property catalog. The ETag is derived from the
+# catalog version stored in the database (see catalog.py) plus the path, query
+# string and Accept header, so it costs one primary-key read whichever process
+# last wrote the catalog. A matching If-None-Match is answered with 304 before
+# the endpoint runs; `If-None-Match: *` means "if the item exists", so on
+# single-item routes it is left to the endpoint. The tag is weak since
+# CompressionMiddleware may encode the body differently per client.
+PROPERTIES_CACHE_CONTROL = os.getenv("PROPERTIES_CACHE_CONTROL", "no-cache")
+
+async def bump_catalog_version(db: AsyncSession):
+    """Increment the stored catalog version in db's transaction; call catalog_version.observe after the commit."""
+    catalog_state = await db.run_sync(models.bump_catalog_version)
+    catalog_version.expect(*catalog_state)
+    return catalog_state
+
+async def sync_catalog_version(db: AsyncSession):
+    """Pick up the stored catalog version, dropping the in-memory indexes if another process changed the catalog."""
+    if catalog_version.observe(*await db.run_sync(models.read_catalog_state)):
+        logger.info("The catalog changed outside this process, reloading the catalog indexes on next use")
+        for index in catalog_indexes:
+            index.clear()
+
+def _opaque_tag(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+def _if_none_match_tags(request: Request) -> list:
+    return [tag.strip() for tag in request.headers.get("if-none-match", "").split(",") if tag.strip()]
+
+def _etag_matches(tags, etag: str) -> bool:
+    # If-None-Match uses the weak comparison
+    return _opaque_tag(etag) in (_opaque_tag(tag) for tag in tags)
+
+async def _catalog_etag(request: Request, response: Response, db: AsyncSession, match_any: bool):
+    await sync_catalog_version(db)
+    etag = catalog_version.etag(request.url.path, request.url.query, request.headers.get("accept", ""))
+    headers = {"ETag": etag, "Cache-Control": PROPERTIES_CACHE_CONTROL, "Vary": "Accept, Accept-Encoding"}
+    tags = _if_none_match_tags(request)
+    if _etag_matches(tags, etag) or (match_any and "*" in tags):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return headers
+
+async def catalog_etag(request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    return await _catalog_etag(request, response, db, match_any=True)
+
+async def catalog_item_etag(request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    """catalog_etag for single-item routes, which answer `If-None-Match: *` themselves."""
+    return await _catalog_etag(request, response, db, match_any=False)
 
 # Validate e-mail format
 def is_valid_email(email: str) -> bool:
@@ -56,61 +342,105 @@ def normalize_email(email: str) -> str:
 
 # ---------- User Endpoints ----------
 @app.post("/users/", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    # The email probe and get_or_create_tags' probe for new interests must not
+    # race another request inserting the same rows
+    await lock_sqlite_writes(db)
     email = normalize_email(user.email)
     if not is_valid_email(email):
         raise HTTPException(status_code=400, detail="Invalid email format")
-    db_user = db.query(models.User).filter(models.User.email == email).first()
+    db_user = await db.scalar(select(models.User).filter(models.User.email == email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     db_user = models.User(
         name=user.name,
-        email=email,
-        interests=list_to_comma_string(user.interests)
+        email=email
     )
+    await db.run_sync(models.set_user_interests, db_user, user.interests)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    recommendation_worker.enqueue(db_user.id)
     resp = schemas.UserResponse(
         id=db_user.id,
         name=db_user.name,
         email=db_user.email,
-        interests=comma_string_to_list(db_user.interests)
+        interests=db_user.interests
     )
     return resp
 
-@app.get("/users/", response_model=List[schemas.UserResponse])
-def list_users(db: Session = Depends(get_db)):
-    users = db.query(models.User).all()
-    return [
-        schemas.UserResponse(
-            id=u.id,
-            name=u.name,
-            email=u.email,
-            interests=comma_string_to_list(u.interests)
-        )
-        for u in users
+@app.post("/users/bulk", response_model=schemas.UserBulkResponse)
+async def create_users_bulk(items: List[Dict[str, Any]] = Body(...), db: AsyncSession = Depends(get_db)):
+    # The email probe and the id assignment in bulk_insert_ids share one write lock
+    await lock_sqlite_writes(db)
+    errors = []
+    candidates = []
+    for index, user in validate_bulk_items(items, schemas.UserCreate, errors):
+        email = normalize_email(user.email)
+        if not is_valid_email(email):
+            errors.append(schemas.BulkItemError(index=index, detail="Invalid email format"))
+        else:
+            candidates.append((index, user, email))
+    # One IN query for emails that already exist, plus duplicates inside the batch
+    taken = set(await db.scalars(
+        select(models.User.email).filter(models.User.email.in_([email for _, _, email in candidates]))
+    ))
+    valid = []
+    for index, user, email in candidates:
+        if email in taken:
+            errors.append(schemas.BulkItemError(index=index, detail="Email already registered"))
+            continue
+        taken.add(email)
+        valid.append((user, email, models.clean_tag_names(user.interests)))
+    ids = await bulk_insert_ids(db, models.User, [{"name": user.name, "email": email} for user, email, _ in valid])
+    await bulk_insert_tag_links(
+        db, models.Interest, models.UserInterest, "user_id", "interest_id",
+        [(user_id, interests) for user_id, (_, _, interests) in zip(ids, valid)],
+    )
+    await db.commit()
+    recommendation_worker.enqueue(*ids)
+    created = [
+        schemas.UserResponse(id=user_id, name=user.name, email=email, interests=interests)
+        for user_id, (user, email, interests) in zip(ids, valid)
     ]
+    return schemas.UserBulkResponse(created=created, errors=sorted(errors, key=lambda e: e.index))
+
+@app.get("/users/", response_model=List[schemas.UserResponse])
+async def list_users(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    query = select(models.User)
+    if wants_ndjson(request):
+        return stream_ndjson(db, query, models.User, limit, after, user_to_dict)
+    users = await paginate(db, query, models.User, limit or DEFAULT_PAGE_SIZE, after, response)
+    return fast_json(users, user_to_dict, response)
 
 @app.get("/users/{user_id}", response_model=schemas.UserResponse)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user(user_id: int, db: AsyncSession = Depends(get_read_db)):
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return schemas.UserResponse(
         id=user.id,
         name=user.name,
         email=user.email,
-        interests=comma_string_to_list(user.interests)
+        interests=user.interests
     )
 
 @app.put("/users/{user_id}", response_model=schemas.UserResponse)
-def update_user(user_id: int, user_update: schemas.UserUpdate, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def update_user(user_id: int, user_update: schemas.UserUpdate, db: AsyncSession = Depends(get_db)):
+    if user_update.email is not None or user_update.interests is not None:
+        await lock_sqlite_writes(db)
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if user_update.email:
-        existing = db.query(models.User).filter(models.User.email == user_update.email, models.User.id != user_id).first()
+        existing = await db.scalar(
+            select(models.User).filter(models.User.email == user_update.email, models.User.id != user_id)
+        )
         if existing:
             raise HTTPException(status_code=400, detail="Email already registered by another user")
     if user_update.name is not None:
@@ -120,98 +450,464 @@ def update_user(user_id: int, user_update: schemas.UserUpdate, db: Session = Dep
         if not is_valid_email(email):
             raise HTTPException(status_code=400, detail="Invalid email format")
         user.email = email
+    old_interests = user.interests
     if user_update.interests is not None:
-        user.interests = list_to_comma_string(user_update.interests)
-    db.commit()
-    db.refresh(user)
+        await db.run_sync(models.set_user_interests, user, user_update.interests)
+    interests_changed = user.interests != old_interests
+    if interests_changed:
+        # The stored ranking was for the old interests; serve inline until refreshed
+        await db.execute(delete(models.UserRecommendation).filter(models.UserRecommendation.user_id == user_id))
+    await db.commit()
+    if interests_changed:
+        recommendation_cache.invalidate_interests(old_interests)
+        recommendation_worker.enqueue(user_id)
     return schemas.UserResponse(
         id=user.id,
         name=user.name,
         email=user.email,
-        interests=comma_string_to_list(user.interests)
+        interests=user.interests
     )
 
 @app.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    db.delete(user)
-    db.commit()
+    await db.execute(delete(models.UserRecommendation).filter(models.UserRecommendation.user_id == user_id))
+    await db.delete(user)
+    await db.commit()
     return
 
 # ---------- Given a User, invoke an LLM to suggest vacation properties ----------
-@app.get("/users/{user_id}/properties", response_model=List[schemas.PropertyResponse])
-def get_user_properties(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    props = db.query(models.Property).all()
-    
-    user_interests = user.interests
-    city_state_list = [
-    {
-        "id": prop.id,
-        "name": prop.name,
-        "city": prop.city,
-        "state": prop.state,
-        "amenities": prop.amenities
+# Compact, cache-friendly prompt (see prompts.py). Token counts per part are
+# logged, sent in the X-Prompt-Tokens header and exported on /metrics.
+recommendation_prompts = RecommendationPromptBuilder(
+    model_name=RECOMMENDATION_MODEL, shared_tokens=RECOMMENDATION_SHARED_TOKENS
+)
+
+def build_recommendation_prompt(user, props) -> RecommendationPrompt:
+    prompt = recommendation_prompts.build(user.interests, props, catalog_version.value)
+    logger.info("The user has interests: %s", user.interests)
+    logger.info("Sending %d candidate properties to the LLM, prompt tokens: %s", len(props), prompt.tokens)
+    metrics.observe_prompt(prompt.tokens)
+    return prompt
+
+async def recommend_property_ids(prompt: str, llm):
+    """Ask the LLM which of the properties in the prompt best match the user's interests."""
+    property_ids = await llm_resilience.complete(
+        prompt, llm_targets(llm), get_completion_async, temperature=RECOMMENDATION_TEMPERATURE
+    )
+    logger.info("The LLM returned the following: %s", property_ids)
+    property_ids = clean_llm_output(property_ids, "json")
+    property_ids = json.loads(property_ids)
+    if not isinstance(property_ids, list):
+        raise TypeError("expected a JSON array of property ids")
+    # Keep the LLM's ranking, dropping repeats
+    return list(dict.fromkeys(int(pid) for pid in property_ids))
+
+
+async def _load_properties(db: AsyncSession):
+    return (await db.scalars(select(models.Property))).all()
+
+async def _properties_by_id(db: AsyncSession, property_ids) -> dict:
+    """One IN query for the given ids."""
+    if not property_ids:
+        return {}
+    return {
+        prop.id: prop
+        for prop in await db.scalars(select(models.Property).filter(models.Property.id.in_(property_ids)))
     }
-    for prop in props
+
+async def load_catalog_indexes(db: AsyncSession):
+    """Build the local engine and candidate index on first use, tokenizing in a worker thread.
+
+    Catalog writes made by other processes are not applied incrementally; when
+    the stored catalog version shows one, the indexes are rebuilt.
+    """
+    await sync_catalog_version(db)
+    if all(index.loaded for index in catalog_indexes):
+        return
+    version = catalog_version.value
+    props = await _load_properties(db)
+
+    def build():
+        for index in catalog_indexes:
+            index.load(props)
+
+    await anyio.to_thread.run_sync(build)
+    if catalog_version.value != version:
+        # A property write landed mid-scan and was not applied; rebuild on next use
+        for index in catalog_indexes:
+            index.clear()
+
+async def _hydrate_properties(db: AsyncSession, property_ids, loaded=()):
+    """Build responses for the ranked ids, in order.
+
+    Rows already loaded by the caller are reused; anything else is fetched with a
+    single IN query. Ids that do not exist are logged and skipped.
+    """
+    by_id = {prop.id: prop for prop in loaded}
+    by_id.update(await _properties_by_id(db, [pid for pid in property_ids if pid not in by_id]))
+    unknown = [pid for pid in property_ids if pid not in by_id]
+    if unknown:
+        logger.warning("Recommendations referenced unknown property ids: %s", unknown)
+    return [
+        schemas.PropertyResponse(
+            id=prop.id,
+            name=prop.name,
+            address_line1=prop.address_line1,
+            address_line2=prop.address_line2,
+            city=prop.city,
+            state=prop.state,
+            zip_code=prop.zip_code,
+            country=prop.country,
+            price_per_night=prop.price_per_night,
+            amenities=prop.amenities
+        )
+        for prop in (by_id[pid] for pid in property_ids if pid in by_id)
     ]
 
-    print("The user has interests: {}".format(user.interests))
-    print("There are {} properties in the database".format(len(city_state_list)))
+async def recommend_locally(user, db: AsyncSession):
+    """Rank properties with the in-process term matrix, loading it on first use."""
+    await load_catalog_indexes(db)
+    return local_engine.recommend(user.interests)
 
-    user_recommendations_prompt = f"""
-    You are a travel agent.
-    You will be given a set of user interests as well as a detailed list of vacation property locations.
-    The property locations include the id, name, city, state, and amenities.
-    Recommend a list of properties that align with the user's interests.
-    Base your recommendation on the city of the property and what activities are popular there.
-    Try to spread your recommendations across different interests and locations, and consider all properties in the list.
-    Also, favor unusual destinations that are not too touristy.
+async def load_candidates(user, db: AsyncSession, extra_ids=()):
+    """The user's top RECOMMENDATION_CANDIDATES properties from the index, best first.
 
-    The user's interests are: {user_interests}
-    The list of property locations is: {city_state_list}
+    Only those rows (plus extra_ids, if any) are fetched, with a single IN query.
+    The first time per catalog version that query also fetches the rows of the
+    prompts' shared catalog block. Returns (candidates, rows by id).
+    """
+    await load_catalog_indexes(db)
+    version = catalog_version.value
+    candidate_ids = candidate_index.candidates(user.interests, RECOMMENDATION_CANDIDATES)
+    shared_ids = []
+    if recommendation_prompts.needs_shared(version):
+        shared_ids = candidate_index.first_ids(recommendation_prompts.shared_limit)
+    by_id = await _properties_by_id(db, list(dict.fromkeys([*candidate_ids, *extra_ids, *shared_ids])))
+    if shared_ids:
+        recommendation_prompts.set_shared([by_id[pid] for pid in shared_ids if pid in by_id], version)
+    return [by_id[pid] for pid in candidate_ids if pid in by_id], by_id
+
+def recommendation_key(user):
+    return recommendation_cache.make_key(
+        user.interests, catalog_version.value, RECOMMENDATION_MODEL, RECOMMENDATION_TEMPERATURE
+    )
+
+# property_ids best first; source is "llm" or "local"; props are the rows
+# already loaded (the candidates), for hydrating without another query
+Ranking = namedtuple("Ranking", ["property_ids", "source", "prompt", "props"])
+
+async def rank_properties(user, db: AsyncSession, llm, cache_key) -> Ranking:
+    """LLM ranking of the user's candidates, or the local engine's if the LLM fails.
 
-    Your response should be the list of property ids in JSON format (a JSON array of integers).
-    Do not include anything else in your response, and do not repeat property ids.
-    Return no more than 5 property ids.
+    Only LLM rankings are cached.
     """
-    project_root = os.path.abspath(os.path.join(os.getcwd(), '..'))
-    client, model_name, api_provider = setup_llm_client(model_name="gpt-4.1-mini")
-    property_ids = get_completion(user_recommendations_prompt, client, model_name, api_provider, temperature=0.5)
-    print("The LLM returned the following: {}".format(property_ids))
-    property_ids = clean_llm_output(property_ids, "json")
-    property_ids = json.loads(property_ids)
-    property_ids = sorted(set(property_ids))
-
-    print("The LLM recommended the following property ids: {}".format(property_ids))
-
-    responses = []
-    for pid in property_ids:
-        prop = db.query(models.Property).filter(models.Property.id == pid).first()
-        if prop:
-            resp = schemas.PropertyResponse(
-                id=prop.id,
-                name=prop.name,
-                address_line1=prop.address_line1,
-                address_line2=prop.address_line2,
-                city=prop.city,
-                state=prop.state,
-                zip_code=prop.zip_code,
-                country=prop.country,
-                price_per_night=prop.price_per_night,
-                amenities=comma_string_to_list(prop.amenities)
+    candidates, _ = await load_candidates(user, db)
+    prompt = build_recommendation_prompt(user, candidates)
+    # Nothing was written; end the read transaction so the connection is not
+    # left idle in a transaction for the whole LLM call
+    await db.commit()
+    try:
+        # Candidates depend only on the interests and catalog version, which
+        # are part of the key, so every caller would send the same prompt
+        property_ids = await recommendation_flight.do(
+            cache_key, lambda: recommend_property_ids(prompt.text, llm)
+        )
+    except (ValueError, TypeError) as e:
+        # The LLM is down or returned something unusable; fall back to the
+        # local engine without caching its answer under the LLM key.
+        logger.warning("LLM recommendation failed (%s), using the local engine", e)
+        return Ranking(local_engine.recommend(user.interests), "local", prompt, candidates)
+    recommendation_cache.set(cache_key, property_ids)
+    return Ranking(property_ids, "llm", prompt, candidates)
+
+# ---------- Precomputed recommendations ----------
+# LLM rankings are stored in UserRecommendations by a background worker (see
+# recommendation_worker.py), so /users/{user_id}/properties usually answers
+# with one indexed query and no LLM call. New users and interest changes
+# enqueue refreshes; a catalog write refreshes only the users with an interest
+# matching a search term of the properties it touched, since nobody else's
+# candidates can change (beyond the unmatched padding of sparse interest sets).
+# Rows keep the last successful LLM ranking: when the LLM fails, the local
+# engine's answer is served but not stored.
+#
+# RECOMMENDATION_REFRESH_CONCURRENCY  batches refreshed at once
+# RECOMMENDATION_REFRESH_BATCH        users per batch (one LLM call per distinct interest set)
+# RECOMMENDATION_REFRESH_DELAY        seconds between a catalog write and the refresh of the users it affects
+#
+# Rankings are stored in short write transactions of their own, one per
+# interest set, that take the SQLite write lock up front like the booking and
+# bulk handlers do (lock_sqlite_writes); a
+# store that still finds the database locked after busy_timeout is retried
+# after each of RECOMMENDATION_STORE_RETRY_DELAYS (seconds).
+RecommendationSession = SessionLocal
+RECOMMENDATION_STORE_RETRY_DELAYS = (0.1, 0.5, 2.0)
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def set_recommendation_headers(response: Response, source: str, computed_at=None):
+    response.headers["X-Recommendations-Source"] = source
+    if computed_at is not None:
+        response.headers["X-Recommendations-Computed-At"] = computed_at.isoformat(timespec="seconds") + "Z"
+
+def background_llm_client():
+    """get_llm_client for work outside a request, honoring dependency overrides."""
+    return app.dependency_overrides.get(get_llm_client, get_llm_client)()
+
+async def store_recommendations(db: AsyncSession, rankings: Dict[int, List[int]], computed_at: datetime):
+    """Replace the stored rankings of the given users (not committed)."""
+    await db.execute(
+        delete(models.UserRecommendation).filter(models.UserRecommendation.user_id.in_(list(rankings)))
+    )
+    rows = [
+        {"user_id": user_id, "rank": rank, "property_id": property_id, "computed_at": computed_at}
+        for user_id, property_ids in rankings.items()
+        for rank, property_id in enumerate(property_ids)
+    ]
+    if rows:
+        await db.execute(insert(models.UserRecommendation), rows)
+
+def is_database_locked(error: OperationalError) -> bool:
+    return "database is locked" in str(error.orig)
+
+async def save_recommendations(rankings: Dict[int, List[int]], computed_at: datetime):
+    """Store rankings in one short write transaction, retrying while the database is locked."""
+    for delay in (*RECOMMENDATION_STORE_RETRY_DELAYS, None):
+        try:
+            async with RecommendationSession() as db:
+                await lock_sqlite_writes(db)
+                await store_recommendations(db, rankings, computed_at)
+                await db.commit()
+            return
+        except OperationalError as e:
+            if delay is None or not is_database_locked(e):
+                raise
+            logger.warning("Database locked while storing recommendations, retrying in %ss", delay)
+        await asyncio.sleep(delay)
+
+async def refresh_recommendations(user_ids):
+    """Recompute and store the LLM rankings of a batch of users.
+
+    Reads go through one session; each interest set's ranking is stored as soon
+    as it is known, in a write transaction of its own.
+    """
+    llm = background_llm_client()
+    async with RecommendationSession() as db:
+        users = (await db.scalars(select(models.User).filter(models.User.id.in_(user_ids)))).all()
+        if not users:
+            return
+        await load_catalog_indexes(db)
+        groups = {}
+        for user in users:
+            groups.setdefault(recommendation_key(user), []).append(user)
+        for cache_key, group in groups.items():
+            property_ids = recommendation_cache.get(cache_key)
+            if property_ids is None:
+                ranking = await rank_properties(group[0], db, llm, cache_key)
+                if ranking.source != "llm":
+                    continue
+                property_ids = ranking.property_ids
+            # Drop ids the LLM made up or that were deleted since
+            property_ids = [pid for pid in property_ids if candidate_index.contains(pid)]
+            await save_recommendations({user.id: property_ids for user in group}, utc_now())
+
+async def list_user_ids(after: Optional[int], limit: int, terms=None) -> List[int]:
+    """Ascending user ids; with terms, only users with an interest matching one of them."""
+    async with RecommendationSession() as db:
+        query = select(models.User.id).order_by(models.User.id).limit(limit)
+        if terms is not None:
+            # Interests are a short list of names; match them here, then use the
+            # UserInterests reverse index
+            interest_ids = [
+                interest_id
+                for interest_id, name in await db.execute(select(models.Interest.id, models.Interest.name))
+                if not terms.isdisjoint(interest_terms([name]))
+            ]
+            if not interest_ids:
+                return []
+            query = query.filter(models.User.id.in_(
+                select(models.UserInterest.user_id).filter(models.UserInterest.interest_id.in_(interest_ids))
+            ))
+        if after is not None:
+            query = query.filter(models.User.id > after)
+        return list(await db.scalars(query))
+
+recommendation_worker = RecommendationWorker(
+    refresh_recommendations,
+    list_user_ids,
+    concurrency=int(os.getenv("RECOMMENDATION_REFRESH_CONCURRENCY", "4")),
+    batch_size=int(os.getenv("RECOMMENDATION_REFRESH_BATCH", "50")),
+    catalog_delay=float(os.getenv("RECOMMENDATION_REFRESH_DELAY", "5")),
+)
+metrics.register_recommendation_worker(recommendation_worker)
+
+async def _precomputed_properties(db: AsyncSession, user_id: int):
+    """[(property, computed_at)] in rank order; amenities are joined into the same query."""
+    result = await db.execute(
+        select(models.Property, models.UserRecommendation.computed_at)
+        .join(models.UserRecommendation, models.UserRecommendation.property_id == models.Property.id)
+        .filter(models.UserRecommendation.user_id == user_id)
+        .order_by(models.UserRecommendation.rank)
+        .options(joinedload(models.Property.amenity_links))
+    )
+    return result.unique().all()
+
+# With ?refresh=true the ranking is recomputed inline (skipping the cache) and
+# stored before responding. X-Recommendations-Source says where the answer came
+# from ("precomputed", "cache", "llm" or "local") and, for stored rankings,
+# X-Recommendations-Computed-At when it was computed (UTC).
+@app.get("/users/{user_id}/properties", response_model=List[schemas.PropertyResponse])
+async def get_user_properties(
+    user_id: int,
+    response: Response,
+    ranker: schemas.RecommendationEngine = Query(schemas.RecommendationEngine.llm, alias="engine"),
+    refresh: bool = False,
+    db: AsyncSession = Depends(get_read_db),
+    llm=Depends(get_llm_client),
+):
+    if ranker == schemas.RecommendationEngine.llm and not refresh:
+        # Rows only exist for existing users, so no separate user lookup
+        rows = await _precomputed_properties(db, user_id)
+        if rows:
+            set_recommendation_headers(response, "precomputed", min(computed_at for _, computed_at in rows))
+            props = [prop for prop, _ in rows]
+            return await _hydrate_properties(db, [prop.id for prop in props], props)
+
+    user = await db.get(models.User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if ranker == schemas.RecommendationEngine.local:
+        property_ids = await recommend_locally(user, db)
+        return await _hydrate_properties(db, property_ids)
+
+    cache_key = recommendation_key(user)
+    property_ids = None if refresh else recommendation_cache.get(cache_key)
+    props = ()
+    if property_ids is None:
+        property_ids, source, prompt, props = await rank_properties(user, db, llm, cache_key)
+        response.headers["X-Prompt-Tokens"] = str(prompt.tokens["total"])
+    else:
+        source = "cache"
+        logger.info("Serving cached recommendations for user %s", user.id)
+
+    logger.info("Recommended property ids: %s", property_ids)
+    hydrated = await _hydrate_properties(db, property_ids, props)
+    if refresh and source == "llm":
+        computed_at = utc_now()
+        await save_recommendations({user.id: [prop.id for prop in hydrated]}, computed_at)
+        set_recommendation_headers(response, source, computed_at)
+    else:
+        set_recommendation_headers(response, source)
+        # Nothing stored yet (or the LLM failed); let the worker precompute it
+        recommendation_worker.enqueue(user.id)
+    return hydrated
+
+# Server-sent events variant of get_user_properties: every recommended property
+# is pushed as an `event: property` message as soon as the LLM has written its
+# id, then one `event: done` message says where the ranking came from
+# ("cache", "llm" or "local"). Everything the stream needs is loaded before the
+# response starts, so the generator never touches the session.
+RECOMMENDATION_LIMIT = 5
+
+@app.get("/users/{user_id}/properties/stream")
+async def stream_user_properties(
+    user_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    llm=Depends(get_llm_client),
+):
+    user = await db.get(models.User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    cache_key = recommendation_key(user)
+    property_ids = recommendation_cache.get(cache_key)
+    if property_ids is not None:
+        cached = await _hydrate_properties(db, property_ids)
+
+        async def replay():
+            for prop in cached:
+                yield sse_event("property", prop.model_dump())
+            yield sse_event("done", {"source": "cache", "count": len(cached)})
+
+        return StreamingResponse(replay(), media_type=SSE_MEDIA_TYPE, headers=SSE_HEADERS)
+
+    # The local fallback's rows come with the candidates' IN query, so the
+    # generator never needs the session
+    await load_catalog_indexes(db)
+    fallback_ids = local_engine.recommend(user.interests)
+    candidates, by_id = await load_candidates(user, db, fallback_ids)
+    prompt = build_recommendation_prompt(user, candidates)
+    headers = dict(SSE_HEADERS, **{"X-Prompt-Tokens": str(prompt.tokens["total"])})
+
+    async def generate():
+        sent = []
+
+        def take(ids):
+            events = []
+            for pid in ids:
+                if pid in by_id and pid not in sent and len(sent) < RECOMMENDATION_LIMIT:
+                    sent.append(pid)
+                    events.append(sse_event("property", property_to_dict(by_id[pid])))
+            return events
+
+        parser = IncrementalIdParser()
+        source = "llm"
+        try:
+            completion = llm_resilience.stream(
+                get_completion_stream_async, llm, prompt.text, temperature=RECOMMENDATION_TEMPERATURE
             )
-            responses.append(resp)
-    return responses
+            async with aclosing(completion):
+                async for delta in completion:
+                    for event in take(parser.feed(delta)):
+                        yield event
+                    if parser.done:
+                        break
+            for event in take(parser.close()):
+                yield event
+        except Exception as e:
+            # Provider errors surface mid-stream; finish with the local engine
+            logger.warning("LLM recommendation stream failed (%s), using the local engine", e)
+            source = "local"
+        if source == "llm" and sent:
+            recommendation_cache.set(cache_key, list(sent))
+        else:
+            source = "local"
+            for event in take(fallback_ids):
+                yield event
+        logger.info("Streamed recommended property ids: %s", sent)
+        yield sse_event("done", {"source": source, "count": len(sent)})
+
+    return StreamingResponse(generate(), media_type=SSE_MEDIA_TYPE, headers=headers)
 
 
 # ---------- Property Endpoints ----------
+def filter_properties(query, city=None, state=None, min_price=None, max_price=None, amenity=None):
+    """Apply the shared property search filters to a Property query."""
+    # Each requested amenity is an indexed lookup: Amenities.name -> PropertyAmenities(amenity_id, property_id)
+    for name in amenity or []:
+        query = query.filter(models.Property.id.in_(
+            select(models.PropertyAmenity.property_id)
+            .join(models.Amenity, models.Amenity.id == models.PropertyAmenity.amenity_id)
+            .where(models.Amenity.name == name.strip())
+        ))
+    if city is not None:
+        query = query.filter(models.Property.city == city)
+    if state is not None:
+        query = query.filter(models.Property.state == state)
+    if min_price is not None:
+        query = query.filter(models.Property.price_per_night >= min_price)
+    if max_price is not None:
+        query = query.filter(models.Property.price_per_night <= max_price)
+    return query
+
 @app.post("/properties/", response_model=schemas.PropertyResponse, status_code=status.HTTP_201_CREATED)
-def create_property(property: schemas.PropertyCreate, db: Session = Depends(get_db)):
+async def create_property(property: schemas.PropertyCreate, db: AsyncSession = Depends(get_db)):
+    # get_or_create_tags probes for new amenities before inserting them
+    await lock_sqlite_writes(db)
     db_property = models.Property(
         name=property.name,
         address_line1=property.address_line1,
@@ -220,12 +916,15 @@ def create_property(property: schemas.PropertyCreate, db: Session = Depends(get_
         state=property.state,
         zip_code=property.zip_code,
         country=property.country,
-        price_per_night=property.price_per_night,
-        amenities=list_to_comma_string(property.amenities)
+        price_per_night=property.price_per_night
     )
+    await db.run_sync(models.set_property_amenities, db_property, property.amenities)
     db.add(db_property)
-    db.commit()
-    db.refresh(db_property)
+    catalog_state = await bump_catalog_version(db)
+    await db.commit()
+    catalog_version.observe(*catalog_state)
+    recommendation_worker.enqueue_matching(retrieval_terms(db_property))
+    index_property(db_property)
     return schemas.PropertyResponse(
         id=db_property.id,
         name=db_property.name,
@@ -236,33 +935,98 @@ def create_property(property: schemas.PropertyCreate, db: Session = Depends(get_
         zip_code=db_property.zip_code,
         country=db_property.country,
         price_per_night=db_property.price_per_night,
-        amenities=comma_string_to_list(db_property.amenities)
+        amenities=db_property.amenities
     )
 
-@app.get("/properties/", response_model=List[schemas.PropertyResponse])
-def list_properties(db: Session = Depends(get_db)):
-    props = db.query(models.Property).all()
-    return [
-        schemas.PropertyResponse(
-            id=p.id,
-            name=p.name,
-            address_line1=p.address_line1,
-            address_line2=p.address_line2,
-            city=p.city,
-            state=p.state,
-            zip_code=p.zip_code,
-            country=p.country,
-            price_per_night=p.price_per_night,
-            amenities=comma_string_to_list(p.amenities)
-        )
-        for p in props
+@app.post("/properties/bulk", response_model=schemas.PropertyBulkResponse)
+async def create_properties_bulk(items: List[Dict[str, Any]] = Body(...), db: AsyncSession = Depends(get_db)):
+    errors = []
+    valid = [
+        (prop.dict(exclude={"amenities"}), models.clean_tag_names(prop.amenities))
+        for _, prop in validate_bulk_items(items, schemas.PropertyCreate, errors)
     ]
+    ids = await bulk_insert_ids(db, models.Property, [fields for fields, _ in valid])
+    await bulk_insert_tag_links(
+        db, models.Amenity, models.PropertyAmenity, "property_id", "amenity_id",
+        [(property_id, amenities) for property_id, (_, amenities) in zip(ids, valid)],
+    )
+    catalog_state = await bump_catalog_version(db) if ids else None
+    await db.commit()
+    created = [
+        schemas.PropertyResponse(id=property_id, amenities=amenities, **fields)
+        for property_id, (fields, amenities) in zip(ids, valid)
+    ]
+    if created:
+        catalog_version.observe(*catalog_state)
+        recommendation_worker.enqueue_matching(term for prop in created for term in retrieval_terms(prop))
+    # The responses carry every field the catalog indexes look at
+    for prop in created:
+        index_property(prop)
+    return schemas.PropertyBulkResponse(created=created, errors=errors)
+
+@app.get("/properties/", response_model=List[schemas.PropertyResponse])
+async def list_properties(
+    request: Request,
+    response: Response,
+    etag_headers: dict = Depends(catalog_etag),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    city: Optional[str] = None,
+    state: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    amenity: Optional[List[str]] = Query(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    query = filter_properties(select(models.Property), city, state, min_price, max_price, amenity)
+    if wants_ndjson(request):
+        return stream_ndjson(db, query, models.Property, limit, after, property_to_dict, etag_headers)
+    props = await paginate(db, query, models.Property, limit or DEFAULT_PAGE_SIZE, after, response)
+    return fast_json(props, property_to_dict, response)
+
+# Properties with no reservation overlapping [check_in, check_out). The NOT EXISTS
+# probe is answered from the Reservations(property_id, check_in_date, check_out_date) index.
+@app.get("/properties/available", response_model=List[schemas.PropertyResponse])
+async def list_available_properties(
+    request: Request,
+    response: Response,
+    check_in: date,
+    check_out: date,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    city: Optional[str] = None,
+    state: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    amenity: Optional[List[str]] = Query(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if check_in >= check_out:
+        raise HTTPException(status_code=400, detail="check_out must be after check_in")
+    booked = select(models.Reservation.id).where(
+        models.Reservation.property_id == models.Property.id,
+        models.Reservation.check_in_date < check_out,
+        models.Reservation.check_out_date > check_in,
+    )
+    query = filter_properties(select(models.Property), city, state, min_price, max_price, amenity)
+    query = query.filter(~booked.exists())
+    if wants_ndjson(request):
+        return stream_ndjson(db, query, models.Property, limit, after, property_to_dict)
+    props = await paginate(db, query, models.Property, limit or DEFAULT_PAGE_SIZE, after, response)
+    return fast_json(props, property_to_dict, response)
 
 @app.get("/properties/{property_id}", response_model=schemas.PropertyResponse)
-def get_property(property_id: int, db: Session = Depends(get_db)):
-    prop = db.query(models.Property).filter(models.Property.id == property_id).first()
+async def get_property(
+    property_id: int,
+    request: Request,
+    etag_headers: dict = Depends(catalog_item_etag),
+    db: AsyncSession = Depends(get_read_db),
+):
+    prop = await db.get(models.Property, property_id)
     if not prop:
         raise HTTPException(status_code=404, detail="Property not found")
+    if "*" in _if_none_match_tags(request):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers)
     return schemas.PropertyResponse(
         id=prop.id,
         name=prop.name,
@@ -273,21 +1037,30 @@ def get_property(property_id: int, db: Session = Depends(get_db)):
         zip_code=prop.zip_code,
         country=prop.country,
         price_per_night=prop.price_per_night,
-        amenities=comma_string_to_list(prop.amenities)
+        amenities=prop.amenities
     )
 
 @app.put("/properties/{property_id}", response_model=schemas.PropertyResponse)
-def update_property(property_id: int, property_update: schemas.PropertyUpdate, db: Session = Depends(get_db)):
-    prop = db.query(models.Property).filter(models.Property.id == property_id).first()
+async def update_property(property_id: int, property_update: schemas.PropertyUpdate, db: AsyncSession = Depends(get_db)):
+    if property_update.amenities is not None:
+        await lock_sqlite_writes(db)
+    prop = await db.get(models.Property, property_id)
     if not prop:
         raise HTTPException(status_code=404, detail="Property not found")
+    terms_before = retrieval_terms(prop)
     for field, value in property_update.dict(exclude_unset=True).items():
         if field == "amenities" and value is not None:
-            setattr(prop, field, list_to_comma_string(value))
+            await db.run_sync(models.set_property_amenities, prop, value)
         elif value is not None:
             setattr(prop, field, value)
-    db.commit()
-    db.refresh(prop)
+    catalog_state = await bump_catalog_version(db)
+    await db.commit()
+    catalog_version.observe(*catalog_state)
+    # Users matching the old or the new terms may gain or lose it as a candidate
+    terms_after = retrieval_terms(prop)
+    if terms_after != terms_before:
+        recommendation_worker.enqueue_matching([*terms_before, *terms_after])
+    index_property(prop)
     return schemas.PropertyResponse(
         id=prop.id,
         name=prop.name,
@@ -298,29 +1071,77 @@ def update_property(property_id: int, property_update: schemas.PropertyUpdate, d
         zip_code=prop.zip_code,
         country=prop.country,
         price_per_night=prop.price_per_night,
-        amenities=comma_string_to_list(prop.amenities)
+        amenities=prop.amenities
     )
 
 @app.delete("/properties/{property_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_property(property_id: int, db: Session = Depends(get_db)):
-    prop = db.query(models.Property).filter(models.Property.id == property_id).first()
+async def delete_property(property_id: int, db: AsyncSession = Depends(get_db)):
+    prop = await db.get(models.Property, property_id)
     if not prop:
         raise HTTPException(status_code=404, detail="Property not found")
-    db.delete(prop)
-    db.commit()
+    terms = retrieval_terms(prop)
+    # Users it was recommended to lose a row now and are refreshed first
+    recommended_to = (await db.execute(
+        delete(models.UserRecommendation)
+        .filter(models.UserRecommendation.property_id == property_id)
+        .returning(models.UserRecommendation.user_id)
+    )).scalars().all()
+    await db.delete(prop)
+    catalog_state = await bump_catalog_version(db)
+    await db.commit()
+    catalog_version.observe(*catalog_state)
+    recommendation_worker.enqueue(*recommended_to)
+    recommendation_worker.enqueue_matching(terms)
+    for index in catalog_indexes:
+        index.remove(property_id)
     return
 
 # ---------- Reservation Endpoints ----------
-@app.post("/reservations/", response_model=schemas.ReservationResponse, status_code=status.HTTP_201_CREATED)
-def create_reservation(reservation: schemas.ReservationCreate, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == reservation.user_id).first()
-    prop = db.query(models.Property).filter(models.Property.id == reservation.property_id).first()
-    if not user:
+# Double-booking protection: the overlap probe and the write must run in one
+# write transaction, otherwise two concurrent requests can both see the dates
+# as free. On SQLite, BEGIN IMMEDIATE takes the database write lock before the
+# probe; on other backends the property row is locked with SELECT ... FOR UPDATE,
+# which serializes bookings per property only.
+async def lock_for_booking(db: AsyncSession, property_id: int):
+    if not await lock_sqlite_writes(db):
+        await db.execute(select(models.Property.id).filter(models.Property.id == property_id).with_for_update())
+
+async def has_overlapping_reservation(db: AsyncSession, property_id: int, check_in, check_out, exclude_id=None) -> bool:
+    """Indexed probe on Reservations(property_id, check_in_date, check_out_date)."""
+    query = select(models.Reservation.id).filter(
+        models.Reservation.property_id == property_id,
+        models.Reservation.check_in_date < check_out,
+        models.Reservation.check_out_date > check_in,
+    )
+    if exclude_id is not None:
+        query = query.filter(models.Reservation.id != exclude_id)
+    return await db.scalar(select(query.exists()))
+
+RESERVATION_CONFLICT = "Property is already reserved for these dates"
+
+async def check_reservation_references(db: AsyncSession, user_id=None, property_id=None):
+    """400 unless the referenced user and property exist; both are checked in one query."""
+    checks = []
+    if user_id is not None:
+        checks.append(select(models.User.id).filter(models.User.id == user_id).exists().label("user"))
+    if property_id is not None:
+        checks.append(select(models.Property.id).filter(models.Property.id == property_id).exists().label("property"))
+    if not checks:
+        return
+    found = (await db.execute(select(*checks))).one()._mapping
+    if not found.get("user", True):
         raise HTTPException(status_code=400, detail="User does not exist")
-    if not prop:
+    if not found.get("property", True):
         raise HTTPException(status_code=400, detail="Property does not exist")
+
+@app.post("/reservations/", response_model=schemas.ReservationResponse, status_code=status.HTTP_201_CREATED)
+async def create_reservation(reservation: schemas.ReservationCreate, db: AsyncSession = Depends(get_db)):
+    await check_reservation_references(db, reservation.user_id, reservation.property_id)
     if reservation.check_in_date >= reservation.check_out_date:
         raise HTTPException(status_code=400, detail="check_out_date must be after check_in_date")
+    await lock_for_booking(db, reservation.property_id)
+    if await has_overlapping_reservation(db, reservation.property_id, reservation.check_in_date, reservation.check_out_date):
+        raise HTTPException(status_code=409, detail=RESERVATION_CONFLICT)
     today = date.today()
     db_reservation = models.Reservation(
         user_id=reservation.user_id,
@@ -330,8 +1151,7 @@ def create_reservation(reservation: schemas.ReservationCreate, db: Session = Dep
         reservation_date=today
     )
     db.add(db_reservation)
-    db.commit()
-    db.refresh(db_reservation)
+    await db.commit()
     return schemas.ReservationResponse(
         id=db_reservation.id,
         user_id=db_reservation.user_id,
@@ -341,24 +1161,85 @@ def create_reservation(reservation: schemas.ReservationCreate, db: Session = Dep
         reservation_date=db_reservation.reservation_date
     )
 
-@app.get("/reservations/", response_model=List[schemas.ReservationResponse])
-def list_reservations(db: Session = Depends(get_db)):
-    reservations = db.query(models.Reservation).all()
-    return [
-        schemas.ReservationResponse(
-            id=r.id,
-            user_id=r.user_id,
-            property_id=r.property_id,
-            check_in_date=r.check_in_date,
-            check_out_date=r.check_out_date,
-            reservation_date=r.reservation_date
+@app.post("/reservations/bulk", response_model=schemas.ReservationBulkResponse)
+async def create_reservations_bulk(items: List[Dict[str, Any]] = Body(...), db: AsyncSession = Depends(get_db)):
+    errors = []
+    candidates = validate_bulk_items(items, schemas.ReservationCreate, errors)
+    user_ids = {r.user_id for _, r in candidates}
+    property_ids = {r.property_id for _, r in candidates}
+    # The whole batch is checked and written under one write lock
+    for property_id in sorted(property_ids):
+        await lock_for_booking(db, property_id)
+    known_users = set(await db.scalars(select(models.User.id).filter(models.User.id.in_(user_ids))))
+    known_properties = set(await db.scalars(select(models.Property.id).filter(models.Property.id.in_(property_ids))))
+    # Stays already booked on these properties within the batch's date span, in
+    # one query instead of an overlap probe per item
+    accepted = {}
+    if candidates:
+        span_start = min(r.check_in_date for _, r in candidates)
+        span_end = max(r.check_out_date for _, r in candidates)
+        booked = await db.execute(
+            select(models.Reservation.property_id, models.Reservation.check_in_date, models.Reservation.check_out_date)
+            .filter(
+                models.Reservation.property_id.in_(property_ids),
+                models.Reservation.check_in_date < span_end,
+                models.Reservation.check_out_date > span_start,
+            )
         )
-        for r in reservations
-    ]
+        for property_id, check_in, check_out in booked:
+            accepted.setdefault(property_id, []).append((check_in, check_out))
+    valid = []
+    for index, r in candidates:
+        if r.user_id not in known_users:
+            detail = "User does not exist"
+        elif r.property_id not in known_properties:
+            detail = "Property does not exist"
+        elif r.check_in_date >= r.check_out_date:
+            detail = "check_out_date must be after check_in_date"
+        elif any(r.check_in_date < out and r.check_out_date > cin for cin, out in accepted.get(r.property_id, [])):
+            detail = RESERVATION_CONFLICT
+        else:
+            accepted.setdefault(r.property_id, []).append((r.check_in_date, r.check_out_date))
+            valid.append(r)
+            continue
+        errors.append(schemas.BulkItemError(index=index, detail=detail))
+    today = date.today()
+    rows = [dict(r.dict(), reservation_date=today) for r in valid]
+    ids = await bulk_insert_ids(db, models.Reservation, rows)
+    await db.commit()
+    created = [schemas.ReservationResponse(id=rid, **row) for rid, row in zip(ids, rows)]
+    return schemas.ReservationBulkResponse(created=created, errors=sorted(errors, key=lambda e: e.index))
+
+@app.get("/reservations/", response_model=List[schemas.ReservationResponse])
+async def list_reservations(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    user_id: Optional[int] = None,
+    property_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    query = select(models.Reservation)
+    if user_id is not None:
+        query = query.filter(models.Reservation.user_id == user_id)
+    if property_id is not None:
+        query = query.filter(models.Reservation.property_id == property_id)
+    # Date range: reservations whose stay overlaps [start_date, end_date)
+    if start_date is not None:
+        query = query.filter(models.Reservation.check_out_date > start_date)
+    if end_date is not None:
+        query = query.filter(models.Reservation.check_in_date < end_date)
+    if wants_ndjson(request):
+        return stream_ndjson(db, query, models.Reservation, limit, after, reservation_to_dict)
+    reservations = await paginate(db, query, models.Reservation, limit or DEFAULT_PAGE_SIZE, after, response)
+    return fast_json(reservations, reservation_to_dict, response)
 
 @app.get("/reservations/{reservation_id}", response_model=schemas.ReservationResponse)
-def get_reservation(reservation_id: int, db: Session = Depends(get_db)):
-    r = db.query(models.Reservation).filter(models.Reservation.id == reservation_id).first()
+async def get_reservation(reservation_id: int, db: AsyncSession = Depends(get_read_db)):
+    r = await db.get(models.Reservation, reservation_id)
     if not r:
         raise HTTPException(status_code=404, detail="Reservation not found")
     return schemas.ReservationResponse(
@@ -371,29 +1252,27 @@ def get_reservation(reservation_id: int, db: Session = Depends(get_db)):
     )
 
 @app.put("/reservations/{reservation_id}", response_model=schemas.ReservationResponse)
-def update_reservation(reservation_id: int, reservation_update: schemas.ReservationUpdate, db: Session = Depends(get_db)):
-    r = db.query(models.Reservation).filter(models.Reservation.id == reservation_id).first()
+async def update_reservation(reservation_id: int, reservation_update: schemas.ReservationUpdate, db: AsyncSession = Depends(get_db)):
+    r = await db.get(models.Reservation, reservation_id)
     if not r:
         raise HTTPException(status_code=404, detail="Reservation not found")
     data = reservation_update.dict(exclude_unset=True)
-    if "user_id" in data:
-        user = db.query(models.User).filter(models.User.id == data["user_id"]).first()
-        if not user:
-            raise HTTPException(status_code=400, detail="User does not exist")
-        r.user_id = data["user_id"]
-    if "property_id" in data:
-        prop = db.query(models.Property).filter(models.Property.id == data["property_id"]).first()
-        if not prop:
-            raise HTTPException(status_code=400, detail="Property does not exist")
-        r.property_id = data["property_id"]
-    if "check_in_date" in data:
-        r.check_in_date = data["check_in_date"]
-    if "check_out_date" in data:
-        r.check_out_date = data["check_out_date"]
-    if r.check_in_date >= r.check_out_date:
+    # Validate the updated values before touching the row, so a rejected update
+    # leaves nothing dirty in the session.
+    await check_reservation_references(db, data.get("user_id"), data.get("property_id"))
+    property_id = data.get("property_id", r.property_id)
+    check_in_date = data.get("check_in_date", r.check_in_date)
+    check_out_date = data.get("check_out_date", r.check_out_date)
+    if check_in_date >= check_out_date:
         raise HTTPException(status_code=400, detail="check_out_date must be after check_in_date")
-    db.commit()
-    db.refresh(r)
+    await lock_for_booking(db, property_id)
+    if await has_overlapping_reservation(db, property_id, check_in_date, check_out_date, exclude_id=r.id):
+        raise HTTPException(status_code=409, detail=RESERVATION_CONFLICT)
+    r.user_id = data.get("user_id", r.user_id)
+    r.property_id = property_id
+    r.check_in_date = check_in_date
+    r.check_out_date = check_out_date
+    await db.commit()
     return schemas.ReservationResponse(
         id=r.id,
         user_id=r.user_id,
@@ -404,10 +1283,10 @@ def update_reservation(reservation_id: int, reservation_update: schemas.Reservat
     )
 
 @app.delete("/reservations/{reservation_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_reservation(reservation_id: int, db: Session = Depends(get_db)):
-    r = db.query(models.Reservation).filter(models.Reservation.id == reservation_id).first()
+async def delete_reservation(reservation_id: int, db: AsyncSession = Depends(get_db)):
+    r = await db.get(models.Reservation, reservation_id)
     if not r:
         raise HTTPException(status_code=404, detail="Reservation not found")
-    db.delete(r)
-    db.commit()
+    await db.delete(r)
+    await db.commit()
     return
@@ -0,0 +1,113 @@
+"""Booking throughput with many concurrent writers on a few hot properties.
+
+Every worker thread books random stays on the same small set of properties
+through POST /reservations/, against a scratch SQLite file. The run reports
+bookings/s, how many requests were rejected with 409, and verifies at the end
+that no property was double-booked.
+
+Usage (from the app directory):
+    python benchmarks/booking_contention.py --workers 16 --requests 200 --properties 3
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+import models_sqlalchemy as models
+from api_endpoints import app, get_db
+
+DOUBLE_BOOKINGS_SQL = """
+SELECT COUNT(*) FROM Reservations a JOIN Reservations b
+  ON a.property_id = b.property_id AND a.id < b.id
+ AND a.check_in_date < b.check_out_date AND a.check_out_date > b.check_in_date
+"""
+
+def run(workers: int, requests_per_worker: int, properties: int, days: int, seed: int = 0) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        models.init_db(engine)
+        # TestClient runs every request thread on its own event loop, so sessions
+        # must not share pooled connections across threads
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+        Session = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+        async def override_get_db():
+            async with Session() as db:
+                yield db
+
+        app.dependency_overrides[get_db] = override_get_db
+        try:
+            client = TestClient(app)
+            user_id = client.post("/users/", json={"name": "Bench", "email": "bench@example.com"}).json()["id"]
+            property_ids = [
+                client.post("/properties/", json={
+                    "name": f"Hot {i}", "address_line1": "1 Main St", "city": "Denver", "state": "CO",
+                    "zip_code": "80202", "price_per_night": 100.0,
+                }).json()["id"]
+                for i in range(properties)
+            ]
+            counts = {"created": 0, "conflict": 0, "error": 0}
+            lock = threading.Lock()
+            start_day = date(2030, 1, 1)
+
+            def worker(worker_id: int):
+                rng = random.Random(seed + worker_id)
+                for _ in range(requests_per_worker):
+                    check_in = start_day + timedelta(days=rng.randrange(days))
+                    payload = {
+                        "user_id": user_id,
+                        "property_id": rng.choice(property_ids),
+                        "check_in_date": check_in.isoformat(),
+                        "check_out_date": (check_in + timedelta(days=rng.randint(1, 3))).isoformat(),
+                    }
+                    status = client.post("/reservations/", json=payload).status_code
+                    key = "created" if status == 201 else "conflict" if status == 409 else "error"
+                    with lock:
+                        counts[key] += 1
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            app.dependency_overrides.clear()
+
+        with engine.connect() as conn:
+            double_bookings = conn.execute(text(DOUBLE_BOOKINGS_SQL)).scalar()
+        engine.dispose()
+
+    total = workers * requests_per_worker
+    return {
+        "workers": workers,
+        "requests": total,
+        "properties": properties,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 1),
+        **counts,
+        "double_bookings": double_bookings,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent booking benchmark")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=100, help="requests per worker")
+    parser.add_argument("--properties", type=int, default=3, help="number of hot properties")
+    parser.add_argument("--days", type=int, default=365, help="window of check-in days to pick from")
+    args = parser.parse_args()
+    print(json.dumps(run(args.workers, args.requests, args.properties, args.days), indent=2))
@@ -0,0 +1,136 @@
+"""Synthetic dataset generator for benchmarks.
+
+Writes --users users, --properties properties and --reservations reservations
+into a scratch SQLite file through the streaming importer (import_data.py), so
+memory stays flat at any size. Interests and amenities are drawn from realistic
+vocabularies and reservations never overlap on a property, so the data passes
+the same checks the API enforces.
+
+Usage (from the app directory):
+    python benchmarks/generate_data.py --scale 100k --database /tmp/bench.db
+    python benchmarks/generate_data.py --users 5000 --properties 20000 --reservations 50000 --database /tmp/bench.db
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+import import_data
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+INTERESTS = [
+    "hiking", "skiing", "surfing", "beaches", "food tours", "wine tasting", "art museums", "nightlife",
+    "national parks", "photography", "cycling", "fishing", "golf", "theater", "shopping", "spa",
+    "historical sites", "kayaking", "camping", "concerts", "breweries", "mountain biking", "snorkeling",
+]
+AMENITIES = [
+    "Wi-Fi", "Kitchen", "Parking", "Hot Tub", "Pool", "Fireplace", "AC", "Pet-Friendly", "Elevator",
+    "Washer", "Ski-in/Ski-out", "Beach Access", "Ocean View", "Gym", "EV Charger", "Fenced Yard",
+]
+CITIES = [
+    ("New York", "NY"), ("Los Angeles", "CA"), ("Lake Tahoe", "CA"), ("New Orleans", "LA"), ("Aspen", "CO"),
+    ("Denver", "CO"), ("Miami", "FL"), ("Key West", "FL"), ("Austin", "TX"), ("Seattle", "WA"),
+    ("Portland", "OR"), ("Asheville", "NC"), ("Sedona", "AZ"), ("Park City", "UT"), ("Nashville", "TN"),
+    ("Savannah", "GA"), ("Bar Harbor", "ME"), ("Honolulu", "HI"), ("Moab", "UT"), ("Chicago", "IL"),
+]
+FIRST_NAMES = ["Emily", "Carlos", "Jessica", "David", "Priya", "Robert", "Linda", "Michael", "Sofia", "James"]
+LAST_NAMES = ["Chen", "Martinez", "Lee", "Wilson", "Patel", "Smith", "Nguyen", "Johnson", "Garcia", "Anderson"]
+
+RESERVATIONS_START = date(2025, 1, 1)
+
+def users(count, rng):
+    for i in range(1, count + 1):
+        yield "Users", {
+            "id": i,
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "email": f"user{i}@example.com",
+            "interests": rng.sample(INTERESTS, rng.randint(1, 4)),
+        }
+
+def properties(count, rng):
+    for i in range(1, count + 1):
+        city, state = rng.choice(CITIES)
+        yield "Properties", {
+            "id": i,
+            "name": f"{city} Stay {i}",
+            "address_line1": f"{rng.randint(1, 9999)} Main St",
+            "city": city,
+            "state": state,
+            "zip_code": f"{rng.randint(10000, 99999)}",
+            "country": "USA",
+            "price_per_night": round(rng.uniform(60, 900), 2),
+            "amenities": rng.sample(AMENITIES, rng.randint(2, 6)),
+        }
+
+def reservations(count, user_count, property_count, rng):
+    # The k-th reservation goes to property k % properties in week k // properties,
+    # so stays on the same property never overlap
+    for k in range(count):
+        check_in = RESERVATIONS_START + timedelta(weeks=k // property_count, days=rng.randint(0, 2))
+        yield "Reservations", {
+            "id": k + 1,
+            "user_id": rng.randint(1, user_count),
+            "property_id": k % property_count + 1,
+            "check_in_date": check_in,
+            "check_out_date": check_in + timedelta(days=rng.randint(1, 4)),
+            "reservation_date": check_in - timedelta(days=rng.randint(7, 90)),
+        }
+
+def generate(database_path, user_count, property_count, reservation_count, seed=0,
+             batch_size=import_data.DEFAULT_BATCH_SIZE) -> dict:
+    """Create a fresh SQLite database at database_path and fill it. Returns counts and timing."""
+    if os.path.exists(database_path):
+        os.remove(database_path)
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite:///{database_path}")
+    started = time.perf_counter()
+    import_data.models.init_db(engine)
+    for index in import_data.secondary_indexes():
+        index.drop(bind=engine, checkfirst=True)
+    with engine.connect() as conn:
+        importer = import_data.Importer(conn, batch_size=batch_size)
+        sources = [
+            users(user_count, rng),
+            properties(property_count, rng),
+            reservations(reservation_count, max(user_count, 1), max(property_count, 1), rng),
+        ]
+        for source in sources:
+            for table_name, row in source:
+                importer.add(table_name, row)
+            importer.flush_all()
+    import_data.models.init_db(engine)
+    engine.dispose()
+    return {
+        "database": database_path,
+        "users": user_count,
+        "properties": property_count,
+        "reservations": reservation_count,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+def add_dataset_arguments(parser):
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k",
+                        help="rows per table; --users/--properties/--reservations override it")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--properties", type=int)
+    parser.add_argument("--reservations", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+
+def dataset_sizes(args):
+    size = SCALES[args.scale]
+    return args.users or size, args.properties or size, args.reservations or size
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark database")
+    add_dataset_arguments(parser)
+    parser.add_argument("--database", default=os.path.join("benchmarks", "bench.db"))
+    args = parser.parse_args()
+    print(json.dumps(generate(args.database, *dataset_sizes(args), seed=args.seed), indent=2))
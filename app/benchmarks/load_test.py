@@ -0,0 +1,246 @@
+"""Load test of every API endpoint against a local uvicorn.
+
+Generates a synthetic database (generate_data.py), starts the API on it with a
+mocked LLM (server.py) and drives each endpoint in turn with --concurrency
+clients for --requests requests. Writes go before the deletes that consume
+them, so every request targets a row that exists. The report is JSON with, per
+endpoint, throughput and p50/p95/p99 latency in milliseconds:
+
+    {"config": {...}, "dataset": {...}, "endpoints": {"GET /users/{user_id}": {
+        "requests": 500, "errors": 0, "status_counts": {"200": 500},
+        "throughput_rps": 1834.2, "mean_ms": 4.3, "p50_ms": 3.9, "p95_ms": 7.1, "p99_ms": 9.8}, ...}}
+
+Usage (from the app directory):
+    python benchmarks/load_test.py --scale 100k --concurrency 32 --requests 1000 --output bench.json
+    python benchmarks/load_test.py --database /tmp/bench.db --reuse-database --only "GET /properties/"
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+import httpx
+
+from generate_data import AMENITIES, CITIES, INTERESTS, add_dataset_arguments, dataset_sizes, generate
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+# New reservations are booked one week apart from here on, far past the generated ones
+NEW_RESERVATIONS_START = date(2040, 1, 1)
+BULK_SIZE = 100
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+def summarize(latencies, statuses, elapsed) -> dict:
+    latencies = sorted(latencies)
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    status_counts = {}
+    for code in statuses:
+        status_counts[str(code)] = status_counts.get(str(code), 0) + 1
+    return {
+        "requests": len(statuses),
+        "errors": sum(1 for code in statuses if code == "error" or code >= 400),
+        "status_counts": status_counts,
+        "throughput_rps": round(len(statuses) / elapsed, 1) if elapsed else None,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+    }
+
+class Scenarios:
+    """Builds the i-th request for every endpoint, keeping the ids that writes create."""
+
+    def __init__(self, users, properties, reservations, seed=0):
+        self.users = users
+        self.properties = properties
+        self.reservations = reservations
+        self.rng = random.Random(seed)
+        self.run = uuid.uuid4().hex[:8]
+        self.created = {"users": [], "properties": [], "reservations": []}
+
+    def user_id(self):
+        return self.rng.randint(1, self.users)
+
+    def property_id(self):
+        return self.rng.randint(1, self.properties)
+
+    def user_payload(self, i, prefix="load"):
+        return {"name": f"Load User {i}", "email": f"{prefix}-{self.run}-{i}@example.com",
+                "interests": self.rng.sample(INTERESTS, 3)}
+
+    def property_payload(self, i):
+        city, state = self.rng.choice(CITIES)
+        return {"name": f"Load Stay {i}", "address_line1": f"{i} Bench Rd", "city": city, "state": state,
+                "zip_code": "12345", "country": "USA", "price_per_night": 150.0,
+                "amenities": self.rng.sample(AMENITIES, 3)}
+
+    def reservation_payload(self, slot, nights=3):
+        check_in = NEW_RESERVATIONS_START + timedelta(weeks=slot)
+        return {"user_id": self.user_id(), "property_id": self.property_id(),
+                "check_in_date": check_in.isoformat(),
+                "check_out_date": (check_in + timedelta(days=nights)).isoformat()}
+
+    def pop(self, kind):
+        ids = self.created[kind]
+        return ids.pop() if ids else 0
+
+    def endpoints(self, requests):
+        """(name, request factory, collect) in run order; factories return (method, url, kwargs)."""
+        stay = lambda: {"check_in": "2025-03-01", "check_out": "2025-03-05"}
+        keep = lambda kind: lambda r: self.created[kind].append(r.json()["id"])
+        bulk_slot = lambda i, k: requests * 2 + i * BULK_SIZE + k
+        return [
+            ("GET /users/", lambda i: ("GET", "/users/", {}), None),
+            ("GET /users/{user_id}", lambda i: ("GET", f"/users/{self.user_id()}", {}), None),
+            ("GET /users/{user_id}/properties?engine=local",
+             lambda i: ("GET", f"/users/{self.user_id()}/properties", {"params": {"engine": "local"}}), None),
+            ("GET /users/{user_id}/properties?engine=llm",
+             lambda i: ("GET", f"/users/{self.user_id()}/properties", {"params": {"engine": "llm"}}), None),
+            ("GET /users/{user_id}/properties/stream",
+             lambda i: ("GET", f"/users/{self.user_id()}/properties/stream", {}), None),
+            ("GET /properties/", lambda i: ("GET", "/properties/", {}), None),
+            ("GET /properties/{property_id}", lambda i: ("GET", f"/properties/{self.property_id()}", {}), None),
+            ("GET /properties/available",
+             lambda i: ("GET", "/properties/available", {"params": dict(stay(), city=self.rng.choice(CITIES)[0])}),
+             None),
+            ("GET /reservations/",
+             lambda i: ("GET", "/reservations/", {"params": {"property_id": self.property_id()}}), None),
+            ("GET /reservations/{reservation_id}",
+             lambda i: ("GET", f"/reservations/{self.rng.randint(1, self.reservations)}", {}), None),
+            ("POST /users/", lambda i: ("POST", "/users/", {"json": self.user_payload(i)}), keep("users")),
+            ("POST /properties/", lambda i: ("POST", "/properties/", {"json": self.property_payload(i)}),
+             keep("properties")),
+            ("POST /reservations/", lambda i: ("POST", "/reservations/", {"json": self.reservation_payload(i)}),
+             keep("reservations")),
+            ("PUT /users/{user_id}",
+             lambda i: ("PUT", f"/users/{self.user_id()}", {"json": {"name": f"Renamed {i}"}}), None),
+            ("PUT /properties/{property_id}",
+             lambda i: ("PUT", f"/properties/{self.property_id()}", {"json": {"price_per_night": 175.0}}), None),
+            ("PUT /reservations/{reservation_id}",
+             lambda i: ("PUT", f"/reservations/{self.pop('reservations')}",
+                        {"json": {k: v for k, v in self.reservation_payload(requests + i, 4).items()
+                                  if k.endswith("_date")}}),
+             keep("reservations")),
+            ("POST /users/bulk",
+             lambda i: ("POST", "/users/bulk",
+                        {"json": [self.user_payload(i * BULK_SIZE + k, "bulk") for k in range(BULK_SIZE)]}), None),
+            ("POST /properties/bulk",
+             lambda i: ("POST", "/properties/bulk",
+                        {"json": [self.property_payload(i * BULK_SIZE + k) for k in range(BULK_SIZE)]}), None),
+            ("POST /reservations/bulk",
+             lambda i: ("POST", "/reservations/bulk",
+                        {"json": [self.reservation_payload(bulk_slot(i, k)) for k in range(BULK_SIZE)]}), None),
+            ("DELETE /reservations/{reservation_id}",
+             lambda i: ("DELETE", f"/reservations/{self.pop('reservations')}", {}), None),
+            ("DELETE /properties/{property_id}",
+             lambda i: ("DELETE", f"/properties/{self.pop('properties')}", {}), None),
+            ("DELETE /users/{user_id}", lambda i: ("DELETE", f"/users/{self.pop('users')}", {}), None),
+            ("GET /metrics", lambda i: ("GET", "/metrics", {}), None),
+        ]
+
+async def drive(client, factory, collect, requests, concurrency) -> dict:
+    latencies, statuses = [], []
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            method, url, kwargs = factory(i)
+            started = time.perf_counter()
+            try:
+                r = await client.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                statuses.append("error")
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses.append(r.status_code)
+            if collect is not None and r.status_code < 400:
+                collect(r)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+async def wait_for_server(base_url, process, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with code {process.returncode}")
+            try:
+                await client.get("/metrics")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start in time")
+
+async def run_load(base_url, scenarios, requests, concurrency, only=None, warmup=20) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        for name, factory, collect in scenarios.endpoints(requests):
+            if only and name not in only:
+                continue
+            # Warm caches and connections on the read endpoints only, so writes stay balanced
+            if warmup and name.startswith("GET "):
+                await drive(client, factory, None, warmup, concurrency)
+            results[name] = await drive(client, factory, collect, requests, concurrency)
+            print(f"{name}: {results[name]['throughput_rps']} req/s", file=sys.stderr)
+    return results
+
+def run(args) -> dict:
+    users, properties, reservations = dataset_sizes(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.database or os.path.join(tmp, "bench.db")
+        if args.reuse_database and os.path.exists(database):
+            dataset = {"database": database, "reused": True}
+        else:
+            dataset = generate(database, users, properties, reservations, seed=args.seed)
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.abspath(database)}")
+        server = subprocess.Popen(
+            [sys.executable, SERVER, "--port", str(args.port), "--llm-latency", str(args.llm_latency)],
+            env=env, cwd=os.path.dirname(os.path.dirname(SERVER)),
+        )
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            asyncio.run(wait_for_server(base_url, server))
+            scenarios = Scenarios(users, properties, reservations, seed=args.seed)
+            endpoints = asyncio.run(run_load(base_url, scenarios, args.requests, args.concurrency, args.only))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    return {
+        "config": {"concurrency": args.concurrency, "requests": args.requests, "llm_latency": args.llm_latency},
+        "dataset": dataset,
+        "endpoints": endpoints,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-endpoint load test against a local uvicorn")
+    add_dataset_arguments(parser)
+    parser.add_argument("--database", help="SQLite file for the dataset (default: a temporary file)")
+    parser.add_argument("--reuse-database", action="store_true", help="skip generation if --database exists")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per mocked LLM completion")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--only", action="append", help="run just this endpoint (repeatable), e.g. 'GET /users/'")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
@@ -0,0 +1,133 @@
+"""Serialization throughput for list_properties on a large catalog.
+
+Seeds a scratch SQLite file with --rows properties and then measures:
+
+- serializer: encoding all rows the old way (PropertyResponse objects validated
+  again through the List[PropertyResponse] response model, as FastAPI does for
+  response_model) against the fast path (property_to_dict + orjson);
+- endpoint: paging through GET /properties/?limit=1000 with identity, gzip and
+  brotli encodings, reporting rows/s and bytes on the wire.
+
+Usage (from the app directory):
+    python benchmarks/serialization.py --rows 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+import models_sqlalchemy as models
+import models_pydantic as schemas
+from api_endpoints import MAX_PAGE_SIZE, app, get_read_db, property_to_dict
+from fast_responses import brotli, dumps
+
+AMENITIES = ["Wi-Fi", "Kitchen", "Parking", "Hot Tub", "Pool", "Fireplace", "AC", "Pet-Friendly"]
+
+def seed(engine, rows: int):
+    models.init_db(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Amenity), [{"id": i + 1, "name": name} for i, name in enumerate(AMENITIES)])
+        for start in range(0, rows, 10000):
+            ids = range(start + 1, min(start + 10000, rows) + 1)
+            conn.execute(insert(models.Property), [
+                {
+                    "id": i, "name": f"Property {i}", "address_line1": f"{i} Main St", "city": "Denver",
+                    "state": "CO", "zip_code": "80202", "country": "USA", "price_per_night": 100.0 + i % 400,
+                }
+                for i in ids
+            ])
+            conn.execute(insert(models.PropertyAmenity), [
+                {"property_id": i, "amenity_id": (i + k) % len(AMENITIES) + 1, "position": k}
+                for i in ids
+                for k in range(3)
+            ])
+
+def best_of(repeat: int, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def bench_serializer(engine, repeat: int) -> dict:
+    with Session(engine) as db:
+        props = db.query(models.Property).all()
+        adapter = TypeAdapter(List[schemas.PropertyResponse])
+
+        def response_model_path():
+            content = [schemas.PropertyResponse(**property_to_dict(p)) for p in props]
+            return adapter.dump_json(adapter.validate_python(content))
+
+        def fast_path():
+            return dumps([property_to_dict(p) for p in props])
+
+        old = best_of(repeat, response_model_path)
+        new = best_of(repeat, fast_path)
+    return {
+        "rows": len(props),
+        "response_model_seconds": round(old, 3),
+        "fast_path_seconds": round(new, 3),
+        "response_model_rows_per_second": round(len(props) / old),
+        "fast_path_rows_per_second": round(len(props) / new),
+        "speedup": round(old / new, 2),
+    }
+
+def bench_endpoint(client, encoding: str) -> dict:
+    rows = downloaded = 0
+    after = None
+    started = time.perf_counter()
+    while True:
+        params = {"limit": MAX_PAGE_SIZE}
+        if after is not None:
+            params["after"] = after
+        r = client.get("/properties/", params=params, headers={"Accept-Encoding": encoding})
+        rows += len(r.json())
+        downloaded += r.num_bytes_downloaded
+        after = r.headers.get("x-next-cursor")
+        if after is None:
+            break
+    elapsed = time.perf_counter() - started
+    return {"rows": rows, "seconds": round(elapsed, 3), "rows_per_second": round(rows / elapsed), "bytes": downloaded}
+
+def run(rows: int, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        seed(engine, rows)
+        report = {"serializer": bench_serializer(engine, repeat)}
+        engine.dispose()
+
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        ReadSession = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+        async def override_get_read_db():
+            async with ReadSession() as db:
+                yield db
+
+        app.dependency_overrides[get_read_db] = override_get_read_db
+        try:
+            with TestClient(app) as client:
+                encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+                report["endpoint"] = {encoding: bench_endpoint(client, encoding) for encoding in encodings}
+        finally:
+            app.dependency_overrides.clear()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="list_properties serialization benchmark")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.repeat), indent=2))
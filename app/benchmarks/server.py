@@ -0,0 +1,63 @@
+"""The API under uvicorn with a mocked LLM, for load tests.
+
+The recommendation routes get a fake asyncio completion that takes
+--llm-latency seconds and answers with the first five candidate ids from the
+prompt (one id at a time on the SSE route), so the LLM path is exercised end
+to end without network calls or API keys. Everything else (database, middleware, caches) is the real app.
+
+Usage (from the app directory):
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/server.py --port 8765
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+
+import api_endpoints
+
+FAKE_PROVIDER = "benchmark"
+# The prompt lists the user's candidates on one line, best first
+CANDIDATE_IDS = re.compile(r"^Candidate ids: (.*)$", re.MULTILINE)
+
+def candidate_ids(prompt: str) -> list:
+    match = CANDIDATE_IDS.search(prompt)
+    return [pid.strip() for pid in match.group(1).split(",") if pid.strip()] if match else []
+
+def mock_llm(latency: float):
+    """Point the recommendation routes at a fake client with fixed latency."""
+
+    async def fake_completion(prompt, client, model_name, api_provider, temperature=0.7, **kwargs):
+        await asyncio.sleep(latency)
+        return json.dumps([int(pid) for pid in candidate_ids(prompt)[:5]])
+
+    async def fake_stream(prompt, client, model_name, api_provider, temperature=0.7):
+        ids = candidate_ids(prompt)[:5]
+        yield "["
+        for i, pid in enumerate(ids):
+            await asyncio.sleep(latency / max(len(ids), 1))
+            yield pid + ("]" if i == len(ids) - 1 else ", ")
+
+    async def no_warm(model_names, preconnect=True):
+        pass
+
+    api_endpoints.get_completion_async = fake_completion
+    api_endpoints.get_completion_stream_async = fake_stream
+    api_endpoints.llm_clients.warm_async = no_warm
+    api_endpoints.app.dependency_overrides[api_endpoints.get_llm_client] = (
+        lambda: (object(), api_endpoints.RECOMMENDATION_MODEL, FAKE_PROVIDER)
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the API with a mocked LLM")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake completion")
+    args = parser.parse_args()
+    mock_llm(args.llm_latency)
+    uvicorn.run(api_endpoints.app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,63 @@
+import hashlib
+import threading
+
+# ---------- Property catalog version ----------
+# The catalog version lives in the database (models.CatalogState) and is bumped
+# in the same transaction as every write to the Properties table, by this
+# process, other API workers and the command-line tools alike. ETags are
+# derived from it, so they change whichever process wrote.
+#
+# This object is the process's view of it. `value` is a local counter that
+# moves whenever the catalog is seen to change, for keying in-memory state
+# (cached recommendations, prompts, indexes). Writes made here are announced
+# with expect() before their commit, so observe() can tell them apart from
+# writes made elsewhere, which the in-memory indexes have not seen.
+
+class CatalogVersion:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.epoch = ""
+        self.version = 0       # last version seen in the database
+        self._value = 0
+        self._expected = set()  # (epoch, version) this process is committing
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def expect(self, epoch: str, version: int):
+        """Announce a version this process's open transaction is about to commit."""
+        with self._lock:
+            self._expected.add((epoch, version))
+
+    def observe(self, epoch: str, version: int) -> bool:
+        """Adopt a version read from the database.
+
+        Returns True when the catalog changed in a way this process did not
+        make itself (another process wrote, or the database was replaced).
+        """
+        with self._lock:
+            if epoch == self.epoch and version <= self.version:
+                return False
+            # Every version in between must be one of ours; a new epoch never is
+            outside = epoch != self.epoch or any(
+                (epoch, v) not in self._expected for v in range(self.version + 1, version + 1)
+            )
+            self._expected = {(e, v) for e, v in self._expected if e == epoch and v > version}
+            self.epoch, self.version = epoch, version
+            self._value += 1
+            return outside
+
+    def etag(self, *parts: str) -> str:
+        """Weak ETag for a representation derived from the catalog version last observed.
+
+        Weak because one tag covers the identity, gzip and brotli encodings of
+        the body, which are equivalent but not byte-for-byte equal.
+        """
+        key = "\0".join([self.epoch, str(self.version), *parts])
+        return 'W/"' + hashlib.sha1(key.encode()).hexdigest()[:32] + '"'
+
+catalog_version = CatalogVersion()
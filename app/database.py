@@ -0,0 +1,124 @@
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+import models_sqlalchemy as models
+
+# ---------- Database configuration ----------
+# DATABASE_URL          read-write database (defaults to the local travel.db)
+# DATABASE_READ_URL     optional read replica for GET endpoints (non-SQLite backends)
+# DATABASE_PROFILE      "production" applies the SQLite pragmas below, "default" leaves SQLite as is
+# DATABASE_POOL_SIZE / DATABASE_MAX_OVERFLOW / DATABASE_POOL_TIMEOUT / DATABASE_POOL_RECYCLE
+DATABASE_URL = os.getenv("DATABASE_URL", models.DATABASE_URL)
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+DATABASE_PROFILE = os.getenv("DATABASE_PROFILE", "production")
+
+POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+
+# Production SQLite profile. WAL lets readers run alongside the single writer,
+# synchronous=NORMAL only fsyncs at checkpoints (safe in WAL mode), busy_timeout
+# makes writers wait for the lock instead of failing, and mmap/cache/temp_store
+# keep hot pages and temporary b-trees in memory.
+SQLITE_PRODUCTION_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative = KiB, so 64 MiB
+    "temp_store": "MEMORY",
+}
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+IN_MEMORY_DATABASE = _is_memory_sqlite(make_url(DATABASE_URL))
+
+# The API runs on asyncio drivers; a plain sqlite:// or postgresql:// URL is
+# switched to the matching async driver.
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+KNOWN_ASYNC_DRIVERS = {"aiosqlite", "asyncpg", "psycopg", "aiomysql", "asyncmy"}
+
+def to_async_url(database_url):
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS and url.get_driver_name() not in KNOWN_ASYNC_DRIVERS:
+        url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    return url
+
+def _engine_options(url) -> dict:
+    kwargs = {}
+    if url.get_backend_name() == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False}
+        if not _is_memory_sqlite(url):
+            kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+    else:
+        kwargs.update(
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+    return kwargs
+
+def _install_sqlite_pragmas(engine, read_only: bool, profile: str):
+    pragmas = dict(SQLITE_PRODUCTION_PRAGMAS) if profile == "production" else {}
+    if read_only:
+        # Changing the journal mode needs a write; the writer engine sets it for the file
+        pragmas.pop("journal_mode", None)
+        pragmas["query_only"] = "ON"
+
+    @event.listens_for(engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def build_engine(database_url: str, read_only: bool = False, profile: str = DATABASE_PROFILE):
+    """Create a (sync) engine for the URL with pool settings and, for SQLite, the pragma profile.
+
+    Read-only SQLite engines open the same file with PRAGMA query_only, so any
+    accidental write through them fails instead of taking the write lock.
+    """
+    url = make_url(database_url)
+    engine = create_engine(url, **_engine_options(url))
+    if url.get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(engine, read_only, profile)
+    return engine
+
+def build_async_engine(database_url: str, read_only: bool = False, profile: str = DATABASE_PROFILE):
+    """Async counterpart of build_engine, used by the API."""
+    url = to_async_url(database_url)
+    engine = create_async_engine(url, **_engine_options(url))
+    if url.get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(engine.sync_engine, read_only, profile)
+    return engine
+
+engine = build_async_engine(DATABASE_URL)
+if DATABASE_READ_URL:
+    read_engine = build_async_engine(DATABASE_READ_URL, read_only=True)
+elif IN_MEMORY_DATABASE:
+    # A second in-memory engine would be a different, empty database. Every
+    # session shares its one connection, so in-memory SQLite is for tests only.
+    read_engine = engine
+else:
+    read_engine = build_async_engine(DATABASE_URL, read_only=True)
+
+# expire_on_commit=False: attributes stay readable after commit without another
+# round trip (lazy loads are not allowed on an AsyncSession).
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(bind=read_engine, autoflush=False, expire_on_commit=False)
+
+# Dependency to get a read-write DB session
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+# Dependency to get a read-only DB session, for GET endpoints
+async def get_read_db():
+    async with ReadSessionLocal() as db:
+        yield db
@@ -0,0 +1,102 @@
+"""Fast JSON encoding and response compression for the API.
+
+orjson and brotli are optional: without orjson the stdlib encoder is used, and
+without brotli responses are only gzip-compressed.
+"""
+import json
+import os
+
+import anyio.to_thread
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ---------- JSON ----------
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSON response for content that is already plain dicts/lists.
+
+    Returning it from an endpoint skips response_model validation, so only use
+    it with rows built by the *_to_dict helpers.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+# ---------- Compression ----------
+# Bodies smaller than COMPRESSION_MINIMUM_SIZE are sent as is; larger ones are
+# brotli-compressed when the client accepts br (and brotli is installed), gzip otherwise.
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+# Chunks above this size are compressed in a worker thread instead of on the event loop
+THREAD_MINIMUM_SIZE = 128 * 1024
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() == encoding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, quality: int = BROTLI_QUALITY):
+        super().__init__(app, minimum_size)
+        self.quality = quality
+        self._compressor = None
+
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=self.quality)
+        data = self._compressor.process(body)
+        return data + (self._compressor.flush() if more_body else self._compressor.finish())
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if len(body) >= THREAD_MINIMUM_SIZE:
+            return await anyio.to_thread.run_sync(self._compress_body, body, more_body)
+        return self._compress_body(body, more_body)
+
+class CompressionMiddleware(GZipMiddleware):
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE, compresslevel: int = GZIP_LEVEL,
+                 brotli_quality: int = BROTLI_QUALITY):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            send = _dedupe_vary(send)
+        if scope["type"] == "http" and brotli is not None:
+            if accepts_encoding(Headers(scope=scope).get("accept-encoding", ""), "br"):
+                responder = BrotliResponder(self.app, self.minimum_size, quality=self.brotli_quality)
+                await responder(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
+
+def _dedupe_vary(send):
+    # Endpoints that already list Accept-Encoding (next to a weak ETag) would
+    # otherwise get it twice once a responder appends its own
+    async def wrapped(message):
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(raw=message["headers"])
+            vary = headers.get("vary")
+            if vary:
+                headers["vary"] = ", ".join(dict.fromkeys(name.strip() for name in vary.split(",")))
+        await send(message)
+    return wrapped
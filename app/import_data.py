@@ -0,0 +1,383 @@
+"""Stream seed or partner data into the database.
+
+Reads CSV, JSONL or SQL (INSERT ... VALUES) files without loading them into
+memory, converts rows to the column types in models_sqlalchemy and inserts them
+with one executemany per batch, committing every --batch-size rows.
+
+- CSV/JSONL files go into the table named by --table, or by the file name
+  (reservations.csv -> Reservations).
+- SQL files may contain INSERT statements for several tables, like
+  capstone_artifacts/seed_data.sql. Other statements are skipped; the schema
+  always comes from the models.
+- Users.interests and Properties.amenities may be given as a list or a
+  comma-separated string and are written to the tag tables.
+- On SQLite, foreign keys are not enforced during the load and are checked once
+  at the end with PRAGMA foreign_key_check. Violations are reported and the
+  command exits non-zero; committed batches are kept.
+- A batch that violates a constraint (a duplicate id or email, say) stops the
+  load: the first offending row is reported and the command exits non-zero;
+  earlier batches stay committed.
+- Writes to the property catalog bump the stored catalog version in the same
+  transaction, so running API servers send new ETags and rebuild their
+  candidate indexes on their next catalog request without a restart. Stored
+  recommendations are cleared at the end, since they were ranked against the
+  old catalog; each user's list is ranked again on their next request.
+- --rebuild-indexes drops the non-unique secondary indexes first and recreates
+  them after the last batch, which is much faster than maintaining them row by
+  row for large loads.
+
+Usage:
+    python import_data.py FILE [FILE ...] [--table Reservations] [--format csv|jsonl|sql]
+                          [--batch-size 10000] [--rebuild-indexes] [--database-url sqlite:///./travel.db]
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import Date, Float, Integer, delete, select, text
+from sqlalchemy.exc import IntegrityError
+
+import models_sqlalchemy as models
+from database import build_engine
+
+DEFAULT_BATCH_SIZE = 10000
+
+# Tag columns that are not stored on the row itself: table -> (tag model, link model, owner key, tag key)
+TAG_COLUMNS = {
+    "Users": ("interests", models.Interest, models.UserInterest, "user_id", "interest_id"),
+    "Properties": ("amenities", models.Amenity, models.PropertyAmenity, "property_id", "amenity_id"),
+}
+
+# Tables whose rows make up the property catalog (see catalog.py)
+CATALOG_TABLES = {"Properties", "Amenities", "PropertyAmenities"}
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".sql": "sql"}
+
+class RowError(Exception):
+    """A batch failed on a constraint; row is the 1-based position among the rows loaded into table."""
+
+    def __init__(self, table, row, message):
+        self.table, self.row = table, row
+        super().__init__(f"{table} row {row}: {message}")
+
+# ---------- Readers ----------
+# Each reader yields (table name, row dict) pairs.
+
+def read_csv(path, table):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            # Empty CSV cells mean NULL
+            yield table, {key: (value if value != "" else None) for key, value in row.items()}
+
+def read_jsonl(path, table):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield table, json.loads(line)
+
+_SQL_TOKEN = re.compile(r"\s+|--[^\n]*|'(?:[^']|'')*'|\"[^\"]*\"|`[^`]*`|[(),;]|[^\s(),;'\"`]+")
+
+def _sql_tokens(f):
+    buffer = ""
+    for line in f:
+        if not buffer and line.lstrip().startswith("--"):
+            continue
+        buffer += line
+        # An odd number of quotes means a string literal continues on the next line
+        if buffer.count("'") % 2:
+            continue
+        for match in _SQL_TOKEN.finditer(buffer):
+            token = match.group()
+            if not token.isspace() and not token.startswith("--"):
+                yield token
+        buffer = ""
+    if buffer.strip():
+        raise ValueError("Unterminated string literal at end of SQL file")
+
+def _sql_identifier(token):
+    return token.strip('"`[]')
+
+def _sql_literal(token):
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    if token.upper() == "NULL":
+        return None
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token)
+    except ValueError:
+        raise ValueError(f"Unsupported SQL value: {token}")
+
+def read_sql(path, table=None):
+    """Yield rows from INSERT INTO t (cols) VALUES (...), (...); statements, one tuple at a time."""
+    with open(path, encoding="utf-8") as f:
+        tokens = _sql_tokens(f)
+        for token in tokens:
+            if token.upper() != "INSERT":
+                # Skip the rest of any other statement
+                while token != ";":
+                    token = next(tokens, ";")
+                continue
+            if next(tokens).upper() != "INTO":
+                raise ValueError("Expected INTO after INSERT")
+            target = _sql_identifier(next(tokens))
+            token = next(tokens)
+            columns = None
+            if token == "(":
+                columns = []
+                for token in tokens:
+                    if token == ")":
+                        break
+                    if token != ",":
+                        columns.append(_sql_identifier(token))
+                token = next(tokens)
+            if token.upper() != "VALUES":
+                raise ValueError(f"Only INSERT ... VALUES is supported (table {target})")
+            if columns is None:
+                columns = [c.name for c in models.Base.metadata.tables[target].columns]
+            token = next(tokens)
+            while token == "(":
+                values = []
+                for token in tokens:
+                    if token == ")":
+                        break
+                    if token != ",":
+                        values.append(_sql_literal(token))
+                yield target, dict(zip(columns, values))
+                token = next(tokens, ";")
+                if token == ",":
+                    token = next(tokens)
+            if token != ";":
+                raise ValueError(f"Unexpected token {token!r} in INSERT into {target}")
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl, "sql": read_sql}
+
+# ---------- Loading ----------
+
+def _converter(column):
+    if isinstance(column.type, Date):
+        return lambda v: v if isinstance(v, date) else date.fromisoformat(v)
+    if isinstance(column.type, Integer):
+        return int
+    if isinstance(column.type, Float):
+        return float
+    return str
+
+def _split_tags(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return models.clean_tag_names(value)
+
+class Importer:
+    """Buffers rows per table and writes them in batches on one connection."""
+
+    def __init__(self, conn, batch_size=DEFAULT_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.pending = {}
+        self.counts = {}
+        self.tag_ids = {}
+        self.catalog_changed = False
+        self._converters = {}
+        self._tables = {name.lower(): table for name, table in models.Base.metadata.tables.items()}
+
+    def _table(self, name):
+        if name.lower() not in self._tables:
+            raise ValueError(f"Unknown table: {name}")
+        return self._tables[name.lower()]
+
+    def _convert(self, table, row):
+        if table.name not in self._converters:
+            self._converters[table.name] = {c.name: _converter(c) for c in table.columns}
+        converters = self._converters[table.name]
+        out = {}
+        for key, value in row.items():
+            if key not in converters:
+                raise ValueError(f"Unknown column {table.name}.{key}")
+            out[key] = None if value is None else converters[key](value)
+        return out
+
+    def add(self, table_name, row):
+        table = self._table(table_name)
+        tags = None
+        if table.name in TAG_COLUMNS:
+            row = dict(row)
+            tags = _split_tags(row.pop(TAG_COLUMNS[table.name][0], None))
+        batch = self.pending.setdefault(table.name, [])
+        batch.append((self._convert(table, row), tags))
+        if len(batch) >= self.batch_size:
+            self.flush(table.name)
+
+    def _get_tag_ids(self, tag_model, names):
+        ids = self.tag_ids.setdefault(tag_model.__tablename__, {})
+        missing = [name for name in dict.fromkeys(names) if name not in ids]
+        if missing:
+            table = tag_model.__table__
+            found = dict(self.conn.execute(select(table.c.name, table.c.id).where(table.c.name.in_(missing))).all())
+            new = [name for name in missing if name not in found]
+            if new:
+                self.conn.execute(table.insert(), [{"name": name} for name in new])
+                found.update(self.conn.execute(select(table.c.name, table.c.id).where(table.c.name.in_(new))).all())
+            ids.update(found)
+        return ids
+
+    def flush(self, table_name):
+        batch = self.pending.pop(table_name, None)
+        if not batch:
+            return
+        table = models.Base.metadata.tables[table_name]
+        rows = [row for row, _ in batch]
+        try:
+            self._write(table, batch, rows)
+        except IntegrityError as exc:
+            # The batch was rolled back; find the row that broke it
+            self.tag_ids.clear()
+            raise self._failing_row(table, rows, exc) from exc
+        self.counts[table_name] = self.counts.get(table_name, 0) + len(rows)
+        if table_name in CATALOG_TABLES:
+            self.catalog_changed = True
+
+    def _failing_row(self, table, rows, exc):
+        """Replay rows one by one in a transaction that is rolled back; returns a RowError."""
+        loaded = self.counts.get(table.name, 0)
+        with self.conn.begin() as transaction:
+            try:
+                for position, row in enumerate(rows):
+                    self.conn.execute(table.insert(), row)
+            except IntegrityError as row_exc:
+                return RowError(table.name, loaded + position + 1, f"{row_exc.orig} {row}")
+            finally:
+                transaction.rollback()
+        # The rows insert cleanly on their own, so it was the tag links
+        return RowError(table.name, loaded + 1, f"{exc.orig} (in the batch of {len(rows)} rows starting here)")
+
+    def _write(self, table, batch, rows):
+        table_name = table.name
+        with self.conn.begin():
+            if table_name in TAG_COLUMNS and any(tags for _, tags in batch):
+                _, tag_model, link_model, owner_key, tag_key = TAG_COLUMNS[table_name]
+                if all(row.get("id") is not None for row in rows):
+                    self.conn.execute(table.insert(), rows)
+                    owner_ids = [row["id"] for row in rows]
+                else:
+                    # Ordered RETURNING can fall back to one INSERT per row, so
+                    # it is only used when the source has no ids
+                    result = self.conn.execute(
+                        table.insert().returning(table.c.id, sort_by_parameter_order=True), rows
+                    )
+                    owner_ids = [r.id for r in result]
+                tag_ids = self._get_tag_ids(tag_model, [name for _, tags in batch for name in tags])
+                links = [
+                    {owner_key: owner_id, tag_key: tag_ids[name], "position": position}
+                    for owner_id, (_, tags) in zip(owner_ids, batch)
+                    for position, name in enumerate(tags)
+                ]
+                if links:
+                    self.conn.execute(link_model.__table__.insert(), links)
+            else:
+                self.conn.execute(table.insert(), rows)
+            if table_name in CATALOG_TABLES:
+                models.bump_catalog_version(self.conn)
+
+    def flush_all(self):
+        # Parents before children so foreign keys line up on backends that enforce them
+        for table in models.Base.metadata.sorted_tables:
+            self.flush(table.name)
+
+def secondary_indexes():
+    """Non-unique indexes; unique ones stay since they enforce constraints."""
+    return [index for table in models.Base.metadata.sorted_tables for index in table.indexes if not index.unique]
+
+def foreign_key_violations(conn, sample_size=20):
+    """Return (number of violations, the first few of them) from PRAGMA foreign_key_check."""
+    if conn.dialect.name != "sqlite":
+        return 0, []
+    total, sample = 0, []
+    for row in conn.execute(text("PRAGMA foreign_key_check")):
+        if total < sample_size:
+            sample.append(tuple(row))
+        total += 1
+    return total, sample
+
+def import_files(engine, sources, batch_size=DEFAULT_BATCH_SIZE, rebuild_indexes=False):
+    """Load (path, format, table) sources.
+
+    Returns the row counts per table and (count, sample) of foreign key violations.
+    """
+    models.init_db(engine)
+    dropped = []
+    if rebuild_indexes:
+        dropped = secondary_indexes()
+        for index in dropped:
+            index.drop(bind=engine, checkfirst=True)
+    try:
+        with engine.connect() as conn:
+            if conn.dialect.name == "sqlite":
+                # Checked once at the end instead of per row
+                conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            conn.commit()
+            importer = Importer(conn, batch_size=batch_size)
+            for path, fmt, table in sources:
+                for table_name, row in READERS[fmt](path, table):
+                    importer.add(table_name, row)
+            try:
+                importer.flush_all()
+            finally:
+                if importer.catalog_changed:
+                    with conn.begin():
+                        conn.execute(delete(models.UserRecommendation))
+            violations = foreign_key_violations(conn)
+    finally:
+        for index in dropped:
+            index.create(bind=engine, checkfirst=True)
+    return importer.counts, violations
+
+def _source(path, fmt=None, table=None):
+    fmt = fmt or FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Cannot tell the format of {path}; pass --format")
+    if fmt != "sql" and table is None:
+        table = os.path.splitext(os.path.basename(path))[0]
+    return path, fmt, table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--table", help="target table for CSV/JSONL files (default: from the file name)")
+    parser.add_argument("--format", choices=sorted(READERS))
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--rebuild-indexes", action="store_true")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", models.DATABASE_URL))
+    args = parser.parse_args()
+
+    sources = [_source(path, args.format, args.table) for path in args.files]
+    started = time.perf_counter()
+    try:
+        counts, violations = import_files(
+            build_engine(args.database_url), sources,
+            batch_size=args.batch_size, rebuild_indexes=args.rebuild_indexes,
+        )
+    except RowError as exc:
+        print(f"Import stopped at {exc}", file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    for table_name, count in counts.items():
+        print(f"{table_name}: {count} rows")
+    print(f"Imported {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)")
+    violation_count, sample = violations
+    if violation_count:
+        for table_name, rowid, parent, _ in sample:
+            print(f"Foreign key violation: {table_name} row {rowid} references missing {parent}", file=sys.stderr)
+        print(f"{violation_count} foreign key violations", file=sys.stderr)
+        sys.exit(1)
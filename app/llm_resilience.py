@@ -0,0 +1,269 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+# ---------- Resilient LLM completions ----------
+# ResilientLLM wraps utils.get_completion_async (or any function with the same
+# signature) for the recommendation routes:
+#
+# - deadline: the whole call, retries included, gives up after `timeout`
+#   seconds, and every attempt after `attempt_timeout` seconds;
+# - retries: failed attempts are retried up to `max_attempts` times with full
+#   jitter backoff (a random sleep in [0, min(cap, base * 2**n)]), preferring a
+#   target other than the one that just failed;
+# - hedging: if an attempt is still running after the model's recent p95
+#   latency (or `hedge_after` until enough samples exist), a second attempt is
+#   sent to the next target (an alternate model, or the same one) and the first
+#   answer wins;
+# - circuit breaker: each provider's breaker opens after `breaker_failures`
+#   consecutive failures and fails fast for `breaker_reset` seconds, after which
+#   a single probe is let through.
+#
+# Targets are (client, model_name, api_provider) tuples, as returned by
+# LLMClientRegistry.get(). Failures raise CompletionError, a ValueError, so
+# callers that already fall back on ValueError keep doing so.
+
+class CompletionError(ValueError):
+    pass
+
+class CompletionTimeout(CompletionError):
+    pass
+
+class CircuitOpenError(CompletionError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. In half-open state only one probe is allowed at a time."""
+        if self.state == "open":
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open":
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def release(self):
+        """Give back a half-open probe that ended without an outcome (e.g. cancelled)."""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = self.clock()
+
+class LatencyWindow:
+    """The most recent successful call latencies of one model."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float):
+        """Nearest-rank percentile, or None until min_samples calls were seen."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+class ResilientLLM:
+    def __init__(self, timeout: float = 30.0, attempt_timeout: float = 15.0, max_attempts: int = 3,
+                 backoff_base: float = 0.25, backoff_cap: float = 2.0, hedge: bool = True,
+                 hedge_after: float = 2.0, hedge_percentile: float = 95, breaker_failures: int = 5,
+                 breaker_reset: float = 30.0, rng=None):
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.rng = rng or random.Random()
+        self.reset()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            timeout=float(os.getenv("LLM_TIMEOUT", "30")),
+            attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT", "15")),
+            max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", "3")),
+            backoff_base=float(os.getenv("LLM_BACKOFF_BASE", "0.25")),
+            backoff_cap=float(os.getenv("LLM_BACKOFF_CAP", "2")),
+            hedge=os.getenv("LLM_HEDGE", "1") == "1",
+            hedge_after=float(os.getenv("LLM_HEDGE_AFTER", "2")),
+            breaker_failures=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            breaker_reset=float(os.getenv("LLM_BREAKER_RESET", "30")),
+        )
+
+    def reset(self):
+        self.breakers = {}
+        self.latencies = {}
+        self.counts = {"attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0, "short_circuits": 0}
+
+    def breaker(self, provider) -> CircuitBreaker:
+        breaker = self.breakers.get(provider)
+        if breaker is None:
+            breaker = self.breakers[provider] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+        return breaker
+
+    def hedge_delay(self, model_name) -> float:
+        window = self.latencies.get(model_name)
+        p95 = window.percentile(self.hedge_percentile) if window else None
+        return self.hedge_after if p95 is None else p95
+
+    def stats(self) -> dict:
+        return dict(self.counts, open_circuits=sum(1 for b in self.breakers.values() if b.state == "open"))
+
+    def _pick(self, targets, avoid=()):
+        """First target whose breaker lets a call through, preferring those not in avoid."""
+        for candidates in ([t for t in targets if t not in avoid], [t for t in targets if t in avoid]):
+            for target in candidates:
+                if self.breaker(target[2]).allow():
+                    return target
+        return None
+
+    async def _attempt(self, call, target, prompt, temperature, deadline):
+        client, model_name, api_provider = target
+        loop = asyncio.get_running_loop()
+        timeout = max(0.0, min(self.attempt_timeout, deadline - loop.time()))
+        self.counts["attempts"] += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(
+                call(prompt, client, model_name, api_provider, temperature=temperature, raise_errors=True), timeout
+            )
+        except asyncio.TimeoutError:
+            self.counts["timeouts"] += 1
+            self.breaker(api_provider).record_failure()
+            raise CompletionTimeout(f"{api_provider}/{model_name} did not answer within {timeout:.1f}s")
+        except asyncio.CancelledError:
+            # A hedge lost the race; not the provider's fault
+            self.breaker(api_provider).release()
+            raise
+        except Exception as e:
+            self.breaker(api_provider).record_failure()
+            raise CompletionError(f"{api_provider}/{model_name} failed: {e}") from e
+        self.breaker(api_provider).record_success()
+        self.latencies.setdefault(model_name, LatencyWindow()).add(time.perf_counter() - started)
+        return result
+
+    async def _round(self, call, targets, prompt, temperature, deadline, avoid):
+        """One attempt, plus a hedge if it is slow. Returns (result, None) or (None, (failed targets, last error))."""
+        loop = asyncio.get_running_loop()
+        first = self._pick(targets, avoid)
+        if first is None:
+            self.counts["short_circuits"] += 1
+            raise CircuitOpenError("every provider's circuit breaker is open")
+        tasks = {asyncio.ensure_future(self._attempt(call, first, prompt, temperature, deadline)): first}
+        hedged = not self.hedge
+        failed, error = [], None
+        try:
+            while tasks:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    # Attempts still running at the deadline count as timeouts
+                    for target in tasks.values():
+                        self.counts["timeouts"] += 1
+                        self.breaker(target[2]).record_failure()
+                    raise CompletionTimeout(f"no answer within {self.timeout:.1f}s")
+                wait = remaining if hedged else min(remaining, self.hedge_delay(first[1]))
+                done, _ = await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    target = tasks.pop(task)
+                    if task.exception() is None:
+                        if target is not first:
+                            self.counts["hedge_wins"] += 1
+                        return task.result(), None
+                    failed.append(target)
+                    error = task.exception()
+                if not done and not hedged:
+                    hedged = True
+                    second = self._pick(targets, avoid=(first,))
+                    if second is not None:
+                        self.counts["hedges"] += 1
+                        tasks[asyncio.ensure_future(self._attempt(call, second, prompt, temperature, deadline))] = second
+            return None, (failed, error)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def complete(self, prompt, targets, call, temperature=0.7):
+        """Completion text from the first target that answers; raises CompletionError when all attempts fail."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        avoid, error = (), None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                delay = self.rng.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** (attempt - 1)))
+                if loop.time() + delay >= deadline:
+                    break
+                self.counts["retries"] += 1
+                await asyncio.sleep(delay)
+            result, failure = await self._round(call, targets, prompt, temperature, deadline, avoid)
+            if failure is None:
+                return result
+            avoid, error = failure
+        raise error if isinstance(error, CompletionError) else CompletionError("LLM completion failed")
+
+    async def stream(self, call, target, prompt, temperature=0.7):
+        """Breaker- and deadline-guarded wrapper around a streaming completion (no retries or hedging)."""
+        client, model_name, api_provider = target
+        breaker = self.breaker(api_provider)
+        if not breaker.allow():
+            self.counts["short_circuits"] += 1
+            raise CircuitOpenError(f"{api_provider} circuit breaker is open")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        # The first chunk must arrive within attempt_timeout
+        chunk_deadline = min(deadline, loop.time() + self.attempt_timeout)
+        chunks = call(prompt, client, model_name, api_provider, temperature=temperature)
+        answered = False
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), max(0.0, chunk_deadline - loop.time()))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self.counts["timeouts"] += 1
+                    breaker.record_failure()
+                    raise CompletionTimeout(f"{api_provider}/{model_name} stream timed out")
+                except Exception as e:
+                    breaker.record_failure()
+                    raise CompletionError(f"{api_provider}/{model_name} failed: {e}") from e
+                if not answered:
+                    answered = True
+                    breaker.record_success()
+                    chunk_deadline = deadline
+                yield chunk
+        finally:
+            if not answered:
+                breaker.release()
+            await chunks.aclose()
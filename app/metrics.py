@@ -0,0 +1,286 @@
+"""Prometheus metrics for the API, the database and LLM calls.
+
+A small in-process registry rendered in the Prometheus text format by
+GET /metrics. Counters and histograms are labelled; callback gauges read their
+value when scraped (used for the recommendation cache stats).
+"""
+import bisect
+import threading
+import time
+
+from sqlalchemy import event
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+class Histogram:
+    type = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(labels[name] for name in self.labelnames))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                samples.append((self.name + "_bucket", labels, cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+class CallbackGauge:
+    """Gauge (or counter, with type="counter") whose value is read at scrape time."""
+
+    def __init__(self, name, help, callback, type="gauge"):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.type = type
+
+    def samples(self):
+        return [(self.name, "", self.callback())]
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge_callback(self, name, help, callback, type="gauge"):
+        return self.register(CallbackGauge(name, help, callback, type))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# ---------- HTTP ----------
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route and status code", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+)
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request, labelled by route template (not raw path)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_duration.observe(time.perf_counter() - started, method=scope["method"], route=route)
+            http_requests.inc(method=scope["method"], route=route, status=str(status))
+
+# ---------- Database ----------
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+db_queries = registry.counter("db_queries_total", "SQL statements executed", ("operation",))
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "SQL statement latency", ("operation",), buckets=DB_BUCKETS
+)
+
+def _operation(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+def instrument_engine(engine):
+    """Count and time every statement run through the engine (sync or async)."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if getattr(sync_engine, "_metrics_instrumented", False):
+        return
+    sync_engine._metrics_instrumented = True
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        operation = _operation(statement)
+        db_queries.inc(operation=operation)
+        db_query_duration.observe(elapsed, operation=operation)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("metrics_started"):
+            conn.info["metrics_started"].pop()
+
+# ---------- LLM ----------
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+llm_requests = registry.counter(
+    "llm_requests_total", "LLM completions by provider, model and outcome", ("provider", "model", "outcome")
+)
+llm_request_duration = registry.histogram(
+    "llm_request_duration_seconds", "LLM completion latency", ("provider", "model"), buckets=LLM_BUCKETS
+)
+llm_tokens = registry.counter("llm_tokens_total", "LLM tokens used", ("provider", "model", "type"))
+
+PROMPT_TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+llm_prompt_tokens = registry.histogram(
+    "llm_prompt_tokens", "Recommendation prompt size in tokens, by part", ("part",), buckets=PROMPT_TOKEN_BUCKETS
+)
+
+def observe_prompt(tokens: dict):
+    """Record a RecommendationPrompt's token counts ({"instructions", "catalog", "candidates", "user", "total"})."""
+    for part, count in tokens.items():
+        llm_prompt_tokens.observe(count, part=part)
+
+def observe_completion(provider, model, seconds, usage, error):
+    """Completion observer for utils.completion_observers."""
+    provider = provider or "unknown"
+    llm_requests.inc(provider=provider, model=model, outcome="error" if error else "success")
+    llm_request_duration.observe(seconds, provider=provider, model=model)
+    for kind, count in (usage or {}).items():
+        if count:
+            llm_tokens.inc(count, provider=provider, model=model, type=kind)
+
+def register_llm_resilience(resilient):
+    """Expose ResilientLLM.stats() (retries, hedges, breaker state) at scrape time."""
+    for name, help in (
+        ("attempts", "LLM attempts sent, hedges and retries included"),
+        ("retries", "LLM retries after a failed attempt"),
+        ("hedges", "Hedged LLM requests sent"),
+        ("hedge_wins", "Hedged LLM requests that answered first"),
+        ("timeouts", "LLM attempts that hit their deadline"),
+        ("short_circuits", "LLM calls refused by an open circuit breaker"),
+    ):
+        registry.gauge_callback(f"llm_{name}_total", help, lambda name=name: resilient.stats()[name], type="counter")
+    registry.gauge_callback("llm_open_circuits", "Providers whose circuit breaker is open",
+                            lambda: resilient.stats()["open_circuits"])
+
+# ---------- Recommendation cache ----------
+def register_cache(cache, prefix="recommendation_cache"):
+    """Expose RecommendationCache.stats() at scrape time."""
+    registry.gauge_callback(f"{prefix}_hits_total", "Cache hits", lambda: cache.stats()["hits"], type="counter")
+    registry.gauge_callback(f"{prefix}_misses_total", "Cache misses", lambda: cache.stats()["misses"], type="counter")
+    registry.gauge_callback(
+        f"{prefix}_evictions_total", "Cache evictions", lambda: cache.stats()["evictions"], type="counter"
+    )
+    registry.gauge_callback(f"{prefix}_size", "Cached entries", lambda: cache.stats()["size"])
+    registry.gauge_callback(f"{prefix}_hit_ratio", "Hits / lookups", lambda: cache.stats()["hit_rate"])
+
+def register_single_flight(flight, prefix="recommendation_singleflight"):
+    """Expose SingleFlight.stats() at scrape time."""
+    registry.gauge_callback(f"{prefix}_in_flight", "Computations in progress", lambda: flight.stats()["in_flight"])
+    registry.gauge_callback(
+        f"{prefix}_waiters", "Requests waiting on another request's computation", lambda: flight.stats()["waiters"]
+    )
+    registry.gauge_callback(f"{prefix}_calls_total", "Computations started", lambda: flight.stats()["calls"], type="counter")
+    registry.gauge_callback(
+        f"{prefix}_coalesced_total", "Requests that shared an in-flight computation (calls saved)",
+        lambda: flight.stats()["coalesced"], type="counter",
+    )
+
+def register_recommendation_worker(worker, prefix="recommendation_refresh"):
+    """Expose RecommendationWorker.stats() at scrape time."""
+    stat = lambda name: lambda: worker.stats()[name]
+    registry.gauge_callback(f"{prefix}_pending_users", "Users waiting for a refresh", stat("pending"))
+    registry.gauge_callback(
+        f"{prefix}_catalog_refresh_scheduled", "1 while a catalog refresh is scheduled", stat("catalog_refresh_scheduled")
+    )
+    registry.gauge_callback(f"{prefix}_running_batches", "Batches being refreshed", stat("running"))
+    registry.gauge_callback(f"{prefix}_batches_total", "Batches refreshed", stat("batches"), type="counter")
+    registry.gauge_callback(f"{prefix}_users_total", "Users refreshed", stat("users"), type="counter")
+    registry.gauge_callback(f"{prefix}_retrying_users", "Users waiting to retry a failed refresh", stat("retrying"))
+    registry.gauge_callback(f"{prefix}_failures_total", "Batches that failed", stat("failures"), type="counter")
+    registry.gauge_callback(
+        f"{prefix}_dropped_users_total", "Users given up on after every retry failed", stat("dropped"), type="counter"
+    )
+    registry.gauge_callback(
+        f"{prefix}_catalog_refreshes_total", "Catalog refreshes started", stat("catalog_refreshes"), type="counter"
+    )
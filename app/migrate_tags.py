@@ -0,0 +1,61 @@
+"""Move comma-separated Users.interests / Properties.amenities into tag tables.
+
+Older copies of travel.db store interests and amenities as comma-separated text
+columns. This migration creates the Interests/Amenities tables and their link
+tables, copies the data over (keeping the original order) and then drops the
+old columns. It is safe to run more than once.
+
+Usage:
+    python migrate_tags.py [--database-url sqlite:///./travel.db]
+"""
+import argparse
+
+from sqlalchemy import create_engine, inspect, text
+
+import models_sqlalchemy as models
+
+def _split(value):
+    if value is None:
+        return []
+    return models.clean_tag_names(value.split(","))
+
+def _migrate_column(conn, owner_table, column, tag_model, link_table, owner_key, tag_key):
+    if column not in {c["name"] for c in inspect(conn).get_columns(owner_table)}:
+        return 0
+    rows = conn.execute(text(f'SELECT id, "{column}" FROM "{owner_table}"')).all()
+    names = models.clean_tag_names(name for _, value in rows for name in _split(value))
+    tag_table = tag_model.__table__
+    existing = {name for (name,) in conn.execute(text(f'SELECT name FROM "{tag_table.name}"'))}
+    new_names = [name for name in names if name not in existing]
+    if new_names:
+        conn.execute(tag_table.insert(), [{"name": name} for name in new_names])
+    tag_ids = dict(conn.execute(text(f'SELECT name, id FROM "{tag_table.name}"')).all())
+    links = [
+        {owner_key: owner_id, tag_key: tag_ids[name], "position": position}
+        for owner_id, value in rows
+        for position, name in enumerate(_split(value))
+    ]
+    if links:
+        conn.execute(link_table.insert(), links)
+    conn.execute(text(f'ALTER TABLE "{owner_table}" DROP COLUMN "{column}"'))
+    return len(links)
+
+def migrate(engine):
+    models.init_db(engine)
+    with engine.begin() as conn:
+        interests = _migrate_column(
+            conn, "Users", "interests", models.Interest,
+            models.UserInterest.__table__, "user_id", "interest_id",
+        )
+        amenities = _migrate_column(
+            conn, "Properties", "amenities", models.Amenity,
+            models.PropertyAmenity.__table__, "property_id", "amenity_id",
+        )
+    return interests, amenities
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=models.DATABASE_URL)
+    args = parser.parse_args()
+    interests, amenities = migrate(create_engine(args.database_url))
+    print(f"Migrated {interests} user interests and {amenities} property amenities")
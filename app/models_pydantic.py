@@ -1,5 +1,6 @@
-from typing import Optional, List
+from typing import Any, Optional, List
 from datetime import date
+from enum import Enum
 from pydantic import BaseModel, EmailStr, Field
 
 class UserBase(BaseModel):
@@ -52,6 +53,10 @@ class PropertyResponse(PropertyBase):
     class Config:
         orm_mode = True
 
+class RecommendationEngine(str, Enum):
+    llm = "llm"
+    local = "local"
+
 class ReservationBase(BaseModel):
     user_id: int
     property_id: int
@@ -73,3 +78,20 @@ class ReservationResponse(ReservationBase):
 
     class Config:
         orm_mode = True
+
+# ---------- Bulk create ----------
+class BulkItemError(BaseModel):
+    index: int
+    detail: Any
+
+class UserBulkResponse(BaseModel):
+    created: List[UserResponse]
+    errors: List[BulkItemError]
+
+class PropertyBulkResponse(BaseModel):
+    created: List[PropertyResponse]
+    errors: List[BulkItemError]
+
+class ReservationBulkResponse(BaseModel):
+    created: List[ReservationResponse]
+    errors: List[BulkItemError]
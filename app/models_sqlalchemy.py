@@ -1,5 +1,7 @@
+import uuid
+
 from sqlalchemy import (
-    Column, Integer, String, Float, Date, ForeignKey, Text, create_engine, Index, UniqueConstraint
+    Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, UniqueConstraint, insert, select, update
 )
 from sqlalchemy.orm import declarative_base, relationship
 
@@ -7,41 +9,189 @@ DATABASE_URL = "sqlite:///./travel.db"
 
 Base = declarative_base()
 
+# Interests and amenities are stored once in their own tables and linked to
+# users/properties through association rows. `position` keeps the order the
+# client sent them in.
+
+class Interest(Base):
+    __tablename__ = "Interests"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False, unique=True, index=True)
+
+class Amenity(Base):
+    __tablename__ = "Amenities"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False, unique=True, index=True)
+
+class UserInterest(Base):
+    __tablename__ = "UserInterests"
+    user_id = Column(Integer, ForeignKey("Users.id", ondelete="CASCADE"), primary_key=True)
+    interest_id = Column(Integer, ForeignKey("Interests.id", ondelete="CASCADE"), primary_key=True)
+    position = Column(Integer, nullable=False, default=0)
+
+    interest = relationship("Interest", lazy="joined")
+
+    # Reverse lookup: users with a given interest
+    __table_args__ = (Index("ix_UserInterests_interest_id_user_id", "interest_id", "user_id"),)
+
+class PropertyAmenity(Base):
+    __tablename__ = "PropertyAmenities"
+    property_id = Column(Integer, ForeignKey("Properties.id", ondelete="CASCADE"), primary_key=True)
+    amenity_id = Column(Integer, ForeignKey("Amenities.id", ondelete="CASCADE"), primary_key=True)
+    position = Column(Integer, nullable=False, default=0)
+
+    amenity = relationship("Amenity", lazy="joined")
+
+    # Reverse lookup: properties with a given amenity
+    __table_args__ = (Index("ix_PropertyAmenities_amenity_id_property_id", "amenity_id", "property_id"),)
+
 class User(Base):
     __tablename__ = "Users"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
     email = Column(String(255), nullable=False, unique=True, index=True)
-    interests = Column(Text, nullable=True)  # comma-separated
 
+    interest_links = relationship(
+        "UserInterest", order_by=UserInterest.position, cascade="all, delete-orphan", lazy="selectin"
+    )
     reservations = relationship("Reservation", back_populates="user", cascade="all, delete-orphan")
 
+    @property
+    def interests(self):
+        return [link.interest.name for link in self.interest_links]
+
 class Property(Base):
     __tablename__ = "Properties"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
     address_line1 = Column(String(255), nullable=False)
     address_line2 = Column(String(255), nullable=True)
-    city = Column(String(100), nullable=False)
-    state = Column(String(100), nullable=False)
+    city = Column(String(100), nullable=False, index=True)
+    state = Column(String(100), nullable=False, index=True)
     zip_code = Column(String(20), nullable=False)
     country = Column(String(100), nullable=False, default="USA")
-    price_per_night = Column(Float, nullable=False)
-    amenities = Column(Text, nullable=True)  # comma-separated
+    price_per_night = Column(Float, nullable=False, index=True)
 
+    amenity_links = relationship(
+        "PropertyAmenity", order_by=PropertyAmenity.position, cascade="all, delete-orphan", lazy="selectin"
+    )
     reservations = relationship("Reservation", back_populates="property", cascade="all, delete-orphan")
 
+    @property
+    def amenities(self):
+        return [link.amenity.name for link in self.amenity_links]
+
 class Reservation(Base):
     __tablename__ = "Reservations"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("Users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("Users.id"), nullable=False, index=True)
     property_id = Column(Integer, ForeignKey("Properties.id"), nullable=False)
-    check_in_date = Column(Date, nullable=False)
+    check_in_date = Column(Date, nullable=False, index=True)
     check_out_date = Column(Date, nullable=False)
     reservation_date = Column(Date, nullable=False)
 
     user = relationship("User", back_populates="reservations")
     property = relationship("Property", back_populates="reservations")
 
+    # Serves property_id lookups as well as date-overlap probes for a property
+    __table_args__ = (
+        Index("ix_Reservations_property_id_dates", "property_id", "check_in_date", "check_out_date"),
+    )
+
+# Precomputed LLM recommendations, refreshed in the background (see
+# recommendation_worker.py). The primary key serves "a user's rows by rank";
+# computed_at is naive UTC.
+class UserRecommendation(Base):
+    __tablename__ = "UserRecommendations"
+    user_id = Column(Integer, ForeignKey("Users.id", ondelete="CASCADE"), primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    property_id = Column(Integer, ForeignKey("Properties.id", ondelete="CASCADE"), nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+    # Deleting a property removes its rows for every user
+    __table_args__ = (Index("ix_UserRecommendations_property_id", "property_id"),)
+
+# Version of the property catalog (Properties and their amenities), shared by
+# every process using the database. Each catalog write increments it in its
+# own transaction, so API workers and the command-line tools all see the same
+# value (see catalog.py). The epoch is set when the row is created and tells
+# a recreated database from the old one. A single row, created by the first bump.
+class CatalogState(Base):
+    __tablename__ = "CatalogState"
+    id = Column(Integer, primary_key=True)
+    epoch = Column(String(32), nullable=False)
+    version = Column(Integer, nullable=False)
+
+def bump_catalog_version(db):
+    """Increment the catalog version in the caller's transaction; returns (epoch, version).
+
+    db is a Session or a Connection.
+    """
+    table = CatalogState.__table__
+    if db.execute(update(table).where(table.c.id == 1).values(version=table.c.version + 1)).rowcount == 0:
+        db.execute(insert(table).values(id=1, epoch=uuid.uuid4().hex, version=1))
+    return read_catalog_state(db)
+
+def read_catalog_state(db):
+    """(epoch, version) of the catalog; ("", 0) before its first write."""
+    table = CatalogState.__table__
+    row = db.execute(select(table.c.epoch, table.c.version).where(table.c.id == 1)).first()
+    return (row.epoch, row.version) if row else ("", 0)
+
 #Index("ix_users_email", User.email, unique=True)
 UniqueConstraint("email", name="uq_users_email")
+
+def init_db(bind):
+    """Create missing tables, plus any declared indexes an existing database lacks."""
+    Base.metadata.create_all(bind=bind)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+# ---------- Tag helpers ----------
+def clean_tag_names(names):
+    """Strip, drop blanks and de-duplicate while keeping the original order."""
+    if not names:
+        return []
+    return list(dict.fromkeys(n.strip() for n in names if n and n.strip()))
+
+def get_or_create_tags(db, tag_model, names):
+    """Return tag rows for the given names, in order, inserting any that are new.
+
+    Existing tags are found with a single IN query on the indexed name column.
+    The probe and the insert race other writers; callers take the write lock
+    first (lock_sqlite_writes in the API) so two requests adding the same new
+    name do not both insert it.
+    """
+    names = clean_tag_names(names)
+    if not names:
+        return []
+    existing = {t.name: t for t in db.query(tag_model).filter(tag_model.name.in_(names)).all()}
+    for name in names:
+        if name not in existing:
+            existing[name] = tag_model(name=name)
+            db.add(existing[name])
+    return [existing[name] for name in names]
+
+def _sync_links(links, tags, make_link, tag_attr):
+    # Reuse link rows that survive so their composite primary keys are not
+    # deleted and re-inserted in the same flush.
+    current = {getattr(link, tag_attr).name: link for link in links}
+    new_links = []
+    for position, tag in enumerate(tags):
+        link = current.get(tag.name) or make_link(tag)
+        link.position = position
+        new_links.append(link)
+    return new_links
+
+def set_user_interests(db, user, names):
+    tags = get_or_create_tags(db, Interest, names)
+    user.interest_links = _sync_links(
+        user.interest_links, tags, lambda tag: UserInterest(interest=tag), "interest"
+    )
+
+def set_property_amenities(db, prop, names):
+    tags = get_or_create_tags(db, Amenity, names)
+    prop.amenity_links = _sync_links(
+        prop.amenity_links, tags, lambda tag: PropertyAmenity(amenity=tag), "amenity"
+    )
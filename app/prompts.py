@@ -0,0 +1,163 @@
+import csv
+import io
+import threading
+from collections import OrderedDict, namedtuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# ---------- Recommendation prompt ----------
+# The prompt is laid out from most to least stable, so providers that cache
+# prompt prefixes (OpenAI does so automatically from 1024 tokens) can reuse
+# the beginning across requests:
+#
+#   1. instructions, identical for every request;
+#   2. the shared catalog: the first properties in id order as CSV (header
+#      once, one short row each), up to `shared_tokens`. It depends only on
+#      the catalog version, so it is the same for every user;
+#   3. the user's candidates that are not in the shared catalog, as CSV rows;
+#   4. the candidate ids and the user's interests.
+#
+# With the default budget the cacheable prefix (1 and 2) is past OpenAI's 1024
+# token minimum once the catalog is big enough to fill it; smaller catalogs
+# fit entirely in the shared block, so only part 4 differs between users.
+#
+# CSV rows are cached per property, the shared block per catalog version and
+# candidate blocks per candidate list; all are dropped when the catalog
+# version changes.
+
+RECOMMENDATION_INSTRUCTIONS = """You are a travel agent.
+Recommend vacation properties that align with a user's interests.
+Base your recommendation on the city of each property and the activities popular there.
+Only recommend properties whose ids are in the user's candidate ids; the other properties are listed for context.
+Spread your recommendations across different interests and locations, consider every candidate, and favor unusual destinations that are not too touristy.
+Answer with a JSON array of at most 5 property ids, best first, without repeats and with nothing else in the response.
+"""
+CATALOG_HEADER = "Properties (CSV; amenities are separated by \";\"):\n"
+CANDIDATES_HEADER = "More properties (same columns):\n"
+CATALOG_COLUMNS = ("id", "name", "city", "state", "amenities")
+
+RecommendationPrompt = namedtuple("RecommendationPrompt", ["text", "tokens"])
+
+_encodings = {}
+
+def count_tokens(text: str, model_name: str = "gpt-4.1-mini") -> int:
+    """Token count from tiktoken when it is installed, otherwise ~4 characters per token."""
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    encoding = _encodings.get(model_name)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        _encodings[model_name] = encoding
+    return len(encoding.encode(text))
+
+def _csv_row(values) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
+
+class RecommendationPromptBuilder:
+    def __init__(self, max_blocks: int = 256, model_name: str = "gpt-4.1-mini", shared_tokens: int = 2048):
+        self.max_blocks = max_blocks
+        self.model_name = model_name
+        self.shared_tokens = shared_tokens
+        # Rows to offer set_shared: catalog rows are rarely under 8 tokens
+        self.shared_limit = shared_tokens // 8
+        self._version = None
+        self._rows = {}
+        self._shared = None  # (text, token count, ids) for self._version
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self.instructions_tokens = count_tokens(RECOMMENDATION_INSTRUCTIONS, model_name)
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, catalog_version: int):
+        if catalog_version != self._version:
+            self._version = catalog_version
+            self._rows.clear()
+            self._shared = None
+            self._blocks.clear()
+
+    def _row(self, prop) -> str:
+        row = self._rows.get(prop.id)
+        if row is None:
+            row = self._rows[prop.id] = _csv_row(
+                [prop.id, prop.name, prop.city, prop.state, ";".join(prop.amenities)]
+            )
+        return row
+
+    def needs_shared(self, catalog_version: int) -> bool:
+        with self._lock:
+            return catalog_version != self._version or self._shared is None
+
+    def set_shared(self, props, catalog_version: int):
+        """Build the shared catalog block from props in id order, stopping at the token budget."""
+        with self._lock:
+            self._check_version(catalog_version)
+            if self._shared is not None or not props:
+                return
+            text = CATALOG_HEADER + _csv_row(CATALOG_COLUMNS)
+            tokens = count_tokens(text, self.model_name)
+            ids = set()
+            for prop in sorted(props, key=lambda prop: prop.id):
+                row = self._row(prop)
+                tokens += count_tokens(row, self.model_name)
+                if tokens > self.shared_tokens:
+                    break
+                text += row
+                ids.add(prop.id)
+            self._shared = (text, count_tokens(text, self.model_name), ids) if ids else ("", 0, ids)
+
+    def catalog_block(self, props, catalog_version: int):
+        """(CSV rows, token count) for the properties not in the shared block, in the order given."""
+        with self._lock:
+            self._check_version(catalog_version)
+            shared_ids = self._shared[2] if self._shared is not None else ()
+            props = [prop for prop in props if prop.id not in shared_ids]
+            if not props:
+                return "", 0
+            key = tuple(prop.id for prop in props)
+            entry = self._blocks.get(key)
+            if entry is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            header = CANDIDATES_HEADER if shared_ids else CATALOG_HEADER + _csv_row(CATALOG_COLUMNS)
+            text = header + "".join(self._row(prop) for prop in props)
+            entry = self._blocks[key] = (text, count_tokens(text, self.model_name))
+            if len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+            return entry
+
+    def build(self, interests, props, catalog_version: int) -> RecommendationPrompt:
+        """Prompt for the candidate props; call set_shared first to get the shared prefix."""
+        candidates, candidates_tokens = self.catalog_block(props, catalog_version)
+        with self._lock:
+            shared, shared_tokens, _ = self._shared if self._shared is not None else ("", 0, ())
+        ids = "Candidate ids: " + ", ".join(str(prop.id) for prop in props) + "\n"
+        user = "User interests: " + ", ".join(interests) + "\n"
+        tokens = {
+            "instructions": self.instructions_tokens,
+            "catalog": shared_tokens,
+            "candidates": candidates_tokens + count_tokens(ids, self.model_name),
+            "user": count_tokens(user, self.model_name),
+        }
+        tokens["total"] = sum(tokens.values())
+        text = RECOMMENDATION_INSTRUCTIONS + "\n" + shared + candidates + "\n" + ids + user
+        return RecommendationPrompt(text, tokens)
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._rows.clear()
+            self._shared = None
+            self._blocks.clear()
+            self.hits = 0
+            self.misses = 0
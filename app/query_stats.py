@@ -0,0 +1,98 @@
+"""Per-request SQL statement counts and N+1 detection.
+
+QueryStatsMiddleware gives every HTTP request its own counter (through a
+context variable), the engine event listeners add each statement to it, and the
+totals are sent back as response headers:
+
+    X-DB-Queries: number of statements executed before the response started
+    X-DB-Time:    time spent in those statements, in milliseconds
+
+When one statement shape (the SQL text with its bound-parameter placeholders)
+runs more than N_PLUS_ONE_THRESHOLD times in a single request, a warning is
+logged, since that usually means a per-row query inside a loop.
+"""
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+class RequestQueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def repeated(self, threshold: int):
+        """Statement shapes that ran more than `threshold` times, most frequent first."""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+_current = ContextVar("request_query_stats", default=None)
+
+def current_stats():
+    return _current.get()
+
+def instrument_engine(engine):
+    """Attribute every statement run through the engine (sync or async) to the current request."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if getattr(sync_engine, "_query_stats_instrumented", False):
+        return
+    sync_engine._query_stats_instrumented = True
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("query_stats_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stats = _current.get()
+        started = conn.info.get("query_stats_started")
+        if stats is None or not started:
+            return
+        stats.seconds += time.perf_counter() - started.pop()
+        stats.count += 1
+        stats.shapes[statement] += 1
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_stats_started"):
+            conn.info["query_stats_started"].pop()
+
+class QueryStatsMiddleware:
+    def __init__(self, app, threshold: int = None):
+        self.app = app
+        self.threshold = threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestQueryStats()
+        token = _current.set(stats)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-DB-Queries"] = str(stats.count)
+                headers["X-DB-Time"] = f"{stats.seconds * 1000:.3f}"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _current.reset(token)
+            threshold = N_PLUS_ONE_THRESHOLD if self.threshold is None else self.threshold
+            for shape, count in stats.repeated(threshold):
+                logger.warning(
+                    "Possible N+1: statement ran %d times in %s %s: %s",
+                    count, scope["method"], scope["path"], " ".join(shape.split())[:300],
+                )
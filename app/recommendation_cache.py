@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# ---------- Recommendation result cache ----------
+# Caches the property ids returned by the LLM for a given set of interests.
+# Keys combine a hash of the normalized interests with the catalog version,
+# model name and temperature, so a property write or a model change simply
+# produces a new key. Entries are evicted least-recently-used first and expire
+# after a fixed time-to-live.
+
+def interests_hash(interests) -> str:
+    """Hash a comma-separated string (or list) of interests, ignoring case and order."""
+    if interests is None:
+        interests = []
+    elif isinstance(interests, str):
+        interests = interests.split(",")
+    normalized = sorted({i.strip().lower() for i in interests if i and i.strip()})
+    return hashlib.sha256("\n".join(normalized).encode("utf-8")).hexdigest()
+
+class RecommendationCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(interests, catalog_version: int, model_name: str, temperature: float):
+        return (interests_hash(interests), catalog_version, model_name, float(temperature))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_interests(self, interests) -> int:
+        """Drop every entry computed for the given interests; returns the number removed."""
+        digest = interests_hash(interests)
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == digest]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+# ---------- Single-flight ----------
+# Concurrent cache misses for the same key share one in-flight computation
+# instead of each calling the LLM. The computation runs in its own task, so a
+# caller that disconnects does not cancel it for the others waiting on it.
+# Coalescing is per process (and per event loop).
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0       # computations actually started
+        self.coalesced = 0   # callers that joined one already in flight (calls saved)
+        self.waiters = 0     # callers currently waiting on someone else's computation
+
+    async def do(self, key, fn):
+        """Await fn() once per key at a time; concurrent callers with the same key share the result."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.calls += 1
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+            return await asyncio.shield(task)
+        self.coalesced += 1
+        self.waiters += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.waiters -= 1
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every caller has gone away
+            task.exception()
+
+    def clear(self):
+        self._calls.clear()
+        self.calls = 0
+        self.coalesced = 0
+        self.waiters = 0
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "waiters": self.waiters,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
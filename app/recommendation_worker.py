@@ -0,0 +1,217 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ---------- Background recommendation refresh ----------
+# Keeps the UserRecommendations table up to date off the request path. Writes
+# enqueue work instead of computing anything themselves:
+#
+# - enqueue(user_id, ...) when a user is created or their interests change;
+# - enqueue_matching(terms) when properties with those search terms are added,
+#   changed or removed: only users with an interest matching one of the terms
+#   can see a different set of candidates. enqueue_all() refreshes everyone.
+#   Catalog writes tend to come in bursts, so the catalog refresh starts
+#   `catalog_delay` seconds after the first one and covers every write made in
+#   the meantime.
+#
+# Users are refreshed in batches of `batch_size` (the refresh function makes one
+# LLM call per distinct interest set in a batch), and at most `concurrency`
+# batches run at once. A catalog refresh pages through user ids with a keyset
+# query, so it never holds more than `concurrency` batches of ids in memory.
+# A batch that fails is not lost: its users are queued again after the next of
+# `retry_delays` (seconds), and given up on, with a log line, once those run
+# out. An error in the loop itself is logged and the loop carries on.
+# The queue lives in the process: work still pending at shutdown is dropped and
+# the rows it would have replaced keep being served, with their timestamp.
+
+# Seconds to wait after an error outside a batch (e.g. listing users failed)
+ERROR_DELAY = 1.0
+
+class RecommendationWorker:
+    def __init__(self, refresh, list_user_ids, concurrency: int = 4, batch_size: int = 50,
+                 catalog_delay: float = 5.0, retry_delays=(1.0, 10.0, 60.0)):
+        self.refresh = refresh              # async refresh(user_ids)
+        # async list_user_ids(after, limit, terms): ascending ids of the users with
+        # an interest matching one of the terms, or of every user if terms is None
+        self.list_user_ids = list_user_ids
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.catalog_delay = catalog_delay
+        self.retry_delays = retry_delays
+        self._task = None
+        self._wake = None
+        self.clear()
+
+    def clear(self):
+        self._pending = {}       # user ids in arrival order (dict as an ordered set)
+        self._catalog_due = None     # loop time at which the scheduled catalog refresh starts
+        self._catalog_terms = set()  # terms it covers; None for every user
+        self._retry_at = {}      # user id -> loop time at which its failed refresh is retried
+        self._attempts = {}      # user id -> failed refreshes since the last success
+        self.running = 0         # batches being refreshed right now
+        self.batches = 0
+        self.users = 0
+        self.failures = 0
+        self.dropped = 0
+        self.catalog_refreshes = 0
+
+    def enqueue(self, *user_ids):
+        for user_id in user_ids:
+            self._retry_at.pop(user_id, None)
+            self._pending[user_id] = None
+        self._notify()
+
+    def enqueue_matching(self, terms):
+        """Schedule a refresh of the users interested in any of the terms; calls before it starts are merged."""
+        self._schedule_catalog_refresh(set(terms), self.catalog_delay)
+
+    def enqueue_all(self):
+        """Schedule a refresh of every user, merged like enqueue_matching."""
+        self._schedule_catalog_refresh(None, self.catalog_delay)
+
+    def _schedule_catalog_refresh(self, terms, delay: float):
+        if terms is None:
+            self._catalog_terms = None
+        elif self._catalog_terms is not None:
+            self._catalog_terms.update(terms)
+        if self._catalog_due is None:
+            self._catalog_due = asyncio.get_running_loop().time() + delay
+            self._notify()
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "retrying": len(self._retry_at),
+            "catalog_refresh_scheduled": int(self._catalog_due is not None),
+            "running": self.running,
+            "batches": self.batches,
+            "users": self.users,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "catalog_refreshes": self.catalog_refreshes,
+        }
+
+    def _next_due(self):
+        """Loop time of the next scheduled catalog refresh or retry, or None."""
+        due = list(self._retry_at.values())
+        if self._catalog_due is not None:
+            due.append(self._catalog_due)
+        return min(due, default=None)
+
+    def _take_due_retries(self, now: float):
+        for user_id, due in list(self._retry_at.items()):
+            if due <= now:
+                del self._retry_at[user_id]
+                self._pending[user_id] = None
+
+    def _retry_later(self, user_ids):
+        now = asyncio.get_running_loop().time()
+        for user_id in user_ids:
+            attempts = self._attempts.get(user_id, 0)
+            if attempts >= len(self.retry_delays):
+                self._attempts.pop(user_id, None)
+                self.dropped += 1
+                logger.error("Giving up refreshing recommendations for user %s after %d attempts",
+                             user_id, attempts + 1)
+                continue
+            self._attempts[user_id] = attempts + 1
+            if user_id not in self._pending:
+                self._retry_at[user_id] = now + self.retry_delays[attempts]
+        self._notify()
+
+    async def _refresh_batch(self, user_ids, semaphore):
+        self.running += 1
+        try:
+            await self.refresh(user_ids)
+            self.users += len(user_ids)
+            for user_id in user_ids:
+                self._attempts.pop(user_id, None)
+        except Exception:
+            self.failures += 1
+            logger.exception("Refreshing recommendations for %d users failed", len(user_ids))
+            self._retry_later(user_ids)
+        finally:
+            self.batches += 1
+            self.running -= 1
+            semaphore.release()
+
+    async def _spawn(self, tasks, user_ids, semaphore):
+        # Acquire before creating the task, so producers wait for a free slot
+        await semaphore.acquire()
+        tasks.add(asyncio.ensure_future(self._refresh_batch(user_ids, semaphore)))
+
+    async def drain(self):
+        """Refresh every pending user, plus the catalog refresh's users if it is due; returns when done."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        loop = asyncio.get_running_loop()
+        try:
+            self._take_due_retries(loop.time())
+            while self._pending or (self._catalog_due is not None and loop.time() >= self._catalog_due):
+                if self._catalog_due is not None and loop.time() >= self._catalog_due:
+                    terms, self._catalog_terms, self._catalog_due = self._catalog_terms, set(), None
+                    self.catalog_refreshes += 1
+                    after = None
+                    while True:
+                        try:
+                            user_ids = await self.list_user_ids(after, self.batch_size, terms)
+                        except Exception:
+                            # Let the batches already started finish and redo the pass later
+                            logger.exception("Listing users for the catalog recommendation refresh failed")
+                            self._schedule_catalog_refresh(terms, ERROR_DELAY)
+                            break
+                        if not user_ids:
+                            break
+                        for user_id in user_ids:
+                            self._pending.pop(user_id, None)
+                        await self._spawn(tasks, user_ids, semaphore)
+                        after = user_ids[-1]
+                    continue
+                batch = list(self._pending)[:self.batch_size]
+                for user_id in batch:
+                    del self._pending[user_id]
+                await self._spawn(tasks, batch, semaphore)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                due = self._next_due()
+                timeout = None if due is None else max(0.0, due - loop.time())
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                await self.drain()
+            except Exception:
+                logger.exception("Recommendation refresh loop failed")
+                # Do not spin if the error repeats
+                await asyncio.sleep(ERROR_DELAY)
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            if self._pending:
+                self._wake.set()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wake = None
@@ -0,0 +1,409 @@
+import bisect
+import heapq
+import re
+import threading
+
+import numpy as np
+
+# ---------- Local candidate retrieval ----------
+# Scores properties against a user's interests with simple keyword features so
+# that only the best top-K candidates are sent to the LLM. The prompt size then
+# stays constant no matter how large the catalog grows.
+
+STOPWORDS = {"a", "an", "and", "the", "of", "in", "on", "at", "to", "for", "with", "st", "rd", "ave", "apt", "unit"}
+
+# Interest words expanded into the words they tend to show up as in property
+# names, amenities and destinations.
+INTEREST_KEYWORDS = {
+    "hiking": ["mountain", "trail", "canyon", "forest", "park", "ridge", "red", "rock"],
+    "camping": ["forest", "lake", "mountain", "desert", "cabin", "stargazing"],
+    "national": ["park", "canyon", "mountain", "desert", "forest"],
+    "photography": ["view", "ocean", "mountain", "canyon", "desert", "historic"],
+    "cycling": ["bike", "boulder", "portland", "trail"],
+    "biking": ["bike", "mountain", "trail", "boulder"],
+    "skiing": ["ski", "snow", "chalet", "lodge", "mountain", "aspen", "vail", "stowe"],
+    "ski": ["ski", "snow", "chalet", "lodge", "mountain"],
+    "snowboarding": ["ski", "snow", "chalet", "mountain"],
+    "surfing": ["beach", "ocean", "beachfront", "coast", "cliff"],
+    "beach": ["beach", "beachfront", "ocean", "coast", "seaside", "pool"],
+    "swimming": ["pool", "beach", "lake", "ocean"],
+    "kayaking": ["kayak", "lake", "lakefront", "river", "riverfront", "waterfront"],
+    "boating": ["lake", "lakefront", "harbor", "waterfront", "marina"],
+    "fishing": ["lake", "lakefront", "river", "riverfront", "waterfront"],
+    "golf": ["golf", "palm", "desert", "scottsdale"],
+    "spa": ["hot", "tub", "spa", "pool"],
+    "wine": ["vineyard", "sonoma", "napa", "winery"],
+    "brewery": ["brewery", "portland", "denver", "milwaukee"],
+    "food": ["kitchen", "market", "new", "orleans"],
+    "nightlife": ["strip", "downtown", "vegas", "miami", "uptown"],
+    "concert": ["music", "nashville", "austin", "jazz"],
+    "music": ["music", "nashville", "austin", "jazz"],
+    "theater": ["broadway", "new", "york", "chicago"],
+    "shopping": ["downtown", "uptown", "strip", "district"],
+    "art": ["gallery", "museum", "santa", "fe", "adobe"],
+    "museum": ["museum", "historic", "capitol"],
+    "historical": ["historic", "history", "capitol", "colonial", "adobe"],
+    "history": ["historic", "history", "capitol", "colonial"],
+    "walking": ["historic", "downtown", "riverwalk", "old"],
+}
+
+FIELD_WEIGHTS = {"amenities": 2.0, "name": 1.5, "city": 1.0, "state": 0.5}
+EXPANDED_TERM_WEIGHT = 0.5
+
+def _normalize_token(token: str) -> str:
+    # Light plural stemming so "beaches"/"beach" and "galleries"/"gallery" match
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if token.endswith("es") and len(token) > 4 and token[-3] in "hx":
+        return token[:-2]
+    if token.endswith("s") and len(token) > 3 and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def tokenize(text) -> list:
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        text = ",".join(text)
+    return [_normalize_token(t) for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS]
+
+def _split_interests(interests) -> list:
+    if interests is None:
+        return []
+    if isinstance(interests, str):
+        interests = interests.split(",")
+    return [i.strip() for i in interests if i and i.strip()]
+
+def interest_terms(interests) -> dict:
+    """Maps each interest word (and its expansions) to a weight."""
+    terms = {}
+    for interest in _split_interests(interests):
+        for token in tokenize(interest):
+            terms[token] = 1.0
+            for keyword in INTEREST_KEYWORDS.get(token, []):
+                for expanded in tokenize(keyword):
+                    terms.setdefault(expanded, EXPANDED_TERM_WEIGHT)
+    return terms
+
+def property_features(prop) -> dict:
+    return {field: set(tokenize(getattr(prop, field, None))) for field in FIELD_WEIGHTS}
+
+def score_property(terms: dict, prop) -> float:
+    score = 0.0
+    for field, tokens in property_features(prop).items():
+        weight = FIELD_WEIGHTS[field]
+        score += sum(weight * terms[t] for t in tokens if t in terms)
+    return score
+
+def retrieve_candidates(interests, props, top_k: int) -> list:
+    """Returns the top_k properties that best match the interests, best first.
+
+    Catalogs that already fit within top_k are returned unchanged. Scores every
+    property; the API keeps a CandidateIndex instead.
+    """
+    props = list(props)
+    if top_k <= 0 or len(props) <= top_k:
+        return props
+    terms = interest_terms(interests)
+    scored = ((score_property(terms, p), -p.id, p) for p in props)
+    return [p for _, _, p in heapq.nlargest(top_k, scored, key=lambda item: (item[0], item[1]))]
+
+def retrieval_terms(prop) -> dict:
+    """score_property's per-property weights as one term -> weight map."""
+    terms = {}
+    for field, tokens in property_features(prop).items():
+        for token in tokens:
+            terms[token] = terms.get(token, 0.0) + FIELD_WEIGHTS[field]
+    return terms
+
+class CandidateIndex:
+    """Inverted index that answers retrieve_candidates from property ids alone.
+
+    Postings map each term to the properties containing it, so a query only
+    touches properties sharing a term with the interests instead of
+    re-tokenizing the catalog. Same scores and order as retrieve_candidates:
+    best score first, then lower id, padded with the lowest unmatched ids.
+    Maintained incrementally with upsert/remove, like TermMatrixEngine.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._postings = {}  # term -> {property_id: weight}
+        self._arrays = {}    # term -> (ids, weights) as numpy arrays, built on first query
+        self._terms = {}     # property_id -> its terms
+        self._ids = []       # every property id, sorted
+        self.loaded = False
+
+    def load(self, props):
+        """Rebuilds the index; readers keep the old one until it is swapped in (safe from a worker thread)."""
+        fresh = CandidateIndex()
+        for prop in props:
+            fresh._upsert(prop)
+        with self._lock:
+            self._postings, self._terms, self._ids = fresh._postings, fresh._terms, fresh._ids
+            self._arrays = {}
+            self.loaded = True
+
+    def upsert(self, prop):
+        with self._lock:
+            self._upsert(prop)
+
+    def remove(self, property_id: int):
+        with self._lock:
+            if self._unindex(property_id):
+                del self._ids[bisect.bisect_left(self._ids, property_id)]
+
+    def contains(self, property_id: int) -> bool:
+        return property_id in self._terms
+
+    def first_ids(self, limit: int) -> list:
+        """The `limit` lowest property ids, ascending."""
+        with self._lock:
+            return self._ids[:limit]
+
+    def _unindex(self, property_id: int) -> bool:
+        terms = self._terms.pop(property_id, None)
+        if terms is None:
+            return False
+        for term in terms:
+            postings = self._postings[term]
+            del postings[property_id]
+            self._arrays.pop(term, None)
+            if not postings:
+                del self._postings[term]
+        return True
+
+    def _upsert(self, prop):
+        if not self._unindex(prop.id):
+            bisect.insort(self._ids, prop.id)
+        terms = retrieval_terms(prop)
+        self._terms[prop.id] = terms
+        for term, weight in terms.items():
+            self._postings.setdefault(term, {})[prop.id] = weight
+            self._arrays.pop(term, None)
+
+    def _posting_arrays(self, term):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self._postings[term]
+            arrays = self._arrays[term] = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float64, count=len(postings)),
+            )
+        return arrays
+
+    def candidates(self, interests, limit: int) -> list:
+        """The `limit` best-matching property ids, best first; the whole catalog in id order if it fits."""
+        query = interest_terms(interests)
+        with self._lock:
+            if limit <= 0 or len(self._ids) <= limit:
+                return list(self._ids)
+            # Scores indexed by property id; ids are unique within one posting list
+            scores = np.zeros(self._ids[-1] + 1)
+            for term, weight in query.items():
+                if term in self._postings:
+                    ids, weights = self._posting_arrays(term)
+                    scores[ids] += weight * weights
+            matched = np.flatnonzero(scores > 0)
+            if len(matched) > limit:
+                # Everything above the limit-th best score, then ties at it by lower id
+                kth = -np.partition(-scores[matched], limit - 1)[limit - 1]
+                above = matched[scores[matched] > kth]
+                ties = matched[scores[matched] == kth][:limit - len(above)]
+                matched = np.concatenate([above, ties])
+            # matched is in id order, so a stable sort on score keeps lower ids first
+            ranked = matched[np.argsort(-scores[matched], kind="stable")].tolist()
+            if len(ranked) < limit:
+                # Pad with zero-score properties, lowest id first
+                taken = set(ranked)
+                for property_id in self._ids:
+                    if property_id not in taken:
+                        ranked.append(property_id)
+                        if len(ranked) == limit:
+                            break
+            return ranked
+
+
+# ---------- Vectorized local recommendation engine ----------
+# Ranks properties entirely in-process: every property is a row of a term
+# matrix built from its amenities, city and state plus curated destination
+# tags, and a user's interests become a query vector over the same terms. One
+# matrix-vector product scores the whole catalog. Used for ?engine=local and as
+# the fallback when the LLM fails.
+
+# Curated destination tags, keyed by city or state. Tags use the same words as
+# user interests so they line up with the query vector.
+DESTINATION_TAGS = {
+    # States
+    "co": ["mountain", "skiing", "hiking", "biking", "brewery"],
+    "ut": ["mountain", "skiing", "hiking", "national park", "canyon"],
+    "vt": ["skiing", "mountain", "lake", "hiking"],
+    "wy": ["mountain", "skiing", "national park", "hiking", "fishing"],
+    "ak": ["mountain", "national park", "fishing", "kayaking", "camping"],
+    "az": ["desert", "canyon", "hiking", "golf"],
+    "nm": ["desert", "art", "historical", "hiking"],
+    "fl": ["beach", "boating", "fishing", "nightlife"],
+    "me": ["ocean", "kayaking", "fishing", "national park"],
+    "tn": ["music", "hiking", "mountain"],
+    # Cities
+    "lake tahoe": ["skiing", "lake", "hiking", "boating"],
+    "big bear lake": ["skiing", "lake", "hiking", "camping"],
+    "joshua tree": ["national park", "desert", "hiking", "camping", "photography"],
+    "palm springs": ["golf", "spa", "desert"],
+    "sonoma": ["wine", "food", "cycling"],
+    "los angeles": ["beach", "surfing", "nightlife", "shopping"],
+    "san diego": ["beach", "surfing", "food"],
+    "santa barbara": ["beach", "surfing", "wine"],
+    "san francisco": ["food", "art", "museum", "shopping"],
+    "new york": ["theater", "museum", "art", "shopping", "nightlife", "food"],
+    "brooklyn": ["art", "food", "music", "brewery"],
+    "new orleans": ["music", "food", "nightlife", "historical", "walking"],
+    "nashville": ["music", "concert", "nightlife"],
+    "austin": ["music", "concert", "food", "nightlife"],
+    "kansas city": ["music", "food"],
+    "las vegas": ["nightlife", "concert", "shopping", "spa"],
+    "chicago": ["museum", "art", "theater", "food", "shopping"],
+    "miami": ["nightlife", "food", "beach"],
+    "miami beach": ["beach", "nightlife", "spa"],
+    "key west": ["beach", "fishing", "boating", "nightlife"],
+    "nags head": ["beach", "fishing", "surfing"],
+    "cannon beach": ["beach", "photography", "hiking"],
+    "oak bluffs": ["beach", "boating"],
+    "newport": ["boating", "historical", "ocean"],
+    "bar harbor": ["national park", "kayaking", "hiking"],
+    "seattle": ["food", "kayaking", "hiking", "museum"],
+    "portland": ["food", "brewery", "hiking", "cycling"],
+    "denver": ["brewery", "hiking", "concert"],
+    "boulder": ["hiking", "cycling", "biking", "climbing"],
+    "milwaukee": ["brewery", "food"],
+    "louisville": ["bourbon", "historical", "food"],
+    "boston": ["historical", "museum", "walking"],
+    "philadelphia": ["historical", "museum", "food"],
+    "washington": ["museum", "historical", "walking"],
+    "savannah": ["historical", "walking", "food"],
+    "charleston": ["historical", "walking", "food"],
+    "sedona": ["hiking", "spa", "art", "photography"],
+    "santa fe": ["art", "historical", "hiking"],
+    "gatlinburg": ["hiking", "national park", "mountain"],
+    "aspen": ["skiing", "hiking", "spa"],
+    "vail": ["skiing", "hiking"],
+    "park city": ["skiing", "biking"],
+    "stowe": ["skiing", "hiking"],
+    "jackson": ["skiing", "national park", "fishing"],
+    "lake placid": ["skiing", "lake", "kayaking", "hiking"],
+    "anchorage": ["national park", "fishing", "hiking"],
+}
+
+ENGINE_FIELD_WEIGHTS = {"amenities": 1.0, "city": 1.0, "state": 0.5}
+DESTINATION_TAG_WEIGHT = 1.5
+
+def property_terms(prop) -> dict:
+    """Weighted terms describing a property for the term matrix."""
+    terms = {}
+    for field, weight in ENGINE_FIELD_WEIGHTS.items():
+        for token in tokenize(getattr(prop, field, None)):
+            terms[token] = max(terms.get(token, 0.0), weight)
+    for place in (prop.city, prop.state):
+        for tag in DESTINATION_TAGS.get((place or "").strip().lower(), []):
+            for token in tokenize(tag):
+                terms[token] = max(terms.get(token, 0.0), DESTINATION_TAG_WEIGHT)
+    return terms
+
+class TermMatrixEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drops every row; the next request reloads the catalog."""
+        self._vocab = {}
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._row_ids = []
+        self._rows = {}
+        self.loaded = False
+
+    def load(self, props):
+        """Rebuilds the matrix from scratch; readers keep the old one until it is swapped in.
+
+        Safe to call from a worker thread.
+        """
+        fresh = TermMatrixEngine()
+        for prop in props:
+            fresh._upsert(prop)
+        with self._lock:
+            self._vocab, self._matrix = fresh._vocab, fresh._matrix
+            self._row_ids, self._rows = fresh._row_ids, fresh._rows
+            self.loaded = True
+
+    def upsert(self, prop):
+        """Adds or replaces a single property's row."""
+        with self._lock:
+            self._upsert(prop)
+
+    def remove(self, property_id: int):
+        with self._lock:
+            row = self._rows.pop(property_id, None)
+            if row is None:
+                return
+            # Move the last row into the hole so the live rows stay contiguous
+            last = len(self._row_ids) - 1
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                moved_id = self._row_ids[last]
+                self._row_ids[row] = moved_id
+                self._rows[moved_id] = row
+            self._matrix[last] = 0.0
+            self._row_ids.pop()
+
+    def _upsert(self, prop):
+        terms = property_terms(prop)
+        for term in terms:
+            if term not in self._vocab:
+                self._vocab[term] = len(self._vocab)
+        row = self._rows.get(prop.id)
+        if row is None:
+            row = len(self._row_ids)
+            self._row_ids.append(prop.id)
+            self._rows[prop.id] = row
+        self._reserve(len(self._row_ids), len(self._vocab))
+        vector = np.zeros(self._matrix.shape[1], dtype=np.float32)
+        for term, weight in terms.items():
+            vector[self._vocab[term]] = weight
+        norm = np.linalg.norm(vector)
+        self._matrix[row] = vector / norm if norm else vector
+
+    def _reserve(self, rows: int, cols: int):
+        # Grow geometrically so incremental writes stay amortized O(1)
+        cur_rows, cur_cols = self._matrix.shape
+        if rows <= cur_rows and cols <= cur_cols:
+            return
+        new_shape = (max(rows, cur_rows * 2, 16), max(cols, cur_cols * 2, 64))
+        grown = np.zeros(new_shape, dtype=np.float32)
+        grown[:cur_rows, :cur_cols] = self._matrix
+        self._matrix = grown
+
+    def query_vector(self, interests) -> np.ndarray:
+        vector = np.zeros(self._matrix.shape[1], dtype=np.float32)
+        for term, weight in interest_terms(interests).items():
+            col = self._vocab.get(term)
+            if col is not None:
+                vector[col] = weight
+        return vector
+
+    def recommend(self, interests, limit: int = 5) -> list:
+        """Returns up to `limit` property ids with a positive score, best first."""
+        with self._lock:
+            count = len(self._row_ids)
+            if count == 0:
+                return []
+            scores = self._matrix[:count] @ self.query_vector(interests)
+            row_ids = list(self._row_ids)
+        if limit < count:
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(count)
+        top = sorted(top, key=lambda row: (-scores[row], row_ids[row]))
+        return [row_ids[row] for row in top if scores[row] > 0]
@@ -0,0 +1,56 @@
+from fast_responses import dumps
+
+# ---------- Server-sent events ----------
+# Helpers for /users/{user_id}/properties/stream, which pushes each recommended
+# property as soon as the LLM has written its id.
+
+SSE_MEDIA_TYPE = "text/event-stream"
+# Stop intermediaries (nginx in particular) from buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(event: str, data) -> bytes:
+    """One SSE message with a JSON payload."""
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + dumps(data) + b"\n\n"
+
+class IncrementalIdParser:
+    """Pulls integer ids out of a JSON array arriving in arbitrary text chunks.
+
+    Anything before the opening "[" (such as a ```json fence or a preamble) is
+    skipped, an id is emitted as soon as the character after its last digit
+    arrives, and parsing stops at the closing "]". Quoted ids ("12") are
+    accepted; fractional parts and negative numbers are not ids and are dropped.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.done = False
+        self._digits = ""
+        self._skipping = False
+
+    def feed(self, text: str) -> list:
+        ids = []
+        for char in text:
+            if self.done:
+                break
+            if not self.started:
+                self.started = char == "["
+            elif char.isdigit():
+                if not self._skipping:
+                    self._digits += char
+            else:
+                if self._digits:
+                    if char == ".":
+                        self._digits = ""
+                    else:
+                        ids.append(int(self._digits))
+                        self._digits = ""
+                # Digits after "." or "-" belong to a number that is not an id
+                self._skipping = char in ".-" or (self._skipping and char not in ",]")
+                self.done = char == "]"
+        return ids
+
+    def close(self) -> list:
+        """Ids still pending when the stream ended without a closing "]"."""
+        ids = [int(self._digits)] if self._digits and not self._skipping else []
+        self._digits = ""
+        return ids
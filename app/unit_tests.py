@@ -1,8 +1,17 @@
+import asyncio
+import json
+import time
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, clear_mappers
-from api_endpoints import app, get_db
+from sqlalchemy.pool import NullPool, StaticPool
+from api_endpoints import (
+    app, get_db, get_read_db, get_llm_client, llm_resilience, recommendation_cache, recommendation_flight,
+    recommendation_prompts, recommendation_worker, local_engine, candidate_index, catalog_version,
+)
+import utils
 import models_sqlalchemy as models
 import models_pydantic as schemas
 
@@ -10,36 +19,38 @@ from unittest.mock import patch
 
 # ---------- TEST FIXTURES ----------
 
-# Use in-memory SQLite for test isolation
-TEST_DATABASE_URL = "sqlite:///:memory:"
+# Use a fresh in-memory SQLite database for each test; StaticPool keeps every
+# session on the one connection that holds it.
+TEST_DATABASE_URL = "sqlite+aiosqlite://"
 
-@pytest.fixture(scope="session")
-def engine():
-    engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False})
-    models.Base.metadata.create_all(bind=engine)
-    yield engine
-    models.Base.metadata.drop_all(bind=engine)
+def create_test_engine(url=TEST_DATABASE_URL, **kwargs):
+    engine = create_async_engine(url, **kwargs)
+    async def create_all():
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+    asyncio.run(create_all())
+    return engine
+
+def async_session_override(engine):
+    Session = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async def override_get_db():
+        async with Session() as db:
+            yield db
+    return override_get_db
 
 @pytest.fixture(scope="function")
-def db_session(engine):
-    """A new DB session for each test."""
-    connection = engine.connect()
-    transaction = connection.begin()
-    Session = sessionmaker(bind=connection)
-    session = Session()
-    yield session
-    session.close()
-    transaction.rollback()
-    connection.close()
+def engine():
+    engine = create_test_engine(poolclass=StaticPool)
+    yield engine
+    asyncio.run(engine.dispose())
 
 @pytest.fixture(scope="function")
-def client(db_session):
+def client(engine):
     """Override get_db dependency for FastAPI TestClient."""
-
-    def override_get_db():
-        yield db_session
-
+    override_get_db = async_session_override(engine)
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[get_llm_client] = lambda: (None, "mock-model", "mock-provider")
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
@@ -48,11 +59,20 @@ def client(db_session):
 
 @pytest.fixture(autouse=True)
 def mock_llm(monkeypatch):
-    # Patch setup_llm_client and get_completion
-    monkeypatch.setattr("api_endpoints.setup_llm_client", lambda model_name: (None, "mock-model", "mock-provider"))
-    # Patch get_completion to always return '[1,2]'
-    monkeypatch.setattr("api_endpoints.get_completion", lambda *a, **k: "[1,2]")
+    # The LLM client dependency is overridden in the client fixture; patch get_completion
+    # Patch get_completion_async to always return '[1,2]'
+    async def fake_completion(*a, **k):
+        return "[1,2]"
+    monkeypatch.setattr("api_endpoints.get_completion_async", fake_completion)
     monkeypatch.setattr("api_endpoints.clean_llm_output", lambda s, fmt: s)
+    recommendation_cache.clear()
+    recommendation_flight.clear()
+    llm_resilience.reset()
+    recommendation_prompts.clear()
+    local_engine.clear()
+    recommendation_worker.clear()
+    candidate_index.clear()
+    catalog_version.clear()
 
 # ---------- TEST DATA HELPERS ----------
 
@@ -233,6 +253,1306 @@ def test_user_properties_llm_recommendation(client):
     prop_ids = [prop["id"] for prop in r.json()]
     assert set(prop_ids).issubset({p1.json()["id"], p2.json()["id"]})
 
+def test_user_properties_served_from_cache(client, monkeypatch):
+    calls = []
+    async def counting_completion(*a, **k):
+        calls.append(a)
+        return "[1,2]"
+    monkeypatch.setattr("api_endpoints.get_completion_async", counting_completion)
+    client.post("/properties/", json=create_property_dict(name="A"))
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    r1 = client.get(f"/users/{uid}/properties")
+    r2 = client.get(f"/users/{uid}/properties")
+    assert r1.json() == r2.json()
+    assert len(calls) == 1
+    assert recommendation_cache.stats()["hits"] == 1
+
+def test_user_properties_cache_invalidated_by_writes(client, monkeypatch):
+    calls = []
+    async def counting_completion(*a, **k):
+        calls.append(a)
+        return "[1,2]"
+    monkeypatch.setattr("api_endpoints.get_completion_async", counting_completion)
+    client.post("/properties/", json=create_property_dict(name="A"))
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    client.get(f"/users/{uid}/properties")
+    # A catalog write bumps the catalog version
+    client.post("/properties/", json=create_property_dict(name="B"))
+    client.get(f"/users/{uid}/properties")
+    assert len(calls) == 2
+    # Changing interests drops the entries for the old interests
+    client.put(f"/users/{uid}", json={"interests": ["surfing"]})
+    assert recommendation_cache.stats()["size"] == 0
+    client.get(f"/users/{uid}/properties")
+    assert len(calls) == 3
+
+def test_llm_client_registry_builds_each_client_once(monkeypatch):
+    built = []
+    def fake_create(model_name, asynchronous=False):
+        built.append(model_name)
+        return object(), model_name, "openai"
+    env_loads = []
+    monkeypatch.setattr(utils, "_create_llm_client", fake_create)
+    monkeypatch.setattr(utils, "load_environment", lambda: env_loads.append(1))
+    registry = utils.LLMClientRegistry()
+    first = registry.get("gpt-4.1-mini")
+    assert registry.get("gpt-4.1-mini") is first
+    registry.get("gpt-4o")
+    assert built == ["gpt-4.1-mini", "gpt-4o"]
+    assert len(env_loads) == 1
+
+def test_llm_client_registry_does_not_cache_failures(monkeypatch):
+    results = [(None, None, None), (object(), "gpt-4o", "openai")]
+    monkeypatch.setattr(utils, "_create_llm_client", lambda model_name, asynchronous=False: results.pop(0))
+    monkeypatch.setattr(utils, "load_environment", lambda: None)
+    registry = utils.LLMClientRegistry()
+    assert registry.get("gpt-4o")[0] is None
+    assert registry.get("gpt-4o")[0] is not None
+
+def test_get_completion_async_awaits_async_client():
+    import asyncio
+    from types import SimpleNamespace
+    seen = {}
+    async def create(**kwargs):
+        seen.update(kwargs)
+        await asyncio.sleep(0)
+        message = SimpleNamespace(content="[3]")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    result = asyncio.run(utils.get_completion_async("prompt", client, "gpt-4.1-mini", "openai", temperature=0.2))
+    assert result == "[3]"
+    assert seen["model"] == "gpt-4.1-mini"
+    assert seen["temperature"] == 0.2
+
+def test_retrieve_candidates_ranks_matching_properties_first():
+    from types import SimpleNamespace
+    from recommender import retrieve_candidates
+    def prop(pid, name, city, state, amenities):
+        return SimpleNamespace(id=pid, name=name, city=city, state=state, amenities=amenities)
+    props = [
+        prop(1, "Downtown Loft", "Chicago", "IL", "Wi-Fi,Elevator"),
+        prop(2, "Aspen Mountain Chalet", "Aspen", "CO", "Hot Tub,Ski-in/Ski-out"),
+        prop(3, "San Diego Beachfront", "San Diego", "CA", "Pool,Beach Access"),
+        prop(4, "Park City Ski Condo", "Park City", "UT", "Hot Tub,Fireplace"),
+    ]
+    top = retrieve_candidates("skiing,spa", props, top_k=2)
+    assert [p.id for p in top] == [2, 4]
+    assert [p.id for p in retrieve_candidates("beaches", props, top_k=1)] == [3]
+    # Small catalogs are passed through untouched
+    assert retrieve_candidates("skiing", props, top_k=10) == props
+
+def test_candidate_index_matches_retrieve_candidates():
+    import random
+    from types import SimpleNamespace
+    from recommender import CandidateIndex, retrieve_candidates
+    rng = random.Random(7)
+    places = [("Aspen", "CO"), ("San Diego", "CA"), ("Chicago", "IL"), ("Sedona", "AZ"), ("Key West", "FL")]
+    words = ["Mountain", "Beach", "Loft", "Lakefront", "Historic", "Chalet", "Studio"]
+    amenities = ["Pool", "Hot Tub", "Kitchen", "Ski Storage", "Beach Access", "Wi-Fi", "Kayaks"]
+    props = []
+    for pid in range(1, 301):
+        city, state = rng.choice(places)
+        props.append(SimpleNamespace(id=pid, name=" ".join(rng.sample(words, 2)), city=city, state=state,
+                                     amenities=rng.sample(amenities, 3)))
+    index = CandidateIndex()
+    index.load(props)
+    index.remove(17)
+    props = [p for p in props if p.id != 17]
+    # Same scores and tie-breaking (lower id first), zero scores included
+    for interests in (["skiing", "spa"], ["beach"], ["kayaking", "history"], ["knitting"]):
+        expected = [p.id for p in retrieve_candidates(interests, props, top_k=25)]
+        assert index.candidates(interests, 25) == expected
+    assert index.candidates(["beach"], 500) == [p.id for p in props]
+
+def test_user_properties_miss_fetches_only_candidate_rows(client, engine, monkeypatch):
+    import query_stats
+    query_stats.instrument_engine(engine)
+    monkeypatch.setattr("api_endpoints.RECOMMENDATION_CANDIDATES", 2)
+    client.post("/properties/bulk", json=[create_property_dict(name=f"P{i}") for i in range(10)])
+    client.post("/properties/", json=create_property_dict(name="Surf Shack", city="San Diego", amenities=["Beach Access"]))
+    uids = [client.post("/users/", json=create_user_dict(email=f"{i}@example.com", interests=[interest])).json()["id"]
+            for i, interest in enumerate(["surfing", "skiing"])]
+    client.get(f"/users/{uids[0]}/properties")  # builds the indexes from one catalog scan
+    loaded = []
+    monkeypatch.setattr("api_endpoints._load_properties", lambda db: loaded.append(db))
+    # New properties are patched into the indexes, no rescan
+    pid = client.post("/properties/", json=create_property_dict(name="Ski Lodge", amenities=["Ski Storage"])).json()["id"]
+    prompts = []
+    async def capturing_completion(prompt, *a, **k):
+        prompts.append(prompt)
+        return json.dumps([pid])
+    monkeypatch.setattr("api_endpoints.get_completion_async", capturing_completion)
+    r = client.get(f"/users/{uids[1]}/properties")
+    assert [p["id"] for p in r.json()] == [pid]
+    assert loaded == [] and "Ski Lodge" in prompts[0]
+    # Precomputed-row probe, user lookup (with interests), catalog version read,
+    # one IN query for the candidates (with amenities)
+    assert int(r.headers["x-db-queries"]) <= 6
+
+def test_user_properties_prompt_limited_to_candidates(client, monkeypatch):
+    prompts = []
+    async def capturing_completion(prompt, *a, **k):
+        prompts.append(prompt)
+        return "[1]"
+    monkeypatch.setattr("api_endpoints.get_completion_async", capturing_completion)
+    monkeypatch.setattr("api_endpoints.RECOMMENDATION_CANDIDATES", 1)
+    client.post("/properties/", json=create_property_dict(name="Chicago Loft", city="Chicago", state="IL", amenities=["Elevator"]))
+    client.post("/properties/", json=create_property_dict(name="Surf Shack", city="San Diego", state="CA", amenities=["Beach Access"]))
+    uid = client.post("/users/", json=create_user_dict(interests=["surfing"])).json()["id"]
+    client.get(f"/users/{uid}/properties")
+    # Both are in the shared catalog block, but only the best match is a candidate
+    assert "Surf Shack" in prompts[0]
+    assert "\nCandidate ids: 2\n" in prompts[0]
+
+def test_recommendation_prompt_is_compact_and_cached_per_catalog_version():
+    from types import SimpleNamespace
+    from prompts import RECOMMENDATION_INSTRUCTIONS, RecommendationPromptBuilder
+    props = [
+        SimpleNamespace(id=1, name="Loft, Downtown", city="Chicago", state="IL", amenities=["Elevator", "Gym"]),
+        SimpleNamespace(id=2, name="Chalet", city="Aspen", state="CO", amenities=["Hot Tub"]),
+    ]
+    builder = RecommendationPromptBuilder()
+    builder.set_shared(props, catalog_version=1)
+    prompt = builder.build(["skiing", "food"], props[::-1], catalog_version=1)
+    # Static instructions first, then the catalog, then the only per-user part
+    assert prompt.text.startswith(RECOMMENDATION_INSTRUCTIONS)
+    assert prompt.text.endswith("\nCandidate ids: 2, 1\nUser interests: skiing, food\n")
+    assert 'id,name,city,state,amenities\n1,"Loft, Downtown",Chicago,IL,Elevator;Gym\n2,Chalet,Aspen,CO,Hot Tub\n' in prompt.text
+    assert prompt.tokens["total"] == sum(v for k, v in prompt.tokens.items() if k != "total")
+    props[1].name = "Renamed Chalet"
+    assert not builder.needs_shared(1)
+    assert "Renamed Chalet" not in builder.build(["skiing"], props, catalog_version=1).text
+    assert builder.needs_shared(2)
+    builder.set_shared(props, catalog_version=2)
+    assert "Renamed Chalet" in builder.build(["skiing"], props, catalog_version=2).text
+
+def test_recommendation_prompt_shares_a_cacheable_catalog_prefix():
+    from types import SimpleNamespace
+    import os
+    from prompts import RECOMMENDATION_INSTRUCTIONS, RecommendationPromptBuilder, count_tokens
+    from recommender import CandidateIndex
+    def city(pid):
+        # The ski and surf towns come after the properties the shared block has room for
+        if pid <= 250:
+            return ("Chicago", "IL", "Elevator")
+        return ("Aspen", "CO", "Hot Tub") if pid % 2 else ("San Diego", "CA", "Beach Access")
+    props = [
+        SimpleNamespace(id=pid, name=f"Property {pid}", city=city(pid)[0], state=city(pid)[1],
+                        amenities=[city(pid)[2], "Wifi"])
+        for pid in range(1, 301)
+    ]
+    index = CandidateIndex()
+    index.load(props)
+    builder = RecommendationPromptBuilder(shared_tokens=1500)
+    by_id = {prop.id: prop for prop in props}
+    builder.set_shared([by_id[pid] for pid in index.first_ids(builder.shared_limit)], catalog_version=1)
+    texts = []
+    for interests in (["skiing"], ["surfing"]):
+        candidates = [by_id[pid] for pid in index.candidates(interests, 20)]
+        prompt = builder.build(interests, candidates, catalog_version=1)
+        assert 1000 < prompt.tokens["catalog"] <= 1500
+        # Candidates past the shared block are listed after it, then all of them by id
+        assert f"Property {candidates[-1].id}," in prompt.text.split("More properties")[1]
+        assert "Candidate ids: " + ", ".join(str(prop.id) for prop in candidates) in prompt.text
+        texts.append(prompt.text)
+    assert index.candidates(["skiing"], 20) != index.candidates(["surfing"], 20)
+    # Everything up to the per-user candidates is shared, and long enough for provider caching
+    prefix = os.path.commonprefix(texts)
+    assert prefix.startswith(RECOMMENDATION_INSTRUCTIONS)
+    assert count_tokens(prefix) >= 1024
+    shared = texts[0].split("More properties")[0]
+    assert texts[1].startswith(shared) and len(prefix) >= len(shared)
+
+def test_user_properties_report_prompt_tokens(client, monkeypatch):
+    prompts = []
+    async def capturing_completion(prompt, *a, **k):
+        prompts.append(prompt)
+        return "[1]"
+    monkeypatch.setattr("api_endpoints.get_completion_async", capturing_completion)
+    client.post("/properties/", json=create_property_dict(name="A"))
+    uid1 = client.post("/users/", json=create_user_dict(email="a@e.com", interests=["hiking"])).json()["id"]
+    uid2 = client.post("/users/", json=create_user_dict(email="b@e.com", interests=["surfing"])).json()["id"]
+    r = client.get(f"/users/{uid1}/properties")
+    assert int(r.headers["X-Prompt-Tokens"]) > 0
+    client.get(f"/users/{uid2}/properties")
+    # Same catalog, different users: everything up to the candidates is shared
+    assert prompts[0].split("Candidate ids")[0] == prompts[1].split("Candidate ids")[0]
+    # Cached answers do not build a prompt
+    assert "X-Prompt-Tokens" not in client.get(f"/users/{uid1}/properties").headers
+    assert 'llm_prompt_tokens_count{part="catalog"}' in client.get("/metrics").text
+
+def test_term_matrix_engine_incremental_updates():
+    from types import SimpleNamespace
+    from recommender import TermMatrixEngine
+    def prop(pid, city, state, amenities):
+        return SimpleNamespace(id=pid, name="", city=city, state=state, amenities=amenities)
+    engine = TermMatrixEngine()
+    engine.load([prop(1, "Chicago", "IL", "Elevator"), prop(2, "Aspen", "CO", "Hot Tub,Ski-in/Ski-out")])
+    assert engine.recommend("skiing") == [2]
+    engine.upsert(prop(3, "Park City", "UT", "Ski-in/Ski-out,Hot Tub,Fireplace"))
+    assert set(engine.recommend("skiing")) == {2, 3}
+    engine.remove(2)
+    assert engine.recommend("skiing") == [3]
+    engine.upsert(prop(3, "Chicago", "IL", "Elevator"))
+    assert engine.recommend("skiing") == []
+    assert engine.recommend("theater") == [1, 3]
+
+def test_user_properties_local_engine(client, monkeypatch):
+    async def failing_completion(*a, **k):
+        raise AssertionError("the local engine must not call the LLM")
+    monkeypatch.setattr("api_endpoints.get_completion_async", failing_completion)
+    client.post("/properties/", json=create_property_dict(name="Loft", city="Chicago", state="IL", amenities=["Elevator"]))
+    uid = client.post("/users/", json=create_user_dict(interests=["skiing"])).json()["id"]
+    r = client.get(f"/users/{uid}/properties", params={"engine": "local"})
+    assert r.status_code == 200
+    assert r.json() == []
+    # New properties are added to the loaded matrix incrementally
+    p = client.post("/properties/", json=create_property_dict(name="Chalet", city="Aspen", state="CO", amenities=["Hot Tub"]))
+    r = client.get(f"/users/{uid}/properties", params={"engine": "local"})
+    assert [prop["id"] for prop in r.json()] == [p.json()["id"]]
+    assert client.get(f"/users/{uid}/properties", params={"engine": "bogus"}).status_code == 422
+
+def test_user_properties_falls_back_to_local_engine(client, monkeypatch):
+    async def broken_completion(*a, **k):
+        return "An API error occurred: timeout"
+    monkeypatch.setattr("api_endpoints.get_completion_async", broken_completion)
+    p = client.post("/properties/", json=create_property_dict(name="Chalet", city="Aspen", state="CO", amenities=["Hot Tub"]))
+    uid = client.post("/users/", json=create_user_dict(interests=["skiing"])).json()["id"]
+    r = client.get(f"/users/{uid}/properties")
+    assert r.status_code == 200
+    assert [prop["id"] for prop in r.json()] == [p.json()["id"]]
+    assert recommendation_cache.stats()["size"] == 0
+
+def test_user_properties_keep_llm_order_and_skip_unknown_ids(client, monkeypatch, caplog):
+    p1 = client.post("/properties/", json=create_property_dict(name="A")).json()["id"]
+    p2 = client.post("/properties/", json=create_property_dict(name="B")).json()["id"]
+    async def ranked_completion(*a, **k):
+        return json.dumps([p2, 999, p1, p2])
+    monkeypatch.setattr("api_endpoints.get_completion_async", ranked_completion)
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    with caplog.at_level("WARNING"):
+        r = client.get(f"/users/{uid}/properties")
+    assert [prop["id"] for prop in r.json()] == [p2, p1]
+    assert "999" in caplog.text
+    # Cached ids are hydrated again, still in ranked order
+    r = client.get(f"/users/{uid}/properties")
+    assert [prop["id"] for prop in r.json()] == [p2, p1]
+
+def use_recommendation_session(engine, monkeypatch):
+    """Point the background refresh at the test database."""
+    monkeypatch.setattr(
+        "api_endpoints.RecommendationSession",
+        async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False),
+    )
+
+def test_recommendation_worker_batches_with_bounded_concurrency():
+    from recommendation_worker import RecommendationWorker
+    batches, running, peak = [], [0], [0]
+    async def refresh(user_ids):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        batches.append(list(user_ids))
+        running[0] -= 1
+    listed_terms = []
+    async def list_user_ids(after, limit, terms):
+        listed_terms.append(terms)
+        # Even users are interested in "beach"
+        return [i for i in range(1, 11) if (after is None or i > after) and (terms is None or i % 2 == 0)][:limit]
+    async def run():
+        worker = RecommendationWorker(refresh, list_user_ids, concurrency=2, batch_size=3, catalog_delay=0)
+        worker.enqueue(4, 5, 4)
+        await worker.drain()
+        assert sorted(batches) == [[4, 5]]
+        # A catalog refresh pages through the matching users; merged requests run once
+        worker.enqueue_matching(["beach"])
+        worker.enqueue_matching(["ski"])
+        await worker.drain()
+        assert listed_terms[0] == {"beach", "ski"} and sorted(batches[1:]) == [[2, 4, 6], [8, 10]]
+        del batches[1:]
+        # enqueue_all covers everyone, whatever was merged before it
+        worker.enqueue(7)
+        worker.enqueue_matching(["beach"])
+        worker.enqueue_all()
+        await worker.drain()
+        return worker.stats()
+    stats = asyncio.run(run())
+    assert listed_terms[-1] is None
+    assert sorted(batches[1:]) == [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10]]
+    assert peak[0] == 2
+    assert stats["catalog_refreshes"] == 2 and stats["pending"] == 0 and stats["users"] == 17
+
+def test_recommendation_worker_retries_failed_users_and_survives_errors(monkeypatch):
+    import recommendation_worker as worker_module
+    from recommendation_worker import RecommendationWorker
+    monkeypatch.setattr(worker_module, "ERROR_DELAY", 0.01)
+    attempts, refreshed, listings = {}, [], []
+    async def refresh(user_ids):
+        for user_id in user_ids:
+            attempts[user_id] = attempts.get(user_id, 0) + 1
+        # User 2 fails twice, user 3 always
+        if 3 in user_ids or (2 in user_ids and attempts[2] <= 2):
+            raise RuntimeError("database is locked")
+        refreshed.extend(user_ids)
+    async def list_user_ids(after, limit, terms):
+        listings.append(after)
+        if len(listings) == 1:
+            raise RuntimeError("database is down")
+        return [i for i in (4, 5) if after is None or i > after][:limit]
+    async def run():
+        worker = RecommendationWorker(refresh, list_user_ids, batch_size=1, catalog_delay=0, retry_delays=(0, 0))
+        worker.enqueue(1, 2, 3)
+        for _ in range(3):
+            await worker.drain()
+        assert worker.stats()["retrying"] == 0 and worker.dropped == 1
+        # A failed listing reschedules the catalog refresh; the loop keeps running
+        worker.start()
+        worker.enqueue_all()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if worker.catalog_refreshes == 2 and not worker.running:
+                break
+        await worker.stop()
+        return worker.stats()
+    stats = asyncio.run(run())
+    assert sorted(refreshed) == [1, 2, 4, 5]
+    assert attempts == {1: 1, 2: 3, 3: 3, 4: 1, 5: 1}
+    assert stats["failures"] == 5 and stats["dropped"] == 1 and stats["pending"] == 0
+
+def test_lifespan_does_not_start_the_worker_on_an_in_memory_database(engine, monkeypatch):
+    import api_endpoints
+    async def warm(models):
+        pass
+    monkeypatch.setattr(api_endpoints, "engine", engine)
+    monkeypatch.setattr(api_endpoints.llm_clients, "warm_async", warm)
+    async def run(in_memory):
+        monkeypatch.setattr(api_endpoints, "IN_MEMORY_DATABASE", in_memory)
+        async with api_endpoints.lifespan(app):
+            started = recommendation_worker._task is not None
+        return started
+    assert asyncio.run(run(True)) is False
+    assert asyncio.run(run(False)) is True
+    assert recommendation_worker._task is None
+
+def test_precomputed_recommendations_served_in_one_query(client, engine, monkeypatch):
+    import query_stats
+    query_stats.instrument_engine(engine)
+    use_recommendation_session(engine, monkeypatch)
+    p1 = client.post("/properties/", json=create_property_dict(name="A", amenities=["wifi"])).json()["id"]
+    p2 = client.post("/properties/", json=create_property_dict(name="B", amenities=["pool"])).json()["id"]
+    calls = []
+    async def counting_completion(*a, **k):
+        calls.append(a)
+        return json.dumps([p2, p1])
+    monkeypatch.setattr("api_endpoints.get_completion_async", counting_completion)
+    uids = [
+        client.post("/users/", json=create_user_dict(email=f"{name}@example.com", interests=interests)).json()["id"]
+        for name, interests in (("a", ["hiking"]), ("b", ["hiking"]), ("c", ["surfing"]))
+    ]
+    assert recommendation_worker.stats()["pending"] == 3
+    asyncio.run(recommendation_worker.drain())
+    # One LLM call per distinct interest set
+    assert len(calls) == 2
+    r = client.get(f"/users/{uids[1]}/properties")
+    assert [prop["id"] for prop in r.json()] == [p2, p1]
+    assert r.json()[0]["amenities"] == ["pool"]
+    assert r.headers["x-recommendations-source"] == "precomputed"
+    assert r.headers["x-recommendations-computed-at"].endswith("Z")
+    assert r.headers["x-db-queries"] == "1"
+    assert len(calls) == 2
+
+def test_precomputed_recommendations_follow_user_and_catalog_writes(client, engine, monkeypatch):
+    use_recommendation_session(engine, monkeypatch)
+    monkeypatch.setattr(recommendation_worker, "catalog_delay", 0)
+    p1 = client.post("/properties/", json=create_property_dict(name="A")).json()["id"]
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    asyncio.run(recommendation_worker.drain())
+    assert recommendation_worker.stats()["catalog_refreshes"] == 1
+    assert client.get(f"/users/{uid}/properties").headers["x-recommendations-source"] == "precomputed"
+    # New interests drop the stored ranking and queue a refresh
+    client.put(f"/users/{uid}", json={"interests": ["surfing"]})
+    assert client.get(f"/users/{uid}/properties").headers["x-recommendations-source"] == "llm"
+    assert recommendation_worker.stats()["pending"] == 1
+    asyncio.run(recommendation_worker.drain())
+    assert client.get(f"/users/{uid}/properties").headers["x-recommendations-source"] == "precomputed"
+    # Deleting the property removes it from stored rankings and schedules a catalog refresh
+    client.delete(f"/properties/{p1}")
+    assert recommendation_worker.stats()["catalog_refresh_scheduled"] == 1
+    assert client.get(f"/users/{uid}/properties").headers["x-recommendations-source"] == "llm"
+    client.post("/properties/", json=create_property_dict(name="B"))
+    asyncio.run(recommendation_worker.drain())
+    client.delete(f"/users/{uid}")
+    async def count_rows():
+        async with engine.connect() as conn:
+            return await conn.scalar(select(func.count()).select_from(models.UserRecommendation))
+    assert asyncio.run(count_rows()) == 0
+
+def test_catalog_writes_refresh_only_matching_users(client, engine, monkeypatch):
+    use_recommendation_session(engine, monkeypatch)
+    monkeypatch.setattr(recommendation_worker, "catalog_delay", 0)
+    lodge = client.post("/properties/", json=create_property_dict(name="Ski Lodge", city="Aspen", amenities=["Hot Tub"])).json()["id"]
+    skier = client.post("/users/", json=create_user_dict(email="ski@e.com", interests=["skiing"])).json()["id"]
+    surfer = client.post("/users/", json=create_user_dict(email="surf@e.com", interests=["surfing"])).json()["id"]
+    client.post("/users/", json=create_user_dict(email="art@e.com", interests=["art"]))
+    asyncio.run(recommendation_worker.drain())
+    refreshed = []
+    refresh = recommendation_worker.refresh
+    async def recording_refresh(user_ids):
+        refreshed.extend(user_ids)
+        await refresh(user_ids)
+    monkeypatch.setattr(recommendation_worker, "refresh", recording_refresh)
+    # A beach property only concerns the surfer
+    client.post("/properties/", json=create_property_dict(name="Surf Shack", city="San Diego", amenities=["Beach Access"]))
+    asyncio.run(recommendation_worker.drain())
+    assert refreshed == [surfer]
+    # Changes no candidate list depends on schedule nothing
+    client.put(f"/properties/{lodge}", json={"price_per_night": 99.0})
+    assert recommendation_worker.stats()["catalog_refresh_scheduled"] == 0
+    # Renaming moves it from the skier's interests to the surfer's: both are refreshed
+    refreshed.clear()
+    client.put(f"/properties/{lodge}", json={"name": "Beach House", "city": "Malibu", "amenities": ["Beach Access"]})
+    asyncio.run(recommendation_worker.drain())
+    assert sorted(refreshed) == sorted([skier, surfer])
+
+def test_refresh_query_recomputes_and_stores_recommendations(client, engine, monkeypatch):
+    use_recommendation_session(engine, monkeypatch)
+    p1 = client.post("/properties/", json=create_property_dict(name="A")).json()["id"]
+    p2 = client.post("/properties/", json=create_property_dict(name="B")).json()["id"]
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    asyncio.run(recommendation_worker.drain())
+    first = client.get(f"/users/{uid}/properties")
+    assert [prop["id"] for prop in first.json()] == [p1, p2]
+    async def reversed_completion(*a, **k):
+        return json.dumps([p2, p1])
+    monkeypatch.setattr("api_endpoints.get_completion_async", reversed_completion)
+    # The cached ranking is skipped, and the new one replaces the stored rows
+    r = client.get(f"/users/{uid}/properties", params={"refresh": "true"})
+    assert [prop["id"] for prop in r.json()] == [p2, p1]
+    assert r.headers["x-recommendations-source"] == "llm"
+    assert r.headers["x-recommendations-computed-at"] >= first.headers["x-recommendations-computed-at"]
+    r = client.get(f"/users/{uid}/properties")
+    assert [prop["id"] for prop in r.json()] == [p2, p1]
+    assert r.headers["x-recommendations-source"] == "precomputed"
+
+def test_writes_succeed_while_recommendations_refresh(tmp_path, monkeypatch):
+    import httpx
+    import database
+    # A file database with the production pragmas (WAL, busy_timeout), like the server
+    engine = database.build_async_engine(f"sqlite:///{tmp_path / 'refresh.db'}", profile="production")
+    Session = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    monkeypatch.setitem(app.dependency_overrides, get_db, async_session_override(engine))
+    monkeypatch.setitem(app.dependency_overrides, get_read_db, async_session_override(engine))
+    monkeypatch.setitem(app.dependency_overrides, get_llm_client, lambda: (None, "mock-model", "mock-provider"))
+    monkeypatch.setattr("api_endpoints.RecommendationSession", Session)
+    async def slow_completion(*a, **k):
+        await asyncio.sleep(0.01)
+        return "[1, 2]"
+    monkeypatch.setattr("api_endpoints.get_completion_async", slow_completion)
+    interests = ["hiking", "surfing", "skiing", "food", "music", "art", "museum", "beach"]
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(models.init_db)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            for i in range(3):
+                await ac.post("/properties/", json=create_property_dict(name=f"P{i}"))
+            users = await ac.post("/users/bulk", json=[
+                create_user_dict(email=f"u{i}@e.com", interests=[interests[i % 8], interests[i // 8]])
+                for i in range(40)
+            ])
+            uids = [user["id"] for user in users.json()["created"]]
+            # One LLM call and one store per interest set, interleaved with writes
+            refresh = asyncio.ensure_future(recommendation_worker.drain())
+            writes = []
+            for i, uid in enumerate(uids):
+                writes.append(ac.put(f"/users/{uid}", json={"name": f"Renamed {i}"}))
+                writes.append(ac.post("/reservations/", json=create_reservation_dict(
+                    uid, 1 + i % 3, f"2030-{1 + i // 4:02d}-{1 + 7 * (i % 4):02d}", f"2030-{1 + i // 4:02d}-{5 + 7 * (i % 4):02d}")))
+            responses = await asyncio.gather(*writes)
+            await refresh
+            async with Session() as db:
+                stored = await db.scalar(select(func.count(func.distinct(models.UserRecommendation.user_id))))
+        await engine.dispose()
+        return responses, stored
+    responses, stored = asyncio.run(run())
+    assert [r.status_code for r in responses if r.status_code >= 300] == []
+    assert recommendation_worker.stats()["failures"] == 0
+    assert stored == 40
+
+def test_recommendation_store_waits_out_a_held_write_lock(tmp_path, monkeypatch):
+    import database
+    import api_endpoints
+    # busy_timeout far shorter than the lock is held, so only the retries get through
+    monkeypatch.setitem(database.SQLITE_PRODUCTION_PRAGMAS, "busy_timeout", 20)
+    monkeypatch.setattr("api_endpoints.RECOMMENDATION_STORE_RETRY_DELAYS", (0.1, 0.1, 0.2, 0.4))
+    engine = database.build_async_engine(f"sqlite:///{tmp_path / 'locked.db'}", profile="production")
+    Session = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    monkeypatch.setattr("api_endpoints.RecommendationSession", Session)
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(models.init_db)
+        async with engine.connect() as blocker:
+            await blocker.execute(text("BEGIN IMMEDIATE"))
+            store = asyncio.ensure_future(api_endpoints.save_recommendations({1: [3, 2]}, api_endpoints.utc_now()))
+            await asyncio.sleep(0.3)
+            assert not store.done()
+            await blocker.rollback()
+        await store
+        async with Session() as db:
+            stored = list(await db.scalars(
+                select(models.UserRecommendation.property_id).order_by(models.UserRecommendation.rank)
+            ))
+        await engine.dispose()
+        return stored
+    assert asyncio.run(run()) == [3, 2]
+
+def test_single_flight_shares_one_call_and_its_errors():
+    from recommendation_cache import SingleFlight
+    flight = SingleFlight()
+    calls = []
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if len(calls) == 2:
+            raise ValueError("bad completion")
+        return [1, 2]
+    async def burst():
+        return await asyncio.gather(*(flight.do("key", compute) for _ in range(5)), return_exceptions=True)
+    assert asyncio.run(burst()) == [[1, 2]] * 5
+    assert flight.stats() == {"in_flight": 0, "waiters": 0, "calls": 1, "coalesced": 4}
+    # Errors reach every waiter and are not remembered
+    results = asyncio.run(burst())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert asyncio.run(flight.do("key", compute)) == [1, 2]
+    assert len(calls) == 3
+
+def test_concurrent_recommendation_misses_share_one_llm_call(client, monkeypatch):
+    import httpx
+    calls = []
+    async def slow_completion(*a, **k):
+        calls.append(a)
+        await asyncio.sleep(0.05)
+        return "[1]"
+    monkeypatch.setattr("api_endpoints.get_completion_async", slow_completion)
+    client.post("/properties/", json=create_property_dict(name="A"))
+    uids = [client.post("/users/", json=create_user_dict(email=f"u{i}@e.com")).json()["id"] for i in range(4)]
+    async def burst():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(*(ac.get(f"/users/{uid}/properties") for uid in uids))
+    responses = asyncio.run(burst())
+    assert [r.json()[0]["id"] for r in responses] == [1] * 4
+    assert len(calls) == 1
+    assert recommendation_flight.stats()["coalesced"] == 3
+    assert "recommendation_singleflight_coalesced_total 3" in client.get("/metrics").text
+
+class FakeLLMClient:
+    """Stand-in provider client: answers `text` after `latency` seconds, or raises the next queued error."""
+    def __init__(self, latency=0.0, text="[1]", errors=()):
+        self.latency = latency
+        self.text = text
+        self.errors = list(errors)
+        self.calls = 0
+        self.cancelled = 0
+
+async def fake_client_completion(prompt, client, model_name, api_provider, temperature=0.7, raise_errors=False):
+    client.calls += 1
+    try:
+        await asyncio.sleep(client.latency)
+    except asyncio.CancelledError:
+        client.cancelled += 1
+        raise
+    if client.errors:
+        raise client.errors.pop(0)
+    return client.text
+
+def test_circuit_breaker_opens_fails_fast_and_probes():
+    from llm_resilience import CircuitBreaker
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    now[0] = 10.0
+    # One probe at a time once the reset timeout has passed
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    now[0] = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow() and breaker.allow()
+
+def test_resilient_llm_retries_on_the_alternate_model():
+    from llm_resilience import ResilientLLM
+    primary = FakeLLMClient(errors=[ConnectionError("reset")])
+    alternate = FakeLLMClient(text="[2]")
+    llm = ResilientLLM(backoff_base=0.01, hedge=False)
+    targets = [(primary, "gpt-4.1-mini", "openai"), (alternate, "claude-3-5-haiku-20241022", "anthropic")]
+    assert asyncio.run(llm.complete("prompt", targets, fake_client_completion)) == "[2]"
+    assert (primary.calls, alternate.calls) == (1, 1)
+    assert llm.stats()["retries"] == 1
+    assert llm.breaker("openai").failures == 1
+
+def test_resilient_llm_hedges_slow_attempts():
+    from llm_resilience import ResilientLLM
+    slow = FakeLLMClient(latency=1.0, text="[1]")
+    fast = FakeLLMClient(latency=0.01, text="[2]")
+    llm = ResilientLLM(hedge_after=0.05)
+    targets = [(slow, "gpt-4.1-mini", "openai"), (fast, "gpt-4.1-nano", "openai")]
+    started = time.perf_counter()
+    assert asyncio.run(llm.complete("prompt", targets, fake_client_completion)) == "[2]"
+    assert time.perf_counter() - started < 0.5
+    assert slow.cancelled == 1
+    assert llm.stats()["hedges"] == 1 and llm.stats()["hedge_wins"] == 1
+    # The losing hedge does not count against the provider
+    assert llm.breaker("openai").failures == 0
+
+def test_resilient_llm_deadline_then_open_breaker_fails_fast():
+    from llm_resilience import CircuitOpenError, CompletionTimeout, ResilientLLM
+    hung = FakeLLMClient(latency=5.0)
+    llm = ResilientLLM(timeout=0.1, hedge=False, breaker_failures=1)
+    targets = [(hung, "gpt-4.1-mini", "openai")]
+    with pytest.raises(CompletionTimeout):
+        asyncio.run(llm.complete("prompt", targets, fake_client_completion))
+    started = time.perf_counter()
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(llm.complete("prompt", targets, fake_client_completion))
+    assert time.perf_counter() - started < 0.05
+    assert hung.calls == 1
+    assert llm.stats()["open_circuits"] == 1
+
+def test_incremental_id_parser_handles_split_chunks():
+    from sse import IncrementalIdParser
+    parser = IncrementalIdParser()
+    chunks = ["```json\nHere are 5: [", "1", "2, \"3", "4\", 7.5, -2", ", 8", "]\n```", "[9]"]
+    assert [parser.feed(chunk) for chunk in chunks] == [[], [], [12], [34], [], [8], []]
+    assert parser.done
+    unterminated = IncrementalIdParser()
+    assert unterminated.feed("[5, 6") == [5]
+    assert unterminated.close() == [6]
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_stream_user_properties_pushes_ids_as_they_complete(client, monkeypatch):
+    p1 = client.post("/properties/", json=create_property_dict(name="A")).json()["id"]
+    p2 = client.post("/properties/", json=create_property_dict(name="B")).json()["id"]
+    async def streaming_completion(*a, **k):
+        for chunk in ["[", str(p2)[:1], str(p2)[1:] + ", 99", "9, ", str(p1), "]"]:
+            yield chunk
+    monkeypatch.setattr("api_endpoints.get_completion_stream_async", streaming_completion)
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    r = client.get(f"/users/{uid}/properties/stream")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(r.text)
+    assert [(e, d["id"]) for e, d in events[:-1]] == [("property", p2), ("property", p1)]
+    assert events[-1] == ("done", {"source": "llm", "count": 2})
+    # The finished ranking is cached for both endpoints
+    assert [p["id"] for p in client.get(f"/users/{uid}/properties").json()] == [p2, p1]
+    events = parse_sse(client.get(f"/users/{uid}/properties/stream").text)
+    assert events[-1] == ("done", {"source": "cache", "count": 2})
+    assert client.get("/users/999/properties/stream").status_code == 404
+
+def test_stream_user_properties_finishes_with_local_engine_on_error(client, monkeypatch):
+    p1 = client.post("/properties/", json=create_property_dict(name="Loft", city="Chicago", state="IL", amenities=["Elevator"]))
+    p2 = client.post("/properties/", json=create_property_dict(name="Chalet", city="Aspen", state="CO", amenities=["Hot Tub"]))
+    p1, p2 = p1.json()["id"], p2.json()["id"]
+    async def failing_stream(*a, **k):
+        yield f"[{p1},"
+        raise ConnectionError("stream reset")
+    monkeypatch.setattr("api_endpoints.get_completion_stream_async", failing_stream)
+    uid = client.post("/users/", json=create_user_dict(interests=["skiing"])).json()["id"]
+    events = parse_sse(client.get(f"/users/{uid}/properties/stream").text)
+    assert [d["id"] for e, d in events if e == "property"] == [p1, p2]
+    assert events[-1] == ("done", {"source": "local", "count": 2})
+    assert recommendation_cache.stats()["size"] == 0
+
+def test_get_completion_stream_async_yields_openai_deltas():
+    import asyncio
+    from types import SimpleNamespace
+    seen = {}
+    def chunk(content=None, usage=None):
+        choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+        return SimpleNamespace(choices=choices, usage=usage)
+    async def stream():
+        for c in [chunk("[1"), chunk(", 2]"), chunk(usage=SimpleNamespace(prompt_tokens=10, completion_tokens=4))]:
+            yield c
+    async def create(**kwargs):
+        seen.update(kwargs)
+        return stream()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    usages = []
+    utils.completion_observers.append(lambda provider, model, seconds, usage, error: usages.append(usage))
+    try:
+        async def collect():
+            return [delta async for delta in utils.get_completion_stream_async("prompt", client, "gpt-4.1-mini", "openai")]
+        assert asyncio.run(collect()) == ["[1", ", 2]"]
+    finally:
+        utils.completion_observers.pop()
+    assert seen["stream"] is True
+    assert usages == [{"input": 10, "output": 4}]
+
+def test_list_users_keyset_pagination(client):
+    ids = [client.post("/users/", json=create_user_dict(name=f"U{i}", email=f"u{i}@e.com")).json()["id"] for i in range(5)]
+    r = client.get("/users/", params={"limit": 2}, headers={"Origin": "http://localhost:5173"})
+    assert [u["id"] for u in r.json()] == ids[:2]
+    cursor = r.headers["X-Next-Cursor"]
+    # Browser clients (the React list) need the cursor exposed to follow it
+    assert "X-Next-Cursor" in r.headers["access-control-expose-headers"]
+    r = client.get("/users/", params={"limit": 2, "after": cursor})
+    assert [u["id"] for u in r.json()] == ids[2:4]
+    r = client.get("/users/", params={"limit": 2, "after": r.headers["X-Next-Cursor"]})
+    assert [u["id"] for u in r.json()] == ids[4:]
+    assert "X-Next-Cursor" not in r.headers
+
+def test_list_properties_filters(client):
+    client.post("/properties/", json={**create_property_dict(name="A", city="Denver", state="CO"), "price_per_night": 80})
+    client.post("/properties/", json={**create_property_dict(name="B", city="Denver", state="CO"), "price_per_night": 200})
+    client.post("/properties/", json={**create_property_dict(name="C", city="Austin", state="TX"), "price_per_night": 150})
+    names = lambda r: sorted(p["name"] for p in r.json())
+    assert names(client.get("/properties/", params={"city": "Denver"})) == ["A", "B"]
+    assert names(client.get("/properties/", params={"state": "TX"})) == ["C"]
+    assert names(client.get("/properties/", params={"min_price": 100, "max_price": 180})) == ["C"]
+    assert client.get("/properties/", params={"limit": 0}).status_code == 422
+
+def test_list_reservations_filters(client):
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    uid2 = client.post("/users/", json=create_user_dict(email="b@e.com")).json()["id"]
+    pid = client.post("/properties/", json=create_property_dict()).json()["id"]
+    client.post("/reservations/", json=create_reservation_dict(uid, pid, "2025-01-01", "2025-01-05"))
+    client.post("/reservations/", json=create_reservation_dict(uid2, pid, "2025-03-01", "2025-03-05"))
+    assert len(client.get("/reservations/", params={"user_id": uid}).json()) == 1
+    assert len(client.get("/reservations/", params={"property_id": pid}).json()) == 2
+    r = client.get("/reservations/", params={"start_date": "2025-01-04", "end_date": "2025-02-01"})
+    assert [res["user_id"] for res in r.json()] == [uid]
+
+def test_list_endpoints_stream_ndjson(client, monkeypatch):
+    monkeypatch.setattr("api_endpoints.NDJSON_BATCH_SIZE", 2)
+    for i in range(5):
+        client.post("/properties/", json=create_property_dict(name=f"P{i}"))
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    pid = client.get("/properties/").json()[0]["id"]
+    client.post("/reservations/", json=create_reservation_dict(uid, pid, "2025-01-01", "2025-01-05"))
+    headers = {"Accept": "application/x-ndjson"}
+
+    r = client.get("/properties/", headers=headers)
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [row["name"] for row in rows] == [f"P{i}" for i in range(5)]
+    assert rows == client.get("/properties/").json()
+
+    r = client.get("/properties/", headers=headers, params={"after": rows[1]["id"], "limit": 2})
+    assert [json.loads(line)["name"] for line in r.text.splitlines()] == ["P2", "P3"]
+
+    users = [json.loads(line) for line in client.get("/users/", headers=headers).text.splitlines()]
+    assert users == client.get("/users/").json()
+    reservations = [json.loads(line) for line in client.get("/reservations/", headers=headers).text.splitlines()]
+    assert reservations == client.get("/reservations/").json()
+
+def test_property_etags_and_conditional_get(client, engine):
+    import query_stats
+    query_stats.instrument_engine(engine)
+    pid = client.post("/properties/", json=create_property_dict()).json()["id"]
+    r = client.get("/properties/")
+    etag = r.headers["etag"]
+    assert etag.startswith('W/"') and r.headers["cache-control"] == "no-cache"
+    assert r.headers["vary"].split(", ")[:2] == ["Accept", "Accept-Encoding"]
+    assert client.get("/properties/", params={"city": "Denver"}).headers["etag"] != etag
+
+    # A matching If-None-Match is answered after reading the catalog version only
+    r = client.get("/properties/", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b"" and r.headers["etag"] == etag
+    assert r.headers["x-db-queries"] == "1"
+    item_etag = client.get(f"/properties/{pid}").headers["etag"]
+    assert client.get(f"/properties/{pid}", headers={"If-None-Match": f'"x", {item_etag[2:]}'}).status_code == 304
+    # `*` matches existing items only
+    assert client.get(f"/properties/{pid}", headers={"If-None-Match": "*"}).status_code == 304
+    assert client.get("/properties/999", headers={"If-None-Match": "*"}).status_code == 404
+
+    # Any property write changes the tags
+    client.put(f"/properties/{pid}", json={"price_per_night": 120.0})
+    r = client.get("/properties/", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["etag"] != etag
+
+def test_catalog_writes_from_other_processes_change_etags_and_indexes(client, engine):
+    client.post("/properties/", json=create_property_dict(name="Ski Lodge", city="Aspen"))
+    uid = client.post("/users/", json=create_user_dict(interests=["skiing"])).json()["id"]
+    client.get(f"/users/{uid}/properties")
+    assert candidate_index.loaded
+    etag = client.get("/properties/").headers["etag"]
+    # Another worker or import_data writes the catalog and bumps the stored version
+    async def write_elsewhere():
+        async with engine.begin() as conn:
+            await conn.execute(models.Property.__table__.insert().values(
+                name="Surf Shack", address_line1="1 Beach Rd", city="San Diego", state="CA",
+                zip_code="92101", country="USA", price_per_night=90.0,
+            ))
+            await conn.run_sync(models.bump_catalog_version)
+    asyncio.run(write_elsewhere())
+    r = client.get("/properties/", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["etag"] != etag
+    assert [p["name"] for p in r.json()] == ["Ski Lodge", "Surf Shack"]
+    # The in-memory indexes did not see that write, so they are rebuilt
+    assert not candidate_index.loaded
+    # Writes made by this process keep them
+    client.get(f"/users/{uid}/properties")
+    client.post("/properties/", json=create_property_dict(name="Chalet"))
+    client.get("/properties/")
+    assert candidate_index.loaded and candidate_index.contains(3)
+
+def test_property_cache_control_is_configurable(client, monkeypatch):
+    monkeypatch.setattr("api_endpoints.PROPERTIES_CACHE_CONTROL", "public, max-age=60")
+    r = client.get("/properties/")
+    assert r.headers["cache-control"] == "public, max-age=60"
+    assert "etag" not in client.get("/properties/999").headers
+
+def test_large_lists_are_compressed(client):
+    for i in range(20):
+        client.post("/properties/", json=create_property_dict(name=f"P{i}"))
+    # Every encoding of the list shares one weak ETag, and Vary names Accept-Encoding once
+    tags = set()
+    for encoding in ("gzip", "br", "identity"):
+        r = client.get("/properties/", headers={"Accept-Encoding": encoding})
+        tags.add(r.headers["etag"])
+        assert r.headers["vary"].split(", ")[:2] == ["Accept", "Accept-Encoding"]
+    assert len(tags) == 1 and tags.pop().startswith("W/")
+    r = client.get("/properties/", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in r.headers["vary"]
+    assert [p["name"] for p in r.json()] == [f"P{i}" for i in range(20)]
+    r = client.get("/properties/", params={"limit": 1}, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers and r.headers["x-next-cursor"]
+
+def test_brotli_is_preferred_when_accepted(client):
+    # httpx decodes br bodies only when brotli is installed
+    pytest.importorskip("brotli")
+    for i in range(20):
+        client.post("/properties/", json=create_property_dict(name=f"P{i}"))
+    r = client.get("/properties/", headers={"Accept-Encoding": "gzip, br"})
+    assert r.headers["content-encoding"] == "br"
+    assert len(r.json()) == 20
+    r = client.get("/properties/", headers={"Accept-Encoding": "gzip, br;q=0"})
+    assert r.headers["content-encoding"] == "gzip"
+
+def test_metrics_endpoint_reports_routes_db_and_cache(client, engine):
+    import re
+    import metrics
+    metrics.instrument_engine(engine)
+    # Metrics are process-wide, so compare against the values before this test
+    route = {"method": "GET", "route": "/users/{user_id}"}
+    not_found = metrics.http_requests.value(status="404", **route)
+    timed = metrics.http_request_duration.count(**route)
+    selects = metrics.db_queries.value(operation="SELECT")
+    client.get("/users/999")
+    client.get("/users/998")
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    client.get(f"/users/{uid}/properties")
+    client.get(f"/users/{uid}/properties")
+    # Labelled by route template, not by the raw path
+    assert metrics.http_requests.value(status="404", **route) == not_found + 2
+    assert metrics.http_request_duration.count(**route) == timed + 2
+    assert metrics.db_queries.value(operation="SELECT") > selects
+
+    r = client.get("/metrics")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    text = r.text
+    assert f'http_requests_total{{method="GET",route="/users/{{user_id}}",status="404"}} {not_found + 2}' in text
+    assert re.search(r'http_request_duration_seconds_bucket\{method="GET",route="/users/\{user_id\}",le="\+Inf"\} \d+', text)
+    assert "# TYPE db_query_duration_seconds histogram" in text
+    assert "recommendation_cache_hits_total 1" in text
+    assert "recommendation_cache_misses_total 1" in text
+
+def test_completion_metrics_per_provider_and_model():
+    from types import SimpleNamespace
+    import metrics
+    async def create(**kwargs):
+        message = SimpleNamespace(content="[3]")
+        usage = SimpleNamespace(prompt_tokens=120, completion_tokens=8)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+    async def fail(**kwargs):
+        raise RuntimeError("rate limited")
+    ok = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    broken = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=fail)))
+    labels = {"provider": "openai", "model": "metrics-test-model"}
+    asyncio.run(utils.get_completion_async("prompt", ok, "metrics-test-model", "openai"))
+    assert "An API error occurred" in asyncio.run(utils.get_completion_async("prompt", broken, "metrics-test-model", "openai"))
+    assert metrics.llm_requests.value(outcome="success", **labels) == 1
+    assert metrics.llm_requests.value(outcome="error", **labels) == 1
+    assert metrics.llm_tokens.value(type="input", **labels) == 120
+    assert metrics.llm_tokens.value(type="output", **labels) == 8
+    assert metrics.llm_request_duration.count(**labels) == 2
+
+def test_db_query_headers_per_request(client, engine):
+    import query_stats
+    query_stats.instrument_engine(engine)
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    pid = client.post("/properties/", json=create_property_dict()).json()["id"]
+    r = client.get(f"/users/{uid}")
+    assert int(r.headers["x-db-queries"]) >= 1
+    assert float(r.headers["x-db-time"]) >= 0
+    # Reference check, write lock, overlap probe and insert
+    r = client.post("/reservations/", json=create_reservation_dict(uid, pid, "2025-01-01", "2025-01-05"))
+    assert r.status_code == 201 and int(r.headers["x-db-queries"]) <= 4
+
+def test_repeated_statements_are_logged_as_n_plus_one(engine, caplog):
+    import query_stats
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+    query_stats.instrument_engine(engine)
+    async def lookup(request):
+        async with engine.connect() as conn:
+            for user_id in (1, 2, 3):
+                await conn.execute(select(models.User.id).filter(models.User.id == user_id))
+            await conn.execute(select(func.count()).select_from(models.User))
+        return PlainTextResponse("ok")
+    test_app = query_stats.QueryStatsMiddleware(Starlette(routes=[Route("/lookup", lookup)]), threshold=2)
+    with caplog.at_level("WARNING", logger="query_stats"):
+        r = TestClient(test_app).get("/lookup")
+    assert r.headers["x-db-queries"] == "4"
+    warnings = [rec.getMessage() for rec in caplog.records if rec.name == "query_stats"]
+    assert len(warnings) == 1
+    assert warnings[0].startswith("Possible N+1: statement ran 3 times in GET /lookup: SELECT")
+
+def test_amenities_and_interests_are_normalized(client, engine):
+    p1 = client.post("/properties/", json=create_property_dict(name="A", amenities=["Hot Tub", "Wi-Fi", "Hot Tub"])).json()
+    p2 = client.post("/properties/", json=create_property_dict(name="B", amenities=["Wi-Fi"])).json()
+    assert p1["amenities"] == ["Hot Tub", "Wi-Fi"] and p2["amenities"] == ["Wi-Fi"]
+    # Tags are shared between rows
+    async def count_amenities():
+        async with engine.connect() as conn:
+            return await conn.scalar(select(func.count()).select_from(models.Amenity))
+    assert asyncio.run(count_amenities()) == 2
+    # Reordering keeps the existing link rows and the new order
+    r = client.put(f"/properties/{p1['id']}", json={"amenities": ["Wi-Fi", "Pool", "Hot Tub"]})
+    assert r.json()["amenities"] == ["Wi-Fi", "Pool", "Hot Tub"]
+    assert client.get(f"/properties/{p1['id']}").json()["amenities"] == ["Wi-Fi", "Pool", "Hot Tub"]
+    names = lambda r: sorted(p["name"] for p in r.json())
+    assert names(client.get("/properties/", params={"amenity": "Wi-Fi"})) == ["A", "B"]
+    assert names(client.get("/properties/", params={"amenity": ["Wi-Fi", "Pool"]})) == ["A"]
+    assert names(client.get("/properties/", params={"amenity": "Sauna"})) == []
+
+    u = client.post("/users/", json=create_user_dict(interests=["hiking", "food"])).json()
+    assert u["interests"] == ["hiking", "food"]
+    client.put(f"/users/{u['id']}", json={"interests": ["food", "surfing"]})
+    assert client.get(f"/users/{u['id']}").json()["interests"] == ["food", "surfing"]
+
+def test_migrate_tags_converts_comma_columns(tmp_path):
+    import migrate_tags
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE Users (id INTEGER PRIMARY KEY, name TEXT NOT NULL, email TEXT NOT NULL UNIQUE, interests TEXT)"))
+        conn.execute(text("CREATE TABLE Properties (id INTEGER PRIMARY KEY, name TEXT NOT NULL, address_line1 TEXT NOT NULL, "
+                          "address_line2 TEXT, city TEXT NOT NULL, state TEXT NOT NULL, zip_code TEXT NOT NULL, "
+                          "country TEXT NOT NULL DEFAULT 'USA', price_per_night REAL NOT NULL, amenities TEXT)"))
+        conn.execute(text("INSERT INTO Users VALUES (1, 'A', 'a@x.com', 'hiking, food'), (2, 'B', 'b@x.com', NULL)"))
+        conn.execute(text("INSERT INTO Properties VALUES (1, 'P', '1 St', NULL, 'Denver', 'CO', '80202', 'USA', 100, 'Wi-Fi,Hot Tub')"))
+    assert migrate_tags.migrate(engine) == (2, 2)
+    assert migrate_tags.migrate(engine) == (0, 0)
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        assert session.get(models.User, 1).interests == ["hiking", "food"]
+        assert session.get(models.User, 2).interests == []
+        assert session.get(models.Property, 1).amenities == ["Wi-Fi", "Hot Tub"]
+
+def test_import_seed_sql(tmp_path):
+    import os
+    import import_data
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session as OrmSession
+    engine = create_engine(f"sqlite:///{tmp_path / 'seed.db'}")
+    seed = os.path.join(os.path.dirname(__file__), "..", "capstone_artifacts", "seed_data.sql")
+    counts, (violations, _) = import_data.import_files(engine, [(seed, "sql", None)], batch_size=7)
+    assert counts == {"Users": 10, "Properties": 100, "Reservations": 5}
+    assert violations == 0
+    with OrmSession(engine) as db:
+        user = db.get(models.User, 1)
+        assert user.interests == ["hiking", "art museums", "food tours"]
+        assert db.get(models.Reservation, 3).check_in_date.isoformat() == "2025-01-10"
+    engine.dispose()
+
+def test_import_csv_and_jsonl_with_index_rebuild(tmp_path):
+    import import_data
+    from sqlalchemy import create_engine, inspect
+    (tmp_path / "users.jsonl").write_text(
+        '{"id": 1, "name": "Ann", "email": "ann@example.com", "interests": ["ski", "spa"]}\n'
+        '{"id": 2, "name": "Bob", "email": "bob@example.com", "interests": "beach, ski"}\n'
+    )
+    (tmp_path / "reservations.csv").write_text(
+        "user_id,property_id,check_in_date,check_out_date,reservation_date\n"
+        "1,1,2025-01-01,2025-01-03,2024-12-01\n"
+        "2,1,2025-02-01,2025-02-03,2024-12-01\n"
+        "3,1,2025-03-01,2025-03-03,2024-12-01\n"
+    )
+    engine = create_engine(f"sqlite:///{tmp_path / 'load.db'}")
+    sources = [
+        import_data._source(str(tmp_path / "users.jsonl")),
+        import_data._source(str(tmp_path / "reservations.csv")),
+    ]
+    counts, (violations, sample) = import_data.import_files(engine, sources, batch_size=2, rebuild_indexes=True)
+    assert counts == {"Users": 2, "Reservations": 3}
+    # No Properties were loaded and user 3 does not exist
+    assert violations == 4 and sample[0][0] == "Reservations"
+    indexes = {i["name"] for i in inspect(engine).get_indexes("Reservations")}
+    assert "ix_Reservations_property_id_dates" in indexes
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM Interests").scalar() == 3
+    engine.dispose()
+
+def test_import_reports_the_row_that_violates_a_constraint(tmp_path):
+    import os, subprocess, sys
+    import import_data
+    from sqlalchemy import create_engine
+    (tmp_path / "users.jsonl").write_text("".join(
+        f'{{"name": "U{i}", "email": "{email}", "interests": ["ski"]}}\n'
+        for i, email in enumerate(["a@x.com", "b@x.com", "c@x.com", "a@x.com", "d@x.com"])
+    ))
+    engine = create_engine(f"sqlite:///{tmp_path / 'load.db'}")
+    with pytest.raises(import_data.RowError) as excinfo:
+        import_data.import_files(engine, [import_data._source(str(tmp_path / "users.jsonl"))], batch_size=2)
+    assert (excinfo.value.table, excinfo.value.row) == ("Users", 4)
+    assert "UNIQUE" in str(excinfo.value) and "a@x.com" in str(excinfo.value)
+    # The batch before it is committed, the failing one is not
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM Users").scalar() == 2
+    engine.dispose()
+    result = subprocess.run(
+        [sys.executable, "import_data.py", str(tmp_path / "users.jsonl"), "--batch-size", "2",
+         "--database-url", f"sqlite:///{tmp_path / 'cli.db'}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+    )
+    assert result.returncode == 1
+    assert "Traceback" not in result.stderr and "Users row 4" in result.stderr
+
+def test_import_bumps_the_catalog_version_and_clears_stored_rankings(tmp_path):
+    from datetime import datetime
+    import import_data
+    from sqlalchemy import create_engine
+    engine = create_engine(f"sqlite:///{tmp_path / 'load.db'}")
+    models.init_db(engine)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert().values(id=1, name="A", email="a@x.com"))
+        conn.execute(models.Property.__table__.insert().values(
+            id=1, name="P", address_line1="1 St", city="Denver", state="CO", zip_code="80202",
+            country="USA", price_per_night=100.0,
+        ))
+        conn.execute(models.UserRecommendation.__table__.insert().values(
+            user_id=1, rank=0, property_id=1, computed_at=datetime(2025, 1, 1),
+        ))
+        epoch, version = models.bump_catalog_version(conn)
+    (tmp_path / "properties.jsonl").write_text(
+        '{"name": "Q", "address_line1": "2 St", "city": "Aspen", "state": "CO", "zip_code": "81611", '
+        '"price_per_night": 200, "amenities": ["Hot Tub"]}\n'
+    )
+    import_data.import_files(engine, [import_data._source(str(tmp_path / "properties.jsonl"))])
+    with engine.connect() as conn:
+        assert models.read_catalog_state(conn) == (epoch, version + 1)
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM UserRecommendations").scalar() == 0
+    engine.dispose()
+
+def test_available_properties(client):
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    a = client.post("/properties/", json={**create_property_dict(name="A", city="Denver"), "price_per_night": 90}).json()["id"]
+    b = client.post("/properties/", json={**create_property_dict(name="B", city="Denver"), "price_per_night": 300}).json()["id"]
+    c = client.post("/properties/", json=create_property_dict(name="C", city="Austin")).json()["id"]
+    client.post("/reservations/", json=create_reservation_dict(uid, a, "2025-06-01", "2025-06-05"))
+    client.post("/reservations/", json=create_reservation_dict(uid, c, "2025-06-10", "2025-06-12"))
+    ids = lambda r: [p["id"] for p in r.json()]
+    # Overlaps A's stay only
+    assert ids(client.get("/properties/available", params={"check_in": "2025-06-04", "check_out": "2025-06-08"})) == [b, c]
+    # Back-to-back stays do not conflict
+    assert ids(client.get("/properties/available", params={"check_in": "2025-06-05", "check_out": "2025-06-10"})) == [a, b, c]
+    # Combined with city and price filters
+    r = client.get("/properties/available", params={"check_in": "2025-06-01", "check_out": "2025-06-02", "city": "Denver", "max_price": 200})
+    assert ids(r) == []
+    r = client.get("/properties/available", params={"check_in": "2025-06-01", "check_out": "2025-06-02", "city": "Denver"})
+    assert ids(r) == [b]
+    assert client.get("/properties/available", params={"check_in": "2025-06-05", "check_out": "2025-06-01"}).status_code == 400
+
+def test_reservation_conflicts_return_409(client):
+    uid = client.post("/users/", json=create_user_dict()).json()["id"]
+    pid = client.post("/properties/", json=create_property_dict()).json()["id"]
+    other = client.post("/properties/", json=create_property_dict(name="Other")).json()["id"]
+    first = client.post("/reservations/", json=create_reservation_dict(uid, pid, "2025-01-01", "2025-01-05")).json()["id"]
+    r = client.post("/reservations/", json=create_reservation_dict(uid, pid, "2025-01-04", "2025-01-08"))
+    assert r.status_code == 409
+    # Checking in on the day the previous guest checks out is fine
+    second = client.post("/reservations/", json=create_reservation_dict(uid, pid, "2025-01-05", "2025-01-08"))
+    assert second.status_code == 201
+    # Moving a stay onto another booking conflicts; moving within its own dates does not
+    r = client.put(f"/reservations/{second.json()['id']}", json={"check_in_date": "2025-01-03"})
+    assert r.status_code == 409
+    r = client.put(f"/reservations/{first}", json={"check_in_date": "2025-01-02"})
+    assert r.status_code == 200
+    client.post("/reservations/", json=create_reservation_dict(uid, other, "2025-01-01", "2025-01-05"))
+    r = client.put(f"/reservations/{first}", json={"property_id": other})
+    assert r.status_code == 409
+
+def test_concurrent_bookings_never_double_book(tmp_path):
+    import threading
+    # Every request thread runs its own event loop, so each session gets its own connection
+    engine = create_test_engine(f"sqlite+aiosqlite:///{tmp_path / 'book.db'}", poolclass=NullPool)
+    app.dependency_overrides[get_db] = async_session_override(engine)
+    try:
+        client = TestClient(app)
+        uid = client.post("/users/", json=create_user_dict()).json()["id"]
+        pid = client.post("/properties/", json=create_property_dict()).json()["id"]
+        statuses = []
+        def book():
+            r = client.post("/reservations/", json=create_reservation_dict(uid, pid, "2025-01-01", "2025-01-05"))
+            statuses.append(r.status_code)
+        threads = [threading.Thread(target=book) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        app.dependency_overrides.clear()
+    assert sorted(statuses) == [201] + [409] * 7
+
+def test_concurrent_writes_with_the_same_new_tags(tmp_path):
+    import threading
+    engine = create_test_engine(f"sqlite+aiosqlite:///{tmp_path / 'tags.db'}", poolclass=NullPool)
+    app.dependency_overrides[get_db] = async_session_override(engine)
+    try:
+        client = TestClient(app)
+        statuses = []
+        def create(i):
+            r = client.post("/users/", json=create_user_dict(email=f"u{i}@e.com", interests=["kayaking", "birding"]))
+            statuses.append(r.status_code)
+            r = client.post("/properties/", json=create_property_dict(name=f"P{i}", amenities=["Sauna", "Dock"]))
+            statuses.append(r.status_code)
+        threads = [threading.Thread(target=create, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        app.dependency_overrides.clear()
+    assert statuses == [201] * 16
+    async def count(model):
+        async with engine.connect() as conn:
+            return await conn.scalar(select(func.count()).select_from(model))
+    assert (asyncio.run(count(models.Interest)), asyncio.run(count(models.Amenity))) == (2, 2)
+
+def test_sqlite_production_profile_pragmas(tmp_path):
+    from sqlalchemy.exc import OperationalError
+    import database
+    url = f"sqlite:///{tmp_path / 'prod.db'}"
+    write_engine = database.build_engine(url, profile="production")
+    read_engine = database.build_engine(url, read_only=True, profile="production")
+    models.init_db(write_engine)
+    with write_engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == database.SQLITE_PRODUCTION_PRAGMAS["busy_timeout"]
+        assert conn.execute(text("PRAGMA temp_store")).scalar() == 2  # MEMORY
+    with read_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM Users")).scalar() == 0
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO Users (name, email) VALUES ('a', 'a@x.com')"))
+    write_engine.dispose()
+    read_engine.dispose()
+
+def test_bulk_create_users_reports_errors_by_index(client):
+    client.post("/users/", json=create_user_dict(email="taken@example.com"))
+    items = [
+        create_user_dict(name="A", email="a@example.com", interests=["beach", "food"]),
+        create_user_dict(name="B", email="TAKEN@example.com"),
+        {"name": "C"},
+        create_user_dict(name="D", email="a@example.com"),
+        create_user_dict(name="E", email="e@example.com", interests=["beach", "ski"]),
+    ]
+    r = client.post("/users/bulk", json=items)
+    assert r.status_code == 200
+    body = r.json()
+    assert [u["name"] for u in body["created"]] == ["A", "E"]
+    assert [e["index"] for e in body["errors"]] == [1, 2, 3]
+    assert body["errors"][0]["detail"] == "Email already registered"
+    user = client.get(f"/users/{body['created'][1]['id']}").json()
+    assert user["interests"] == ["beach", "ski"]
+
+def test_bulk_create_properties_and_reservations(client):
+    u = client.post("/users/", json=create_user_dict()).json()
+    r = client.post("/properties/bulk", json=[create_property_dict(name="P1"), create_property_dict(name="P2", amenities=["pool"])])
+    assert r.status_code == 200
+    p1, p2 = r.json()["created"]
+    assert client.get(f"/properties/{p2['id']}").json()["amenities"] == ["pool"]
+    items = [
+        create_reservation_dict(u["id"], p1["id"], "2025-03-01", "2025-03-05"),
+        create_reservation_dict(u["id"], p1["id"], "2025-03-04", "2025-03-06"),  # overlaps the first
+        create_reservation_dict(u["id"], p2["id"], "2025-03-01", "2025-03-05"),
+        create_reservation_dict(999, p2["id"], "2025-04-01", "2025-04-05"),
+        create_reservation_dict(u["id"], p2["id"], "2025-04-05", "2025-04-01"),
+    ]
+    r = client.post("/reservations/bulk", json=items)
+    assert r.status_code == 200
+    body = r.json()
+    assert len(body["created"]) == 2
+    assert [e["index"] for e in body["errors"]] == [1, 3, 4]
+    # Conflicts with already stored reservations are caught too
+    r = client.post("/reservations/bulk", json=[create_reservation_dict(u["id"], p2["id"], "2025-03-02", "2025-03-03")])
+    assert r.json()["created"] == [] and r.json()["errors"][0]["index"] == 0
+    assert len(client.get("/reservations/").json()) == 2
+
+def test_bulk_create_statement_count_does_not_grow_with_batch_size(client, engine):
+    import query_stats
+    query_stats.instrument_engine(engine)
+    client.post("/properties/", json=create_property_dict(name="existing"))
+    r = client.post("/properties/bulk", json=[create_property_dict(name=f"P{i}") for i in range(200)])
+    ids = [p["id"] for p in r.json()["created"]]
+    assert ids == list(range(2, 202))
+    # Lock, MAX(id), one executemany for the rows, tag lookup and one for the
+    # links, then the catalog version bump (update, read back)
+    assert int(r.headers["x-db-queries"]) <= 8
+    assert client.get("/properties/201").json()["name"] == "P199"
+    r = client.post("/users/bulk", json=[create_user_dict(email=f"u{i}@example.com") for i in range(200)])
+    # Plus the email probe and inserting new interest tags
+    assert len(r.json()["created"]) == 200 and int(r.headers["x-db-queries"]) <= 8
+    uid = r.json()["created"][-1]["id"]
+    items = [create_reservation_dict(uid, pid, "2025-03-01", "2025-03-05") for pid in ids]
+    r = client.post("/reservations/bulk", json=items)
+    assert len(r.json()["created"]) == 200 and int(r.headers["x-db-queries"]) <= 8
+
+def test_bulk_create_rejects_oversized_batches(client, monkeypatch):
+    monkeypatch.setattr("api_endpoints.MAX_BULK_ITEMS", 2)
+    r = client.post("/properties/bulk", json=[create_property_dict()] * 3)
+    assert r.status_code == 400
+
+def test_bulk_insert_ids_never_reuse_autoincrement_ids():
+    from sqlalchemy import Column, Integer, String
+    from sqlalchemy.orm import declarative_base
+    from api_endpoints import bulk_insert_ids
+    Base = declarative_base()
+    class Counter(Base):
+        __tablename__ = "Counters"
+        id = Column(Integer, primary_key=True)
+        name = Column(String)
+    async def run():
+        engine = create_async_engine(TEST_DATABASE_URL, poolclass=StaticPool)
+        async with engine.begin() as conn:
+            # Declared like the tables of the original travel.db, not like the model
+            await conn.execute(text("CREATE TABLE Counters (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT)"))
+        Session = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with Session() as db:
+            assert await bulk_insert_ids(db, Counter, [{"name": "a"}, {"name": "b"}, {"name": "c"}]) == [1, 2, 3]
+            await db.commit()
+            await db.execute(Counter.__table__.delete().where(Counter.id == 3))
+            await db.commit()
+            ids = await bulk_insert_ids(db, Counter, [{"name": "d"}, {"name": "e"}])
+            await db.commit()
+            sequence = await db.scalar(text("SELECT seq FROM sqlite_sequence WHERE name = 'Counters'"))
+        await engine.dispose()
+        return ids, sequence
+    assert asyncio.run(run()) == ([4, 5], 5)
+
 # ---------- EDGE CASE TESTS ----------
 
 def test_create_user_duplicate_email(client):
@@ -11,6 +11,8 @@ from PIL import Image
 from io import BytesIO
 import re
 import base64
+import threading
+import time
 
 # --- Dynamic Library Installation ---
 try:
@@ -82,6 +84,16 @@ def load_environment():
 def setup_llm_client(model_name="gpt-4o"):
     """Initializes and returns the API client for the specified model provider."""
     load_environment()
+    return _create_llm_client(model_name)
+
+
+def _create_llm_client(model_name, asynchronous=False):
+    """Builds the API client for a model, assuming the environment is already loaded.
+
+    With asynchronous=True the provider's asyncio client is returned instead
+    (AsyncOpenAI, AsyncAnthropic, AsyncInferenceClient); Gemini models expose
+    both interfaces on the same object.
+    """
     if model_name not in RECOMMENDED_MODELS:
         print(f"ERROR: Model '{model_name}' is not in the list of recommended models.")
         return None, None, None
@@ -90,20 +102,21 @@ def setup_llm_client(model_name="gpt-4o"):
     client = None
     try:
         if api_provider == "openai":
-            from openai import OpenAI
+            from openai import OpenAI, AsyncOpenAI
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key: raise ValueError("OPENAI_API_KEY not found in .env file.")
-            client = OpenAI(api_key=api_key)
+            client = AsyncOpenAI(api_key=api_key) if asynchronous else OpenAI(api_key=api_key)
         elif api_provider == "anthropic":
-            from anthropic import Anthropic
+            from anthropic import Anthropic, AsyncAnthropic
             api_key = os.getenv("ANTHROPIC_API_KEY")
             if not api_key: raise ValueError("ANTHROPIC_API_KEY not found in .env file.")
-            client = Anthropic(api_key=api_key)
+            client = AsyncAnthropic(api_key=api_key) if asynchronous else Anthropic(api_key=api_key)
         elif api_provider == "huggingface":
-            from huggingface_hub import InferenceClient
+            from huggingface_hub import InferenceClient, AsyncInferenceClient
             api_key = os.getenv("HUGGINGFACE_API_KEY")
             if not api_key: raise ValueError("HUGGINGFACE_API_KEY not found in .env file.")
-            client = InferenceClient(model=model_name, token=api_key)
+            client_class = AsyncInferenceClient if asynchronous else InferenceClient
+            client = client_class(model=model_name, token=api_key)
         elif api_provider == "gemini":
             import google.generativeai as genai
             api_key = os.getenv("GOOGLE_API_KEY")
@@ -119,11 +132,126 @@ def setup_llm_client(model_name="gpt-4o"):
     print(f"✅ LLM Client configured: Using '{api_provider}' with model '{model_name}'")
     return client, model_name, api_provider
 
+
+class LLMClientRegistry:
+    """Process-wide cache of LLM clients, one per (provider, model).
+
+    Each client is built once and then shared, so its HTTP connection pool stays
+    warm across requests and the environment is only loaded the first time.
+    Failed setups are not cached, so a missing API key can be fixed without a restart.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._environment_loaded = False
+
+    def get(self, model_name, asynchronous=False):
+        """Returns (client, model_name, api_provider) for the model, building it on first use."""
+        provider = RECOMMENDED_MODELS.get(model_name, {}).get("provider")
+        key = (provider, model_name, asynchronous)
+        entry = self._clients.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                return entry
+            if not self._environment_loaded:
+                load_environment()
+                self._environment_loaded = True
+            entry = _create_llm_client(model_name, asynchronous=asynchronous)
+            if entry[0] is not None:
+                self._clients[key] = entry
+            return entry
+
+    def warm(self, model_names, preconnect=True):
+        """Builds clients ahead of time and optionally opens their first connection."""
+        for model_name in model_names:
+            client, model_name, api_provider = self.get(model_name)
+            if client is None or not preconnect:
+                continue
+            try:
+                # A cheap metadata call pays the TLS handshake now and leaves a
+                # keep-alive connection in the client's pool.
+                if api_provider in ("openai", "anthropic"):
+                    client.models.retrieve(model_name)
+            except Exception as e:
+                print(f"Warning: could not pre-connect '{model_name}': {e}")
+
+    async def warm_async(self, model_names, preconnect=True):
+        """Same as warm(), for the asyncio clients."""
+        for model_name in model_names:
+            client, model_name, api_provider = self.get(model_name, asynchronous=True)
+            if client is None or not preconnect:
+                continue
+            try:
+                if api_provider in ("openai", "anthropic"):
+                    await client.models.retrieve(model_name)
+            except Exception as e:
+                print(f"Warning: could not pre-connect '{model_name}': {e}")
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._environment_loaded = False
+
+
+llm_clients = LLMClientRegistry()
+
+# --- Completion Observers ---
+# Callables appended here are called after every get_completion /
+# get_completion_async call as observer(api_provider, model_name, seconds, usage, error),
+# where usage is {"input": n, "output": n}, plus "cached": n for input tokens
+# read from the provider's prompt cache (or None if the provider did not
+# report usage) and error is the exception, or None on success.
+completion_observers = []
+
+def _token_usage(response):
+    usage = getattr(response, "usage", None) or getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    def first(*names):
+        for name in names:
+            value = getattr(usage, name, None)
+            if value is not None:
+                return value
+        return None
+    counts = {
+        "input": first("prompt_tokens", "input_tokens", "prompt_token_count"),
+        "output": first("completion_tokens", "output_tokens", "candidates_token_count"),
+    }
+    # Input tokens served from the provider's prompt cache, when reported
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = first("cache_read_input_tokens", "cached_content_token_count")
+    if cached is not None:
+        counts["cached"] = cached
+    return counts
+
+def _notify_completion(api_provider, model_name, started, response, error):
+    seconds = time.perf_counter() - started
+    usage = _token_usage(response) if response is not None else None
+    for observer in completion_observers:
+        try:
+            observer(api_provider, model_name, seconds, usage, error)
+        except Exception as e:
+            print(f"Warning: completion observer failed: {e}")
+
 # --- Core Interaction Functions ---
 
-def get_completion(prompt, client, model_name, api_provider, temperature=0.7):
-    """Gets a text completion from the specified LLM."""
-    if not client: return "API client not initialized."
+def get_completion(prompt, client, model_name, api_provider, temperature=0.7, raise_errors=False):
+    """Gets a text completion from the specified LLM.
+
+    Errors are returned as an "An API error occurred: ..." string unless
+    raise_errors is True, in which case the provider's exception is raised.
+    """
+    if not client:
+        if raise_errors: raise ValueError("API client not initialized.")
+        return "API client not initialized."
+    started = time.perf_counter()
+    response = error = None
     try:
         if api_provider == "openai":
             response = client.chat.completions.create(model=model_name, messages=[{"role": "user", "content": prompt}], temperature=temperature)
@@ -142,8 +270,139 @@ def get_completion(prompt, client, model_name, api_provider, temperature=0.7):
         elif api_provider == "gemini":
             response = client.generate_content(prompt)
             return response.text
+        else:
+            raise ValueError(f"Unsupported provider: {api_provider}")
     except Exception as e:
+        error = e
+        if raise_errors: raise
         return f"An API error occurred: {e}"
+    finally:
+        _notify_completion(api_provider, model_name, started, response, error)
+
+async def get_completion_async(prompt, client, model_name, api_provider, temperature=0.7, raise_errors=False):
+    """Gets a text completion from the specified LLM using the provider's asyncio client.
+
+    The client must come from _create_llm_client(..., asynchronous=True) or
+    LLMClientRegistry.get(..., asynchronous=True). Waiting on the response does not
+    hold a thread, so many completions can be in flight at once. raise_errors
+    works as in get_completion().
+    """
+    if not client:
+        if raise_errors: raise ValueError("API client not initialized.")
+        return "API client not initialized."
+    started = time.perf_counter()
+    response = error = None
+    try:
+        if api_provider == "openai":
+            response = await client.chat.completions.create(model=model_name, messages=[{"role": "user", "content": prompt}], temperature=temperature)
+            return response.choices[0].message.content
+        elif api_provider == "anthropic":
+            response = await client.messages.create(
+                model=model_name,
+                max_tokens=4096,
+                temperature=temperature,
+                messages=[{"role": "user", "content": prompt}]
+            )
+            return response.content[0].text
+        elif api_provider == "huggingface":
+            response = await client.chat_completion(messages=[{"role": "user", "content": prompt}], temperature=max(0.1, temperature), max_tokens=4096)
+            return response.choices[0].message.content
+        elif api_provider == "gemini":
+            response = await client.generate_content_async(prompt)
+            return response.text
+        else:
+            raise ValueError(f"Unsupported provider: {api_provider}")
+    except Exception as e:
+        error = e
+        if raise_errors: raise
+        return f"An API error occurred: {e}"
+    finally:
+        _notify_completion(api_provider, model_name, started, response, error)
+
+# --- Streaming Completions ---
+# Both generators yield the text as the provider produces it. Unlike
+# get_completion, errors are raised: part of the answer may already have been
+# consumed, so it cannot be replaced by an error message.
+
+class _StreamUsage:
+    """Token usage collected from the final chunk(s) of a stream, for the observers."""
+    def __init__(self):
+        self.usage = None
+
+    def update(self, chunk):
+        usage = getattr(chunk, "usage", None) or getattr(chunk, "usage_metadata", None)
+        if usage:
+            self.usage = usage
+
+def get_completion_stream(prompt, client, model_name, api_provider, temperature=0.7):
+    """Streams a text completion from the specified LLM, one text delta at a time."""
+    if not client: raise ValueError("API client not initialized.")
+    started = time.perf_counter()
+    response, error = _StreamUsage(), None
+    messages = [{"role": "user", "content": prompt}]
+    try:
+        if api_provider == "openai":
+            stream = client.chat.completions.create(model=model_name, messages=messages, temperature=temperature,
+                                                    stream=True, stream_options={"include_usage": True})
+            for chunk in stream:
+                response.update(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        elif api_provider == "anthropic":
+            with client.messages.stream(model=model_name, max_tokens=4096, temperature=temperature, messages=messages) as stream:
+                yield from stream.text_stream
+                response.update(stream.get_final_message())
+        elif api_provider == "huggingface":
+            for chunk in client.chat_completion(messages=messages, temperature=max(0.1, temperature), max_tokens=4096, stream=True):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        elif api_provider == "gemini":
+            for chunk in client.generate_content(prompt, stream=True):
+                response.update(chunk)
+                yield chunk.text
+        else:
+            raise ValueError(f"Unsupported provider: {api_provider}")
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _notify_completion(api_provider, model_name, started, response, error)
+
+async def get_completion_stream_async(prompt, client, model_name, api_provider, temperature=0.7):
+    """Same as get_completion_stream(), for the asyncio clients."""
+    if not client: raise ValueError("API client not initialized.")
+    started = time.perf_counter()
+    response, error = _StreamUsage(), None
+    messages = [{"role": "user", "content": prompt}]
+    try:
+        if api_provider == "openai":
+            stream = await client.chat.completions.create(model=model_name, messages=messages, temperature=temperature,
+                                                          stream=True, stream_options={"include_usage": True})
+            async for chunk in stream:
+                response.update(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        elif api_provider == "anthropic":
+            async with client.messages.stream(model=model_name, max_tokens=4096, temperature=temperature, messages=messages) as stream:
+                async for text in stream.text_stream:
+                    yield text
+                response.update(await stream.get_final_message())
+        elif api_provider == "huggingface":
+            stream = await client.chat_completion(messages=messages, temperature=max(0.1, temperature), max_tokens=4096, stream=True)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        elif api_provider == "gemini":
+            async for chunk in await client.generate_content_async(prompt, stream=True):
+                response.update(chunk)
+                yield chunk.text
+        else:
+            raise ValueError(f"Unsupported provider: {api_provider}")
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _notify_completion(api_provider, model_name, started, response, error)
 
 def get_vision_completion(prompt, image_url, client, model_name, api_provider):
     """Gets a vision-enhanced completion from the specified LLM."""
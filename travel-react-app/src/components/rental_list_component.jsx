@@ -22,6 +22,22 @@ PropertyRow.propTypes = {
   }).isRequired
 };
 
+// List endpoints return one page at a time; the next page's cursor comes in
+// the X-Next-Cursor header, so keep fetching with ?after= until it is absent.
+const fetchAllPages = async (apiUrl) => {
+  const rows = [];
+  let cursor = null;
+  do {
+    const url = new URL(apiUrl);
+    if (cursor !== null) url.searchParams.set("after", cursor);
+    const res = await fetch(url);
+    if (!res.ok) throw new Error("Failed to fetch properties");
+    rows.push(...(await res.json()));
+    cursor = res.headers.get("X-Next-Cursor");
+  } while (cursor !== null);
+  return rows;
+};
+
 // Main Table Component
 const PropertyTable = ({ apiUrl }) => {
   const [properties, setProperties] = useState([]);
@@ -29,11 +45,7 @@ const PropertyTable = ({ apiUrl }) => {
   const [error, setError] = useState("");
 
   useEffect(() => {
-    fetch(apiUrl)
-      .then((res) => {
-        if (!res.ok) throw new Error("Failed to fetch properties");
-        return res.json();
-      })
+    fetchAllPages(apiUrl)
       .then((data) => {
         setProperties(data);
         setLoading(false);